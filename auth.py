@@ -4,11 +4,16 @@ import datetime
 import os
 import uuid
 import hashlib
+import threading
+import time
+from contextlib import contextmanager
 from functools import wraps
-from flask import request, jsonify, g
+from flask import request, jsonify, g, has_app_context
 from flask_restx import abort, Resource, fields
 from dotenv import load_dotenv
 from dbutils.pooled_db import PooledDB
+from utils.pagination import page_params, keyset_filter, keyset_page, cached_count, invalidate_count, pagination
+from utils import change_log
 
 # Load environment variables
 load_dotenv()
@@ -18,50 +23,336 @@ SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-for-dev')
 # Token expiration time (in minutes)
 TOKEN_EXPIRATION = 60  # 1 hour
 
+# Connection pool sizing (override via environment for larger deployments)
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get('DB_POOL_MAX_CONNECTIONS', 10))
+DB_POOL_MIN_CACHED = int(os.environ.get('DB_POOL_MIN_CACHED', 2))
+DB_POOL_MAX_CACHED = int(os.environ.get('DB_POOL_MAX_CACHED', 5))
+# Block (and measure the wait) instead of failing when every connection is checked out
+DB_POOL_BLOCKING = os.environ.get('DB_POOL_BLOCKING', 'true').lower() in ('1', 'true', 'yes')
+
+# Optional read replicas as a comma-separated list, e.g. "replica1:3306,replica2"
+DB_REPLICA_HOSTS = os.environ.get('DB_REPLICA_HOSTS', '')
+# Seconds a failed replica stays out of rotation before it is tried again
+DB_REPLICA_RETRY_SECONDS = int(os.environ.get('DB_REPLICA_RETRY_SECONDS', 30))
+# Seconds between background replica health checks (0 disables them)
+DB_REPLICA_HEALTH_INTERVAL = int(os.environ.get('DB_REPLICA_HEALTH_INTERVAL', 15))
+
+def create_pool(host, port, **overrides):
+    """Create a connection pool for a MySQL host using the configured sizing."""
+    settings = {
+        'maxconnections': DB_POOL_MAX_CONNECTIONS,
+        'mincached': DB_POOL_MIN_CACHED,
+        'maxcached': DB_POOL_MAX_CACHED,
+        'blocking': DB_POOL_BLOCKING,
+    }
+    settings.update(overrides)
+    return PooledDB(creator=pymysql, **connection_arguments(host, port), **settings)
+
+def connection_arguments(host, port):
+    """pymysql.connect arguments for a MySQL host."""
+    return {
+        'host': host,
+        'user': os.environ.get('DB_USER'),
+        'password': os.environ.get('DB_PASSWORD'),
+        'database': os.environ.get('DB_NAME'),
+        'port': port,
+        'charset': 'utf8mb4',
+        'cursorclass': pymysql.cursors.DictCursor,
+    }
+
+def parse_hosts(value, default_port=3306):
+    """Parse a comma-separated "host[:port]" list into (host, port) tuples."""
+    hosts = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(':')
+        hosts.append((host, int(port) if port else default_port))
+    return hosts
+
+class PoolStats:
+    """Thread-safe counters for one connection pool's checkouts and wait time."""
+
+    def __init__(self, max_connections=DB_POOL_MAX_CONNECTIONS):
+        self._lock = threading.Lock()
+        self.max_connections = max_connections
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def checked_out(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def released(self):
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self):
+        """Return the current counters as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'avg_wait_ms': round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'max_connections': self.max_connections
+            }
+
+class ReplicaSet:
+    """Round-robin set of read replica pools that evicts replicas failing health checks."""
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self._pools = {}
+        self._stats = {replica: PoolStats() for replica in hosts}
+        self._evicted_until = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.hosts)
+
+    def _pool(self, replica):
+        # Pools are created lazily with no idle connections so an unreachable
+        # replica never blocks application startup
+        with self._lock:
+            pool = self._pools.get(replica)
+            if pool is None:
+                pool = self._pools[replica] = create_pool(*replica, mincached=0)
+            return pool
+
+    def stats(self, replica):
+        """Return the checkout counters of a replica's pool."""
+        return self._stats[replica]
+
+    def snapshot(self):
+        """Return each replica's pool counters, keyed by "host:port"."""
+        now = time.monotonic()
+        with self._lock:
+            evicted = {r for r in self.hosts if self._evicted_until.get(r, 0) > now}
+        return {
+            f'{host}:{port}': {**self._stats[(host, port)].snapshot(), 'in_rotation': (host, port) not in evicted}
+            for host, port in self.hosts
+        }
+
+    def healthy(self):
+        """Return the replicas that are currently in rotation."""
+        now = time.monotonic()
+        with self._lock:
+            return [r for r in self.hosts if self._evicted_until.get(r, 0) <= now]
+
+    def evict(self, replica, error):
+        """Take a replica out of rotation for DB_REPLICA_RETRY_SECONDS."""
+        with self._lock:
+            self._evicted_until[replica] = time.monotonic() + DB_REPLICA_RETRY_SECONDS
+        print(f"[DB] Evicting replica {replica[0]}:{replica[1]} for {DB_REPLICA_RETRY_SECONDS}s: {error}")
+
+    def connection(self):
+        """Return (replica, connection) from the next healthy replica, or (None, None)."""
+        candidates = self.healthy()
+        if not candidates:
+            return None, None
+        with self._lock:
+            start = self._next % len(candidates)
+            self._next += 1
+        for replica in candidates[start:] + candidates[:start]:
+            try:
+                return replica, self._pool(replica).connection()
+            except pymysql.MySQLError as e:
+                self.evict(replica, e)
+        return None, None
+
+    def check(self):
+        """Ping every replica, evicting dead ones and restoring recovered ones."""
+        for replica in self.hosts:
+            try:
+                conn = self._pool(replica).connection()
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute('SELECT 1')
+                finally:
+                    conn.close()
+            except Exception as e:
+                self.evict(replica, e)
+            else:
+                with self._lock:
+                    self._evicted_until.pop(replica, None)
+
+    def start_health_checks(self, interval):
+        """Run check() every `interval` seconds in a daemon thread."""
+        def run():
+            while True:
+                time.sleep(interval)
+                self.check()
+
+        thread = threading.Thread(target=run, name='db-replica-health', daemon=True)
+        thread.start()
+        return thread
+
 # Connection pool initialization
-db_pool = PooledDB(
-    creator=pymysql,
-    maxconnections=10,
-    mincached=2,
-    maxcached=5,
-    host=os.environ.get('DB_HOST'),
-    user=os.environ.get('DB_USER'),
-    password=os.environ.get('DB_PASSWORD'),
-    database=os.environ.get('DB_NAME'),
-    port=int(os.environ.get('DB_PORT', 3306)),
-    charset='utf8mb4',
-    cursorclass=pymysql.cursors.DictCursor
-)
+db_pool = create_pool(os.environ.get('DB_HOST'), int(os.environ.get('DB_PORT', 3306)))
+replicas = ReplicaSet(parse_hosts(DB_REPLICA_HOSTS))
+if replicas and DB_REPLICA_HEALTH_INTERVAL > 0:
+    replicas.start_health_checks(DB_REPLICA_HEALTH_INTERVAL)
+
+# Checkout counters of the primary pool; each replica pool has its own in ReplicaSet
+pool_stats = PoolStats()
+
+def pool_snapshot():
+    """Return the primary's and every replica's pool counters and capacity."""
+    return {'primary': pool_stats.snapshot(), 'replicas': replicas.snapshot()}
+
+def _checked_out(started, stats=None):
+    """Record how long a checkout waited, per pool and per request."""
+    wait = time.perf_counter() - started
+    (stats or pool_stats).checked_out(wait)
+    if has_app_context():
+        g._db_pool_wait = getattr(g, '_db_pool_wait', 0.0) + wait
+
+@contextmanager
+def pooled_connection(pool=None):
+    """Check a connection out of the pool only for the duration of the block."""
+    started = time.perf_counter()
+    conn = (pool or db_pool).connection()
+    _checked_out(started)
+    try:
+        yield conn
+    finally:
+        conn.close()
+        pool_stats.released()
+
+@contextmanager
+def transaction():
+    """Run the enclosed query_db/execute_db calls on one connection and commit them together.
+
+    Nested blocks join the outermost transaction. Do not perform network I/O
+    inside the block, the connection stays checked out until it exits.
+    """
+    conn = getattr(g, '_db_transaction', None)
+    if conn is not None:
+        yield conn
+        return
+    with pooled_connection() as conn:
+        g._db_transaction = conn
+        g._db_wrote = True
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            g.pop('_db_transaction', None)
+
+@contextmanager
+def named_lock(name):
+    """Hold the MySQL named lock `name` for the block; yields whether it was acquired.
+
+    Named locks belong to a session, so the lock gets its own connection
+    outside the pool. A background job can then hold it across minutes of
+    ledger I/O while checking pooled connections out per statement.
+    """
+    conn = pymysql.connect(**connection_arguments(os.environ.get('DB_HOST'), int(os.environ.get('DB_PORT', 3306))))
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT GET_LOCK(%s, 0) AS acquired', [name])
+            acquired = bool(cur.fetchone()['acquired'])
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT RELEASE_LOCK(%s)', [name])
+    finally:
+        conn.close()
 
 def get_db():
-    """Get database connection from the pool."""
+    """Get a primary connection pinned to the request until teardown.
+
+    Only needed for execute_db(commit=False) outside of a transaction() block;
+    query_db and execute_db otherwise hold a connection just for one statement.
+    """
     db = getattr(g, '_database', None)
     if db is None:
+        started = time.perf_counter()
         db = g._database = db_pool.connection()
+        _checked_out(started)
     return db
 
 def close_db(e=None):
-    """Close database connection at the end of request."""
-    db = getattr(g, '_database', None)
+    """Close the request-pinned database connection, if any, at the end of request."""
+    db = g.pop('_database', None)
     if db is not None:
         db.close()
+        pool_stats.released()
 
-def query_db(query, args=(), one=False):
-    """Query the database and return the results as a list of dictionaries."""
-    conn = get_db()
+def _fetchall(conn, query, args):
     with conn.cursor() as cur:
         cur.execute(query, args)
-        rv = cur.fetchall()
+        return cur.fetchall()
+
+def query_db(query, args=(), one=False, primary=False):
+    """Query the database and return the results as a list of dictionaries.
+
+    Reads go to a read replica when one is configured, unless `primary` is set
+    or the current request has already written through execute_db.
+    """
+    conn = getattr(g, '_db_transaction', None) or getattr(g, '_database', None)
+    if conn is not None:
+        rv = _fetchall(conn, query, args)
+    elif primary or not replicas or getattr(g, '_db_wrote', False):
+        with pooled_connection() as conn:
+            rv = _fetchall(conn, query, args)
+    else:
+        started = time.perf_counter()
+        replica, conn = replicas.connection()
+        if conn is None:
+            return query_db(query, args, one=one, primary=True)
+        stats = replicas.stats(replica)
+        _checked_out(started, stats)
+        try:
+            rv = _fetchall(conn, query, args)
+        except pymysql.err.OperationalError as e:
+            # The replica died mid-query: evict it and retry on the primary
+            replicas.evict(replica, e)
+            return query_db(query, args, one=one, primary=True)
+        finally:
+            conn.close()
+            stats.released()
     return rv[0] if rv and one else rv
 
 def execute_db(query, args=(), commit=True):
-    """Execute a database query and optionally commit changes."""
-    conn = get_db()
-    with conn.cursor() as cur:
-        cur.execute(query, args)
-        last_id = cur.lastrowid
-        if commit:
-            conn.commit()
+    """Execute a database query and optionally commit changes.
+
+    Inside a transaction() block the statement joins that transaction and is
+    committed when the block exits.
+    """
+    # Subsequent reads in this request must see this write, so pin them to the primary
+    g._db_wrote = True
+    conn = getattr(g, '_db_transaction', None)
+    if conn is not None:
+        with conn.cursor() as cur:
+            cur.execute(query, args)
+            return cur.lastrowid
+    if not commit:
+        conn = get_db()
+        with conn.cursor() as cur:
+            cur.execute(query, args)
+            return cur.lastrowid
+    with pooled_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, args)
+            last_id = cur.lastrowid
+        conn.commit()
     return last_id
 
 def hash_password(password):
@@ -188,10 +479,14 @@ def register_auth_routes(app, auth_ns):
             hashed_password = hash_password(data['password'])
             role = data.get('role', 'user')  # Default role is 'user'
             
-            execute_db(
-                'INSERT INTO users (id, username, email, password, role, created_at) VALUES (%s, %s, %s, %s, %s, %s)',
-                [user_id, data['username'], data['email'], hashed_password, role, datetime.datetime.utcnow()]
-            )
+            with transaction() as conn:
+                execute_db(
+                    'INSERT INTO users (id, username, email, password, role, created_at) VALUES (%s, %s, %s, %s, %s, %s)',
+                    [user_id, data['username'], data['email'], hashed_password, role, datetime.datetime.utcnow()]
+                )
+                with conn.cursor() as cur:
+                    change_log.record_change(cur, 'user', user_id, 'insert', user_id)
+            invalidate_count('users')
             
             return {
                 'message': 'User registered successfully!',
@@ -318,7 +613,10 @@ def register_auth_routes(app, auth_ns):
             # Execute update
             params.append(user_id)  # For the WHERE clause
             query = f"UPDATE users SET {', '.join(updates)} WHERE id = %s"
-            execute_db(query, params)
+            with transaction() as conn:
+                execute_db(query, params)
+                with conn.cursor() as cur:
+                    change_log.record_change(cur, 'user', user_id, 'update', user_id)
             
             # Get updated user info
             updated_user = query_db('SELECT id, username, email, role FROM users WHERE id = %s', 
@@ -355,7 +653,11 @@ def register_auth_routes(app, auth_ns):
                     return {'message': 'Cannot delete the last admin account', 'success': False}, 403
             
             # Delete user
-            execute_db('DELETE FROM users WHERE id = %s', [user_id])
+            with transaction() as conn:
+                execute_db('DELETE FROM users WHERE id = %s', [user_id])
+                with conn.cursor() as cur:
+                    change_log.record_change(cur, 'user', user_id, 'delete', user_id)
+            invalidate_count('users')
             
             return {
                 'message': 'User deleted successfully',
@@ -364,27 +666,35 @@ def register_auth_routes(app, auth_ns):
 
     @auth_ns.route('/users')
     class UserList(Resource):
+        @auth_ns.param('cursor', 'next_cursor from the previous page')
+        @auth_ns.param('per_page', 'Items per page', type=int, default=50)
         @auth_ns.response(200, 'List of users', [user_model])
+        @auth_ns.response(400, 'Invalid cursor')
         @auth_ns.response(403, 'Unauthorized to list users')
         @auth_ns.response(500, 'Internal server error')
         @token_required
         def get(self, current_user):
-            """List all users (admin only)"""
+            """List users, newest first (admin only, paginated)"""
             # Only admins can list all users
             if current_user['role'] != 'admin':
                 return {'message': 'Unauthorized - Admin access required', 'success': False}, 403
                 
-            users = query_db('''
+            try:
+                cursor, per_page = page_params(50, 200)
+            except ValueError as e:
+                return {'message': str(e), 'success': False}, 400
+
+            condition, args = keyset_filter(cursor)
+            users = query_db(f'''
                 SELECT id, username, email, role, created_at 
                 FROM users 
-                ORDER BY created_at DESC
-            ''')
-            
-            # Convert datetime objects to strings
-            for user in users:
-                if isinstance(user.get('created_at'), datetime.datetime):
-                    user['created_at'] = user['created_at'].isoformat()
+                WHERE {condition}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            ''', args + [per_page + 1])
+            users, next_cursor = keyset_page(users, per_page)
+            total = cached_count('users', 'SELECT COUNT(*) as count FROM users')
             
-            return {'users': users, 'success': True}, 200
+            return {'users': users, 'pagination': pagination(per_page, total, next_cursor), 'success': True}, 200
 
     return app
\ No newline at end of file
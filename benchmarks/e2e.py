@@ -0,0 +1,321 @@
+# benchmarks/e2e.py
+"""End-to-end benchmark of the API against a local database and a fake ledger.
+
+Starts the Flask app in-process, seeds products, batches and invoices,
+replays the Finvoice samples in xmls/ through /process-invoices and drives
+the read endpoints concurrently. Throughput, latency percentiles and peak
+RSS are printed and written to a JSON file that later runs can be compared
+against.
+
+    python -m benchmarks.e2e --db sqlite --products 200 --output bench.json
+    python -m benchmarks.e2e --db mysql --latency-ms 50 --compare bench.json
+
+--db mysql uses the DB_* environment variables and creates the schema with
+setup_database.py; point it at a scratch database.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import requests
+
+from benchmarks.fake_ledger import FakeLedger, METRICS
+
+# Summary lines go here; the app's own per-request prints are silenced unless --verbose
+REPORT = sys.stdout
+REPO_ROOT = Path(__file__).resolve().parent.parent
+XML_DIR = REPO_ROOT / 'xmls'
+# Ledger host hardcoded in the sample invoices' <Other> elements
+SAMPLE_LEDGER_URL = 'http://13.61.7.161:8000'
+SUB_CATEGORIES = [metric['name'] for metric in METRICS]
+FACILITIES = ['Helsinki Plant', 'Espoo Plant', 'Tampere Warehouse', 'Oulu Office']
+ORGANIZATIONAL_UNITS = ['Production', 'Logistics', 'Administration']
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (app, ledger and driver) in MiB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def configure_environment(args, workdir):
+    """Point the app at the chosen database and the fake ledger before it is imported."""
+    sys.path.insert(0, str(REPO_ROOT))
+    if args.db == 'sqlite':
+        from benchmarks import sqlite_standin
+        sqlite_standin.install(os.path.join(workdir, 'benchmark.db'))
+        os.environ.setdefault('DB_NAME', 'benchmark')
+    os.environ['DB_POOL_MAX_CONNECTIONS'] = str(args.pool_size)
+    # Measure the endpoints rather than admission control, unless limits are set explicitly
+    for name in ('RATE_LIMIT_UPLOAD_FILES_PER_MINUTE', 'RATE_LIMIT_UPLOAD_FILES_BURST', 'MAX_IN_FLIGHT_UPLOADS'):
+        os.environ.setdefault(name, '1000000')
+    # The filesystem cache lives under the working directory
+    os.chdir(workdir)
+
+
+def start_app():
+    """Create the schema, import the app and serve it on a free local port."""
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import setup_database
+    setup_database.setup_database()
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    import main
+    server = make_server('127.0.0.1', 0, main.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='benchmark-app', daemon=True).start()
+    return main, server, f'http://127.0.0.1:{server.server_port}'
+
+
+def seed(app, ledger_url, products, batches_per_product, invoices_per_batch):
+    """Bulk insert products, batches and invoices owned by the admin user."""
+    from auth import pooled_connection
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    product_rows, batch_rows, invoice_rows = [], [], []
+
+    with app.app_context():
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id FROM users WHERE username = 'admin'")
+                admin_id = cur.fetchone()['id']
+
+            for p in range(products):
+                product_id = str(uuid.uuid4())
+                product_rows.append((product_id, f'Benchmark product {p}', admin_id, now - timedelta(minutes=p)))
+                for b in range(batches_per_product):
+                    batch_id = str(uuid.uuid4())
+                    batch_rows.append((batch_id, product_id, f'{ledger_url}/api/products/batch-{p}-{b}/', now))
+                    for i in range(invoices_per_batch):
+                        start = now.date() - timedelta(days=rng.randint(0, 365))
+                        invoice_rows.append((
+                            str(uuid.uuid4()), batch_id, rng.choice(FACILITIES), rng.choice(ORGANIZATIONAL_UNITS),
+                            f'{ledger_url}/api/products/supplier-{rng.randint(0, 99)}/', rng.choice(SUB_CATEGORIES),
+                            f'INV-{p}-{b}-{i}', start, rng.choice([True, False]), rng.randint(1, 5),
+                            rng.randint(1, 100), round(rng.uniform(10, 5000), 2), 'EUR',
+                            start, start + timedelta(days=30), now
+                        ))
+
+            with conn.cursor() as cur:
+                cur.executemany(
+                    'INSERT INTO products (id, name, user_id, created_at) VALUES (%s, %s, %s, %s)',
+                    product_rows
+                )
+                cur.executemany(
+                    'INSERT INTO batches (id, product_id, information_url, created_at) VALUES (%s, %s, %s, %s)',
+                    batch_rows
+                )
+                cur.executemany(
+                    'INSERT INTO invoices (id, batch_id, facility, organizational_unit, supplier_url, sub_category, invoice_number, invoice_date, emissions_are_per_unit, quantity_needed_per_unit, units_bought, total_amount, currency, transaction_start_date, transaction_end_date, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                    invoice_rows
+                )
+            conn.commit()
+
+    return [row[0] for row in batch_rows]
+
+
+def load_invoice_files(ledger_url):
+    """Read the sample Finvoice files, pointing their ledger links at the fake ledger."""
+    return [
+        (path.name, path.read_text(encoding='utf-8').replace(SAMPLE_LEDGER_URL, ledger_url))
+        for path in sorted(XML_DIR.glob('*.xml'))
+    ]
+
+
+def run_scenario(name, make_request, total, concurrency, before_each=None):
+    """Issue `total` requests with `concurrency` threads and summarize their latencies."""
+    local = threading.local()
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        if before_each:
+            before_each()
+        started = time.perf_counter()
+        try:
+            response = make_request(session, i)
+            failed = response.status_code >= 400
+        except requests.RequestException:
+            failed = True
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            errors += failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': errors,
+        'wall_seconds': round(wall, 4),
+        'throughput_rps': round(total / wall, 2) if wall else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2),
+        'peak_rss_mb': peak_rss_mb()
+    }
+    print(f"{name:<22} {result['throughput_rps']:>9} req/s  p50 {result['p50_ms']:>9} ms  "
+          f"p95 {result['p95_ms']:>9} ms  p99 {result['p99_ms']:>9} ms  errors {errors}", file=REPORT)
+    return result
+
+
+def compare(current, baseline_path):
+    """Print p95 and throughput changes against a previous results file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path}:", file=REPORT)
+    for name, result in current['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        p95 = (result['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100 if previous['p95_ms'] else 0
+        rps = (result['throughput_rps'] - previous['throughput_rps']) / previous['throughput_rps'] * 100 if previous['throughput_rps'] else 0
+        print(f"{name:<22} p95 {p95:+7.1f}%  throughput {rps:+7.1f}%", file=REPORT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end API benchmark')
+    parser.add_argument('--db', choices=['sqlite', 'mysql'], default='sqlite')
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--batches-per-product', type=int, default=3)
+    parser.add_argument('--invoices-per-batch', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per read scenario')
+    parser.add_argument('--cold-requests', type=int, default=5, help='Uncached /emissions requests')
+    parser.add_argument('--uploads', type=int, default=20, help='/process-invoices requests')
+    parser.add_argument('--files-per-upload', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Fake ledger latency')
+    parser.add_argument('--jitter-ms', type=float, default=5.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fake ledger failure ratio')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='Previous results file to compare against')
+    parser.add_argument('--verbose', action='store_true', help="Show the app's own output")
+    args = parser.parse_args()
+
+    if args.verbose:
+        run(args)
+    else:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            run(args)
+
+
+def run(args):
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    ledger = FakeLedger(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate, seed=1).start()
+    os.environ['LEDGER_URL'] = ledger.url
+
+    workdir = tempfile.mkdtemp(prefix='msm-bench-')
+    configure_environment(args, workdir)
+    app_module, server, base_url = start_app()
+
+    started = time.perf_counter()
+    batch_ids = seed(app_module.app, ledger.url, args.products, args.batches_per_product, args.invoices_per_batch)
+    print(f"Seeded {args.products} products, {len(batch_ids)} batches, "
+          f"{len(batch_ids) * args.invoices_per_batch} invoices in {time.perf_counter() - started:.2f}s", file=REPORT)
+
+    login = requests.post(f'{base_url}/api/auth/login', json={'email': 'admin@example.com', 'password': 'admin123'})
+    login.raise_for_status()
+    headers = {'Authorization': f"Bearer {login.json()['token']}"}
+
+    files = load_invoice_files(ledger.url)
+    pages = max(1, args.products // 10)
+    transaction_ids = []
+
+    def upload(session, i):
+        batch = [files[(i * args.files_per_upload + n) % len(files)] for n in range(args.files_per_upload)]
+        response = session.post(
+            f'{base_url}/api/process-invoices', headers=headers,
+            # The samples repeat across uploads; force keeps them from being served from the dedup index
+            data={'force': 'true'},
+            files=[('files', (name, content.encode('utf-8'), 'text/xml')) for name, content in batch]
+        )
+        if response.status_code == 202:
+            transaction_ids.append(response.json()['transaction_id'])
+        return response
+
+    scenarios = {}
+    print(file=REPORT)
+    scenarios['process_invoices'] = run_scenario('process_invoices', upload, args.uploads, args.concurrency)
+    scenarios['transaction'] = run_scenario(
+        'transaction',
+        lambda s, i: s.get(f'{base_url}/api/transaction/{transaction_ids[i % len(transaction_ids)]}', headers=headers),
+        args.requests, args.concurrency
+    ) if transaction_ids else None
+    scenarios['emissions_uncached'] = run_scenario(
+        'emissions_uncached', lambda s, i: s.get(f'{base_url}/api/emissions'),
+        args.cold_requests, 1, before_each=app_module.cache.clear
+    )
+    scenarios['emissions'] = run_scenario(
+        'emissions', lambda s, i: s.get(f'{base_url}/api/emissions'), args.requests, args.concurrency
+    )
+    scenarios['products'] = run_scenario(
+        'products', lambda s, i: s.get(f'{base_url}/api/products', params={'page': i % pages + 1}),
+        args.requests, args.concurrency
+    )
+    scenarios['batch_detail'] = run_scenario(
+        'batch_detail', lambda s, i: s.get(f'{base_url}/api/batches/{batch_ids[i % len(batch_ids)]}', headers=headers),
+        args.requests, args.concurrency
+    )
+
+    results = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+            'ledger_requests': ledger.requests,
+            'ledger_errors': ledger.errors
+        },
+        'peak_rss_mb': peak_rss_mb(),
+        'scenarios': {name: result for name, result in scenarios.items() if result}
+    }
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nPeak RSS {results['peak_rss_mb']} MiB. Results written to {output}", file=REPORT)
+
+    if baseline:
+        compare(results, baseline)
+
+    server.shutdown()
+    ledger.stop()
+
+
+if __name__ == '__main__':
+    main()
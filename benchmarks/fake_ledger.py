@@ -0,0 +1,164 @@
+# benchmarks/fake_ledger.py
+"""Local stand-in for the ledger API with configurable latency and error rate.
+
+Run standalone with:
+    python -m benchmarks.fake_ledger --port 9000 --latency-ms 50 --error-rate 0.01
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Metric catalog served from /api/sustainability-metrics/. Names match the
+# subcategories used by the emissions endpoint.
+METRICS = [
+    {'metric_id': 'm-scope1', 'name': 'Stationary Combustion', 'unit': 'kg'},
+    {'metric_id': 'm-scope2', 'name': 'Purchased Electricity', 'unit': 'kg'},
+    {'metric_id': 'm-scope3', 'name': 'Purchased Goods and Services', 'unit': 'kg'},
+    {'metric_id': 'm-energy', 'name': 'Purchased Electricity (Energy)', 'unit': 'kWh'},
+    {'metric_id': 'm-water', 'name': 'Water Quantities', 'unit': 'Cubic meters'},
+]
+
+PRODUCT_PATH = re.compile(r'^/api/products/([^/]+)/?$')
+
+
+def product_payload(slug):
+    """Deterministic ledger product for a slug."""
+    rng = random.Random(slug)
+    return {
+        'product_id': slug,
+        'slug': slug,
+        'name': f'Product {slug}',
+        'description': f'Benchmark product {slug}',
+        'manufacturer': {'name': f'Manufacturer {rng.randint(1, 50)}', 'mainURL': 'http://localhost'},
+        'timestamp': '2025-04-29T09:00:00',
+        'sustainability_metrics': [
+            {**metric, 'value': round(rng.uniform(1, 100), 3)} for metric in METRICS
+        ]
+    }
+
+
+class FakeLedger:
+    """Threaded HTTP server imitating the ledger endpoints the API calls."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._created = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-ledger', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _delay_and_fail(self):
+        """Sleep for the configured latency; return True if this call should fail."""
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms))
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if delay:
+            time.sleep(delay / 1000)
+        return fail
+
+    def _handler(self):
+        ledger = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if ledger._delay_and_fail():
+                    return self._send(503, {'error': 'injected failure'})
+                if self.path.rstrip('/') == '/api/sustainability-metrics':
+                    return self._send(200, METRICS)
+                match = PRODUCT_PATH.match(self.path)
+                if not match:
+                    return self._send(404, {'error': 'not found'})
+                slug = match.group(1)
+                with ledger._lock:
+                    created = ledger._created.get(slug)
+                self._send(200, created or product_payload(slug))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if ledger._delay_and_fail():
+                    return self._send(503, {'error': 'injected failure'})
+                if self.path.rstrip('/') != '/api/products':
+                    return self._send(404, {'error': 'not found'})
+                slug = f"bench-{uuid.uuid4().hex[:12]}"
+                metric_names = {m['metric_id']: m for m in METRICS}
+                created = {
+                    'product_id': slug,
+                    'slug': slug,
+                    'name': payload.get('name', slug),
+                    'description': '',
+                    'manufacturer': payload.get('manufacturer', {}),
+                    'timestamp': datetime.utcnow().isoformat(),
+                    'sustainability_metrics': [
+                        {**metric_names.get(m['metric_id'], {'name': m['metric_id']}), 'value': m['value']}
+                        for m in payload.get('sustainability_metrics_input', [])
+                    ]
+                }
+                with ledger._lock:
+                    ledger._created[slug] = created
+                self._send(201, created)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake ledger server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    ledger = FakeLedger(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"Fake ledger listening on {ledger.url}")
+    try:
+        ledger.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
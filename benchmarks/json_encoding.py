@@ -0,0 +1,104 @@
+# benchmarks/json_encoding.py
+"""Compare the previous response serialization path with utils.json_encoding.
+
+The previous path walked each payload converting datetimes to strings and
+then encoded it with flask-restx's default json.dumps. The new path hands
+the raw rows, with datetime, date and Decimal values, to the app-wide encoder.
+
+    python -m benchmarks.json_encoding --records 50000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def emissions_payload(records):
+    """A /emissions response body with `records` records, built like the endpoint does."""
+    from routes.emissions import build_emission_records, EMISSION_SUBCATEGORIES
+    from benchmarks.micro import synthetic_supplier
+    supplier, supplier_data = synthetic_supplier(5)
+    start = date(2025, 1, 1)
+    payload = []
+    while len(payload) < records:
+        n = len(payload)
+        supplier = dict(supplier, facility=f'Facility {n % 40}',
+                        transaction_start_date=start + timedelta(days=n % 365),
+                        transaction_end_date=start + timedelta(days=n % 365 + 30))
+        payload.extend(build_emission_records(supplier, supplier_data, EMISSION_SUBCATEGORIES))
+    return payload[:records]
+
+
+def batch_rows(records):
+    """/batches/<id> style invoice rows as PyMySQL returns them."""
+    now = datetime(2025, 4, 29, 9, 0, 0)
+    return [{
+        'id': f'invoice-{i}', 'facility': f'Facility {i % 40}', 'organizational_unit': 'Production',
+        'url': f'http://ledger/api/products/supplier-{i % 100}/', 'subCategory': 'Purchased Goods and Services',
+        'invoiceNumber': f'INV-{i}', 'invoiceDate': date(2025, 1, 1) + timedelta(days=i % 365),
+        'emissionsArePerUnit': 'YES', 'quantityNeededPerUnit': Decimal('2.500000'),
+        'unitsBought': 10.0, 'totalAmount': Decimal('1234.50'), 'currency': 'EUR',
+        'transactionStartDate': date(2025, 1, 1), 'transactionEndDate': date(2025, 1, 31),
+        'createdAt': now + timedelta(seconds=i)
+    } for i in range(records)]
+
+
+def legacy_encode(data):
+    """Previous path: recursive datetime conversion, then json.dumps."""
+    def convert_datetime(obj):
+        if isinstance(obj, (datetime, date)):
+            return obj.isoformat()
+        elif isinstance(obj, Decimal):
+            return float(obj)
+        elif isinstance(obj, dict):
+            return {k: convert_datetime(v) for k, v in obj.items()}
+        elif isinstance(obj, list):
+            return [convert_datetime(item) for item in obj]
+        elif hasattr(obj, 'to_dict'):
+            # Records were plain dicts then
+            return convert_datetime(obj.to_dict())
+        return obj
+    return (json.dumps(convert_datetime(data)) + '\n').encode('utf-8')
+
+
+def best_of(func, repeats):
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        body = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON serialization benchmark')
+    parser.add_argument('--records', type=int, default=50000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DB_POOL_MIN_CACHED', '0')
+    sys.path.insert(0, str(REPO_ROOT))
+    from utils import json_encoding
+
+    payloads = {
+        'emissions': emissions_payload(args.records),
+        'batch_detail': {'batch': {'id': 'b', 'created_at': datetime.utcnow()}, 'batchData': {},
+                         'invoices': batch_rows(args.records)}
+    }
+    print(f"Encoder: {json_encoding.JSON_ENCODER}, {args.records} records per payload")
+    for name, payload in payloads.items():
+        legacy, legacy_size = best_of(lambda: legacy_encode(payload), args.repeats)
+        fast, fast_size = best_of(lambda: json_encoding.dumps(payload), args.repeats)
+        print(f"{name:<14} legacy {legacy * 1000:8.1f} ms ({legacy_size / legacy / 1e6:6.1f} MB/s)   "
+              f"new {fast * 1000:8.1f} ms ({fast_size / fast / 1e6:6.1f} MB/s)   speedup {legacy / fast:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+# benchmarks/micro.py
+"""Micro-benchmarks for the CPU hot paths with a regression gate.
+
+Measures, on synthetic Finvoice documents with 1 to 10,000 InvoiceRows
+built from the xmls/ samples:
+  * xml_to_json (full conversion) and extract_invoice (projected fields)
+    parse time and allocations per row
+  * process_xml_file per document, with the ledger lookup answered in memory
+  * build_emission_records (the /emissions per-invoice arithmetic) per metric
+
+    python -m benchmarks.micro                      # compare with the stored baseline
+    python -m benchmarks.micro --update-baseline    # record a new baseline
+
+Timings are gated on their cost relative to a calibration workload measured
+alongside them, so the baseline survives moving between machines. Exits with
+status 1 when a measurement is slower than the baseline by more than
+--tolerance, or allocates more by more than --alloc-tolerance.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).resolve().parent / 'micro_baseline.json'
+TEMPLATE_PATH = REPO_ROOT / 'xmls' / 'purchased_goods_1.xml'
+ROW_COUNTS = [1, 10, 100, 1000, 10000]
+METRIC_COUNTS = [1, 10, 100, 1000]
+
+ROW_PATTERN = re.compile(r'[ \t]*<InvoiceRow>.*?</InvoiceRow>\s*', re.DOTALL)
+
+
+def synthetic_invoice(rows):
+    """Finvoice document based on the purchased goods sample with `rows` InvoiceRows."""
+    template = TEMPLATE_PATH.read_text(encoding='utf-8')
+    row = ROW_PATTERN.search(template).group(0)
+    generated = ''.join(
+        row.replace('<ArticleIdentifier>12345<', f'<ArticleIdentifier>{10000 + i}<')
+        for i in range(rows)
+    )
+    return ROW_PATTERN.sub(lambda _: generated, template, count=1)
+
+
+def synthetic_supplier(metrics):
+    """An invoice row and a ledger product with `metrics` sustainability metrics."""
+    from routes.emissions import EMISSION_SUBCATEGORIES
+    names = list(EMISSION_SUBCATEGORIES)
+    supplier = {
+        'id': 'bench', 'supplier_url': 'http://ledger/api/products/bench/', 'facility': 'Helsinki Plant',
+        'organizational_unit': 'Production', 'sub_category': 'Purchased Goods and Services',
+        'emissions_are_per_unit': False, 'quantity_needed_per_unit': Decimal('2'), 'units_bought': Decimal('10'),
+        'total_amount': Decimal('1000.00'), 'currency': 'EUR',
+        'transaction_start_date': '2025-01-01', 'transaction_end_date': '2025-01-31'
+    }
+    supplier_data = {
+        'product_id': 'bench', 'name': 'Bench product', 'description': '',
+        'manufacturer': {'name': 'Bench manufacturer'}, 'timestamp': '2025-04-29T09:00:00',
+        'sustainability_metrics': [
+            {'metric_id': f'm{i}', 'name': names[i % len(names)], 'value': 1.5 + i} for i in range(metrics)
+        ]
+    }
+    return supplier, supplier_data
+
+
+def best_time(func, min_seconds=0.25, repeats=7):
+    """Best per-call time over `repeats` runs, each looping for at least `min_seconds`.
+
+    Like timeit, the garbage collector is disabled while timing.
+    """
+    func()  # warm up caches and lazy imports
+    gc.collect()
+    gc.disable()
+    try:
+        loops = 1
+        while True:
+            started = time.perf_counter()
+            for _ in range(loops):
+                func()
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_seconds / repeats or loops >= 1 << 20:
+                break
+            loops *= 2
+        best = elapsed / loops
+        for _ in range(repeats - 1):
+            started = time.perf_counter()
+            for _ in range(loops):
+                func()
+            best = min(best, (time.perf_counter() - started) / loops)
+    finally:
+        gc.enable()
+    return best
+
+
+def calibration():
+    """Time a fixed pure-Python workload so timings can be compared across machines and load."""
+    def workload():
+        rows = [{'name': f'row{i}', 'value': i * 1.5} for i in range(200)]
+        return sum(row['value'] for row in rows if row['name'])
+    return best_time(workload)
+
+
+def allocations(func):
+    """Peak traced bytes and blocks still allocated while the result is alive."""
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    retained = sys.getallocatedblocks() - blocks_before
+    del result
+    return peak, retained
+
+
+def relative_time(func, units):
+    """Return (microseconds per unit, cost per unit relative to the calibration workload).
+
+    The calibration runs right before and after the measurement so both see
+    the same machine load; the relative cost is what the regression gate uses.
+    """
+    before = calibration()
+    seconds = best_time(func)
+    after = calibration()
+    return seconds / units * 1e6, seconds / units / ((before + after) / 2)
+
+
+def run_benchmarks():
+    # Importing the app modules must not try to open MySQL connections
+    os.environ.setdefault('DB_POOL_MIN_CACHED', '0')
+    sys.path.insert(0, str(REPO_ROOT))
+    import utils.xml_parser as xml_parser
+    from routes.emissions import build_emission_records, EMISSION_SUBCATEGORIES
+
+    # Parse without the lru_cache so every call does the work
+    parsers = {
+        'xml_to_json': xml_parser.xml_to_json.__wrapped__,
+        'extract_invoice': xml_parser.extract_invoice.__wrapped__
+    }
+    ledger_product = synthetic_supplier(5)[1]
+
+    async def fetch_in_memory(url):
+        return ledger_product
+
+    results = {}
+    for rows in ROW_COUNTS:
+        document = synthetic_invoice(rows)
+        for name, parse in parsers.items():
+            us, relative = relative_time(lambda: parse(document), rows)
+            peak, retained = allocations(lambda: parse(document))
+            results[f'{name}.rows_{rows}.us_per_row'] = us
+            results[f'{name}.rows_{rows}.cost_per_row'] = relative
+            results[f'{name}.rows_{rows}.peak_bytes_per_row'] = peak / rows
+            results[f'{name}.rows_{rows}.retained_blocks_per_row'] = retained / rows
+
+    original_fetch = xml_parser.fetch_url_data
+    xml_parser.fetch_url_data = fetch_in_memory
+    try:
+        loop = asyncio.new_event_loop()
+        for rows in (1, 100, 1000):
+            document = synthetic_invoice(rows)
+            # Defeat the xml_to_json cache with a distinct document per call
+            counter = iter(range(1 << 30))
+            us, relative = relative_time(
+                lambda: loop.run_until_complete(xml_parser.process_xml_file(f'{document}<!-- {next(counter)} -->')),
+                rows
+            )
+            results[f'process_xml_file.rows_{rows}.us_per_row'] = us
+            results[f'process_xml_file.rows_{rows}.cost_per_row'] = relative
+        loop.close()
+    finally:
+        xml_parser.fetch_url_data = original_fetch
+
+    for metrics in METRIC_COUNTS:
+        supplier, supplier_data = synthetic_supplier(metrics)
+        us, relative = relative_time(
+            lambda: build_emission_records(supplier, supplier_data, EMISSION_SUBCATEGORIES), metrics
+        )
+        results[f'emission_records.metrics_{metrics}.us_per_metric'] = us
+        results[f'emission_records.metrics_{metrics}.cost_per_metric'] = relative
+
+    return {name: round(value, 4) for name, value in results.items()}
+
+
+def compare(results, baseline, tolerance, alloc_tolerance):
+    """Return the measurements that regressed past their tolerance.
+
+    Raw microsecond timings are informational only. Timings are gated on their
+    cost relative to the calibration workload, allocations on their own values.
+    """
+    regressions = []
+    for name, value in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            status = 'new'
+        else:
+            change = (value - previous) / previous if previous else 0.0
+            status = f'{change * 100:+.1f}%'
+            if '.us_per_' in name:
+                limit = None
+            elif '.cost_per_' in name:
+                limit = tolerance
+            else:
+                limit = alloc_tolerance
+            # Tiny absolute allocation counts (e.g. retained blocks near zero) are noise; timing
+            # costs are small fractions of the calibration workload and are gated on the change alone
+            if limit is not None and change > limit and ('.cost_per_' in name or value - previous > 0.5):
+                regressions.append(name)
+                status += '  REGRESSION'
+        print(f'{name:<50} {value:>12.4f}  {status}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parser and emissions micro-benchmarks')
+    parser.add_argument('--baseline', default=str(BASELINE_PATH))
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Allowed relative slowdown as a fraction of the baseline (default 0.5)')
+    parser.add_argument('--alloc-tolerance', type=float, default=0.1,
+                        help='Allowed allocation growth as a fraction of the baseline (default 0.1)')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='Re-runs confirming a timing regression before it fails the gate (default 2)')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run_benchmarks()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        compare(results, {}, args.tolerance, args.alloc_tolerance)
+        print(f'\nBaseline written to {args.baseline}')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.alloc_tolerance)
+    # A slowdown must persist: timings keep their best value across re-runs, allocations are not re-measured
+    for _ in range(args.retries):
+        if not any('.cost_per_' in name for name in regressions):
+            break
+        print(f'\nRe-running to confirm {len(regressions)} regression(s)')
+        rerun = run_benchmarks()
+        results = {
+            name: min(value, rerun[name]) if '.cost_per_' in name else value for name, value in results.items()
+        }
+        regressions = compare(results, baseline, args.tolerance, args.alloc_tolerance)
+    if regressions:
+        print(f'\n{len(regressions)} measurement(s) regressed past the baseline')
+        return 1
+    print('\nNo regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# benchmarks/records.py
+"""Memory per record of utils.records types against the dicts they replaced.
+
+Emission records are built like /emissions builds them, parsed invoices are
+synthetic Finvoice documents run through extract_invoice. The dict versions
+hold the same values, built the way the previous code built them, so the
+difference is the per-record containers.
+
+    python -m benchmarks.records --records 100000 --rows 10000
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def retained_bytes(func):
+    """Traced bytes still allocated by func() while its result is alive."""
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def legacy_emission_dicts(records):
+    """The records as build_emission_records returned them: a copy of the shared base dict, updated."""
+    from utils.records import EMISSION_RECORD_FIELDS
+    base_fields = EMISSION_RECORD_FIELDS[:EMISSION_RECORD_FIELDS.index('isStale') + 1]
+    own_fields = EMISSION_RECORD_FIELDS[len(base_fields):]
+    dicts = []
+    for record in records:
+        template = {name: getattr(record, name) for name in base_fields}.copy()
+        template.update({name: getattr(record, name) for name in own_fields})
+        dicts.append(template)
+    return dicts
+
+
+def legacy_invoice_dict(invoice):
+    """A ParsedInvoice as the nested dicts extract_invoice returned before."""
+    data = invoice.to_dict()
+    data['InvoiceRows'] = [row.to_dict() for row in data.get('InvoiceRows', [])]
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes per record of the slotted record types')
+    parser.add_argument('--records', type=int, default=100000, help='Emission records')
+    parser.add_argument('--rows', type=int, default=10000, help='InvoiceRows of the parsed invoice')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DB_POOL_MIN_CACHED', '0')
+    sys.path.insert(0, str(REPO_ROOT))
+    from benchmarks.json_encoding import emissions_payload
+    from benchmarks.micro import synthetic_invoice
+    from utils import xml_parser
+
+    document = synthetic_invoice(args.rows)
+    parse = xml_parser.extract_invoice.__wrapped__
+    measurements = {
+        'emission_records': (
+            args.records,
+            lambda: emissions_payload(args.records),
+            lambda: legacy_emission_dicts(emissions_payload(args.records))
+        ),
+        'parsed_invoice_rows': (
+            args.rows,
+            lambda: parse(document),
+            lambda: legacy_invoice_dict(parse(document))
+        ),
+    }
+    for name, (count, slotted, legacy) in measurements.items():
+        before = retained_bytes(legacy) / count
+        after = retained_bytes(slotted) / count
+        print(f"{name:<20} dicts {before:8.1f} B/record   slotted {after:8.1f} B/record   "
+              f"saved {(1 - after / before) * 100:5.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# benchmarks/sqlite_standin.py
+"""Minimal PyMySQL-compatible driver backed by SQLite, for running benchmarks without MySQL.
+
+Only the SQL used by this application is translated: %s placeholders,
+MySQL-only table options, INDEX clauses, AUTO_INCREMENT keys, FOR UPDATE,
+ON DUPLICATE KEY UPDATE, SHOW COLUMNS and CREATE DATABASE/USE.
+Results are returned as dicts like pymysql.cursors.DictCursor. Timings are
+only indicative of application overhead; use --db mysql for real numbers.
+"""
+import re
+import sqlite3
+from datetime import datetime, date
+from decimal import Decimal
+
+DATABASE = None
+
+_NOOP = re.compile(r'^\s*(CREATE\s+DATABASE|USE\s)', re.IGNORECASE)
+_TABLE_OPTIONS = re.compile(r'\)\s*ENGINE\s*=\s*\w+[^;]*$', re.IGNORECASE | re.DOTALL)
+_INLINE_INDEX = re.compile(r',\s*(UNIQUE\s+)?(?:INDEX|KEY)\s+(\w+)\s*\(([^)]*)\)', re.IGNORECASE)
+_CREATE_INDEX = re.compile(r'^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(?!IF\s)', re.IGNORECASE)
+_AUTO_INCREMENT = re.compile(r'\bBIGINT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY\b', re.IGNORECASE)
+_FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE\s*$', re.IGNORECASE)
+_ON_DUPLICATE_KEY = re.compile(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', re.IGNORECASE)
+_VALUES_FUNCTION = re.compile(r'\bVALUES\((\w+)\)', re.IGNORECASE)
+_SHOW_COLUMNS = re.compile(r"^\s*SHOW\s+COLUMNS\s+FROM\s+(\w+)\s+LIKE\s+'([^']*)'\s*$", re.IGNORECASE)
+_CREATE_TABLE = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE)
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()[:10]))
+
+
+def translate(query):
+    """Translate a MySQL statement into one or more SQLite statements."""
+    if _NOOP.match(query):
+        return []
+    show_columns = _SHOW_COLUMNS.match(query)
+    if show_columns:
+        table, column = show_columns.groups()
+        return [f"SELECT name AS Field, type AS Type FROM pragma_table_info('{table}') WHERE name LIKE '{column}'"]
+    query = query.replace('%s', '?')
+    query = _TABLE_OPTIONS.sub(')', query)
+    # Only an INTEGER PRIMARY KEY column is assigned ids by SQLite
+    query = _AUTO_INCREMENT.sub('INTEGER PRIMARY KEY AUTOINCREMENT', query)
+    # SQLite serializes writers, so row locks are not needed
+    query = _FOR_UPDATE.sub('', query)
+    if _ON_DUPLICATE_KEY.search(query):
+        head, update = _ON_DUPLICATE_KEY.split(query, 1)
+        query = head + 'ON CONFLICT DO UPDATE SET' + _VALUES_FUNCTION.sub(r'excluded.\1', update)
+    query = _CREATE_INDEX.sub(lambda m: f"CREATE {m.group(1) or ''}INDEX IF NOT EXISTS ", query)
+    statements = [query]
+    table = _CREATE_TABLE.search(query)
+    if table:
+        for unique, name, columns in _INLINE_INDEX.findall(query):
+            statements.append(
+                f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table.group(1)} ({columns})"
+            )
+        statements[0] = _INLINE_INDEX.sub('', query)
+    return statements
+
+
+class Cursor:
+    def __init__(self, connection):
+        self._cursor = connection._conn.cursor()
+        self.lastrowid = None
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def execute(self, query, args=()):
+        params = tuple(args) if args else ()
+        for statement in translate(query):
+            self._cursor.execute(statement, params if '?' in statement else ())
+        self.lastrowid = self._cursor.lastrowid
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def executemany(self, query, seq_of_args):
+        statement, = translate(query)
+        self._cursor.executemany(statement, [tuple(args) for args in seq_of_args])
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def _rows(self, rows):
+        if self._cursor.description is None:
+            return []
+        columns = [column[0] for column in self._cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def fetchone(self):
+        rows = self._rows([row] if (row := self._cursor.fetchone()) is not None else [])
+        return rows[0] if rows else None
+
+    def fetchmany(self, size=1):
+        return self._rows(self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        return self._rows(self._cursor.fetchall())
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    def __init__(self, database):
+        self._conn = sqlite3.connect(
+            database, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES, timeout=30
+        )
+        # Named locks are only used to keep background jobs from overlapping; a single process needs none
+        self._conn.create_function('GET_LOCK', 2, lambda name, timeout: 1)
+        self._conn.create_function('RELEASE_LOCK', 1, lambda name: 1)
+
+    def cursor(self, cursorclass=None):
+        return Cursor(self)
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect=False):
+        return True
+
+    def close(self):
+        self._conn.close()
+
+
+def connect(*args, **kwargs):
+    """pymysql.connect replacement; connection arguments are ignored."""
+    return Connection(DATABASE)
+
+
+def install(database):
+    """Route pymysql.connect to a SQLite file. Must run before the application is imported."""
+    global DATABASE
+    import pymysql
+    DATABASE = database
+    # WAL lets readers proceed while a writer holds the lock, closer to InnoDB behaviour
+    conn = sqlite3.connect(database)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.close()
+    pymysql.connect = connect
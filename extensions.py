@@ -1,13 +1,17 @@
 import os
 from flask_caching import Cache
 
-# FileSystem Cache (persists between app restarts)
+# Tiered cache: in-process LRU in front of a SQLite store shared by all workers on the node
 cache_config = {
-    'CACHE_TYPE': 'FileSystemCache',
-    'CACHE_DIR': os.path.join(os.getcwd(), 'cache'),  # Cache directory
+    'CACHE_TYPE': 'utils.tiered_cache.TieredCache',
+    'CACHE_DIR': os.path.join(os.getcwd(), 'cache'),  # Directory of the shared SQLite store
     'CACHE_DEFAULT_TIMEOUT': 300,
-    'CACHE_THRESHOLD': 500  # Maximum number of items in cache
+    'CACHE_THRESHOLD': 500,  # Maximum number of items in the shared store
+    'CACHE_L1_MAX_ITEMS': int(os.environ.get('CACHE_L1_MAX_ITEMS', 256)),
+    'CACHE_L1_MAX_BYTES': int(os.environ.get('CACHE_L1_MAX_BYTES', 64 * 1024 * 1024)),
+    'CACHE_L1_TIMEOUT': int(os.environ.get('CACHE_L1_TIMEOUT', 30)),  # Max staleness across workers
+    'CACHE_COMPRESS_THRESHOLD': int(os.environ.get('CACHE_COMPRESS_THRESHOLD', 4096))
 }
 
 # Initialize cache object
-cache = Cache(config=cache_config)
\ No newline at end of file
+cache = Cache(config=cache_config)
@@ -1,4 +1,4 @@
-from flask import Flask, request
+from flask import Flask, request, g
 import sqlite3
 import json
 from datetime import datetime, timedelta
@@ -11,10 +11,15 @@ from routes.invoices import invoice_ns
 from routes.batches import batch_ns
 from routes.products import product_ns
 from routes.emissions import emissions_ns
+from routes.system import system_ns
+from routes.changes import changes_ns
 from models import register_models
 from auth import register_auth_routes
 import time
 from extensions import cache
+from utils.json_encoding import register_json
+from utils.compression import register_compression
+from utils import ledger_mirror, emission_rollups
 
 app = Flask(__name__)
 
@@ -41,11 +46,15 @@ api = Api(
     security='apikey'
 )
 
+# Serialize responses (including datetime, date and Decimal values) with the fast encoder
+register_json(app, api)
+
 models = register_models(api)
 invoice_ns.models = models
 batch_ns.models = models
 product_ns.models = models
 emissions_ns.models = models
+changes_ns.models = models
 auth_ns = Namespace('auth', description='Authentication operations')
 
 # Add namespaces to the API
@@ -54,6 +63,8 @@ api.add_namespace(invoice_ns, path='/api')
 api.add_namespace(batch_ns, path='/api')
 api.add_namespace(product_ns, path='/api')
 api.add_namespace(emissions_ns, path='/api')
+api.add_namespace(system_ns, path='/api')
+api.add_namespace(changes_ns, path='/api')
 
 app = register_auth_routes(app, auth_ns)
 
@@ -65,10 +76,23 @@ def start_timer():
 def log_request_performance(response):
     if hasattr(request, '_start_time'):
         duration = time.perf_counter() - request._start_time
-        print(f"[PERF] {request.method} {request.path} took {duration:.4f} seconds")
+        pool_wait = getattr(g, '_db_pool_wait', 0.0)
+        print(f"[PERF] {request.method} {request.path} took {duration:.4f} seconds (db pool wait {pool_wait:.4f}s)")
         response.headers['X-Request-Duration'] = f"{duration:.4f}s"
+        response.headers['X-DB-Pool-Wait'] = f"{pool_wait:.4f}s"
     return response
 
+# Registered after the timer so compression runs first and is included in the request duration
+register_compression(app)
+
+# Keep the local mirror of ledger products fresh
+if ledger_mirror.LEDGER_SYNC_INTERVAL > 0:
+    ledger_mirror.start_sync(ledger_mirror.LEDGER_SYNC_INTERVAL)
+
+# Fold new invoices into the emission rollups behind /emissions/summary
+if emission_rollups.EMISSION_ROLLUP_INTERVAL > 0:
+    emission_rollups.start_refresh(app, emission_rollups.EMISSION_ROLLUP_INTERVAL)
+
 # Custom error handler for the API
 
 @api.errorhandler(Exception)
@@ -5,7 +5,10 @@ def register_models(api):
     # Transaction processing models
     transaction_response = api.model('TransactionResponse', {
         'message': fields.String(description='Status message'),
-        'transaction_id': fields.String(description='Unique transaction ID')
+        'transaction_id': fields.String(description='Unique transaction ID'),
+        'files': fields.Integer(description='XML files in the upload'),
+        'reused': fields.Integer(description='Files whose result from an earlier upload was reused'),
+        'duplicates': fields.Integer(description='Repeats of a file earlier in the upload')
     })
 
     transaction_detail = api.model('TransactionDetail', {
@@ -51,6 +54,24 @@ def register_models(api):
         'batchId': fields.String(description='Batch ID')
     })
 
+    bulk_batch_request = api.model('BulkBatchRequest', {
+        'batches': fields.List(fields.Nested(batch_request), required=True, description='Batch requests, each as for /create-batch')
+    })
+
+    bulk_batch_result = api.model('BulkBatchResult', {
+        'index': fields.Integer(description='Position of the batch request in the submission'),
+        'status': fields.Integer(description='HTTP status /create-batch would have returned'),
+        'productId': fields.String(description='Product ID'),
+        'batchId': fields.String(description='Batch ID'),
+        'error': fields.String(description='Error message of a failed batch request')
+    })
+
+    bulk_batch_response = api.model('BulkBatchResponse', {
+        'created': fields.Integer(description='Batches created'),
+        'failed': fields.Integer(description='Batch requests that failed'),
+        'results': fields.List(fields.Nested(bulk_batch_result), description='One result per batch request, in order')
+    })
+
     # Product models
     batch_info = api.model('BatchInfo', {
         'id': fields.String(description='Batch ID'),
@@ -63,7 +84,10 @@ def register_models(api):
     product_detail = api.model('ProductDetail', {
         'productId': fields.String(description='Product ID'),
         'productName': fields.String(description='Product name'),
-        'batches': fields.List(fields.Nested(batch_info), description='List of batches')
+        'batchCount': fields.Integer(description='Number of batches'),
+        'relatedSuppliers': fields.List(fields.String, description='Distinct supplier names'),
+        'invoiceCount': fields.Integer(description='Number of invoices across all batches'),
+        'totalAmount': fields.Float(description='Sum of invoice total amounts')
     })
 
     sustainability_metric = api.model('SustainabilityMetric', {
@@ -102,15 +126,47 @@ def register_models(api):
         'organizational_unit': fields.String(description='Organizational unit'),
         'facility': fields.String(description='Facility')
     })
+    invoice_aggregate = api.model('InvoiceAggregate', {
+        'group': fields.Raw(description='Grouping key, e.g. {"facility": "Helsinki"}'),
+        'currency': fields.String(description='Currency of the totals'),
+        'invoiceCount': fields.Integer(description='Number of invoices'),
+        'totalAmount': fields.Float(description='Sum of invoice amounts'),
+        'unitsBought': fields.Float(description='Sum of units bought'),
+        'perUnitInvoices': fields.Integer(description='Invoices whose emissions are per unit'),
+        'firstInvoiceDate': fields.String(description='Earliest invoice date'),
+        'lastInvoiceDate': fields.String(description='Latest invoice date')
+    })
+    # Change feed models
+    change_entry = api.model('ChangeEntry', {
+        'seq': fields.Integer(description='Position in the change log'),
+        'entity': fields.String(description="'user', 'product', 'batch' or 'invoice'"),
+        'id': fields.String(description='ID of the changed entity'),
+        'op': fields.String(description="'insert', 'update' or 'delete'"),
+        'parentId': fields.String(description='Product of a batch, batch of an invoice'),
+        'changedAt': fields.DateTime(description='Time of the change')
+    })
+
+    change_feed = api.model('ChangeFeed', {
+        'changes': fields.List(fields.Nested(change_entry), description='Changes after since, oldest first'),
+        'next_since': fields.String(description='since value for the next request'),
+        'has_more': fields.Boolean(description='Whether more changes are available right away')
+    })
+
       # Return models as a dictionary
     return {
         'transaction_response': transaction_response,
         'transaction_detail': transaction_detail,
         'batch_request': batch_request,
         'batch_response': batch_response,
+        'bulk_batch_request': bulk_batch_request,
+        'bulk_batch_result': bulk_batch_result,
+        'bulk_batch_response': bulk_batch_response,
         'product_detail': product_detail,
         'product_list_item': product_list_item,
         'sustainability_metric': sustainability_metric,
         'emissions_model': emissions_model,
-        'invoice_model': invoice_model
+        'invoice_model': invoice_model,
+        'invoice_aggregate': invoice_aggregate,
+        'change_entry': change_entry,
+        'change_feed': change_feed
     }
\ No newline at end of file
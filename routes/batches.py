@@ -1,15 +1,242 @@
 from flask_restx import Namespace, Resource
-from flask import request
+from flask import request, Response, stream_with_context
 from auth import token_required
 import uuid
-from datetime import datetime, date  # Add date import here
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import requests
+from requests.adapters import HTTPAdapter
+from utils import ledger_client, ledger_mirror, product_summaries, admission, change_log, archive
+from utils.ledger_client import LedgerError, LedgerUnavailable
+from utils.json_encoding import dumps
 import os
 from models import register_models
-from auth import query_db, execute_db
+from auth import query_db, execute_db, transaction
+from utils.fieldsets import read_fieldset, select_fields, wants
+from utils.pagination import page_params, keyset_filter, keyset_page, cached_count, invalidate_count, pagination
 
 batch_ns = Namespace('batches', description='Batch management operations')
 models = register_models(batch_ns)
+INSERT_INVOICE = (
+    'INSERT INTO invoices (id, batch_id, facility, organizational_unit, supplier_url, sub_category, invoice_number, invoice_date, emissions_are_per_unit, quantity_needed_per_unit, units_bought, total_amount, currency, transaction_start_date, transaction_end_date, created_at) '
+    'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
+)
+# Batch requests of a /create-batches submission saved per transaction
+BULK_BATCH_CHUNK = int(os.environ.get('BULK_BATCH_CHUNK', 50))
+# Batch requests of a chunk whose ledger calls run concurrently
+BULK_BATCH_CONCURRENCY = int(os.environ.get('BULK_BATCH_CONCURRENCY', 4))
+
+
+class BatchRequestError(Exception):
+    """A batch request that cannot be created, with the HTTP status to report."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def validate_batch_request(data):
+    if not data:
+        raise BatchRequestError('No data provided', 400)
+    if not isinstance(data, dict):
+        raise BatchRequestError('A batch request must be a JSON object', 400)
+    required_fields = ['productName', 'invoices']
+    for field in required_fields:
+        if field not in data:
+            raise BatchRequestError(f'Missing required field: {field}', 400)
+
+
+def fetch_metric_catalog(session=None):
+    """The ledger's sustainability metric definitions and their ids by name."""
+    metrics_url = f"{os.environ.get('LEDGER_URL')}/api/sustainability-metrics/"
+    try:
+        defined, _ = ledger_client.get_json(metrics_url, session=session)
+    except LedgerUnavailable:
+        raise
+    except LedgerError as e:
+        raise Exception(f"Failed to fetch sustainability metrics: {e.status_code}")
+    metric_ids = {}
+    for metric in defined:
+        # The first definition of a name wins
+        metric_ids.setdefault(metric['name'], metric['metric_id'])
+    return defined, metric_ids
+
+
+def create_ledger_batch(batch_id, invoices, catalog, session=None):
+    """Create the batch's supplier and batch products on the ledger. Returns the batch's information URL.
+
+    Invoices without a supplier URL get one for the supplier product created for them.
+    """
+    sustainability_metrics_defined, metric_ids = catalog
+    sustainability_metrics = {}
+    for invoice in invoices:
+        if 'sustainabilityMetrics' in invoice:
+            metrics = invoice['sustainabilityMetrics']
+            for metric in metrics:
+                if 'name' in metric and 'value' in metric:
+                    name = metric['name']
+                    value = metric['value']
+                    if name not in sustainability_metrics:
+                        sustainability_metrics[name] = 0
+                    if invoice["emissionsArePerUnit"] == 'YES':
+                        sustainability_metrics[name] += value * float(invoice['quantityNeededPerUnit'])
+                    else:
+                        sustainability_metrics[name] += value / float(invoice['unitsBought']) * float(invoice['quantityNeededPerUnit'])
+
+    # 1. Build sustainability metrics input
+    sustainability_metrics_input = []
+    for metric in sustainability_metrics_defined:
+        metric_id = metric['metric_id']
+        name = metric['name']
+        if name in sustainability_metrics:
+            sustainability_metrics_input.append({
+                'metric_id': metric_id,
+                'value': sustainability_metrics[name]
+            })
+
+    # 2. Format suppliers
+    suppliers = []
+    for supplier in invoices:
+        formatted_metrics = []
+        if 'sustainabilityMetrics' in supplier:
+            for metric in supplier['sustainabilityMetrics']:
+                name = metric.get('name')
+                value = metric.get('value')
+                if name and value is not None:
+                    metric_id = metric_ids.get(name)
+                    if metric_id:
+                        formatted_metrics.append({'metric_id': metric_id, 'value': value})
+            supplier['formattedMetrics'] = formatted_metrics
+
+        # 3. Ensure supplier URL exists or create supplier product
+        slug = None
+        if supplier.get('url') and supplier['url'] not in ('', 'None'):
+            slug = supplier['url'].split('/')[-1]
+        else:
+            new_product = {
+                "name": supplier['productName'],
+                "manufacturer": {
+                    "name": "",
+                    "mainURL": "http://localhost"
+                },
+                "sustainability_metrics_input": formatted_metrics,
+                "number_of_units": supplier['unitsBought'],
+                "subparts": []
+            }
+            create_url = f"{os.environ.get('LEDGER_URL')}/api/products/"
+            create_response = ledger_client.request('POST', create_url, session=session, json=new_product)
+            if create_response.status_code not in (200, 201):
+                raise Exception(f"Failed to create product: {create_response.status_code} - {create_response.text}")
+            created = create_response.json()
+            slug = created.get('slug')
+            if not slug:
+                raise Exception('Product created but no slug returned')
+            supplier['url'] = f"{os.environ.get('LEDGER_URL')}/api/products/{slug}/"
+
+        suppliers.append({
+            "name": supplier['productName'],
+            "sustainability_metrics_input": formatted_metrics,
+            "quantity_needed_per_unit": float(supplier['quantityNeededPerUnit']),
+            "units_bought": float(supplier['unitsBought']),
+            "manufacturer": {
+                "name": "",
+                "mainURL": "http://localhost"
+            },
+            "slug": slug
+        })
+
+    # 4. Create batch product (template)
+    batch_template = {
+        "name": f"{batch_id}",
+        "manufacturer": {
+            "mainURL": "http://localhost"
+        },
+        "sustainability_metrics_input": sustainability_metrics_input,
+        "number_of_units": 1,
+        "subparts": []
+    }
+
+    create_batch_url = f"{os.environ.get('LEDGER_URL')}/api/products/"
+    batch_response = ledger_client.request('POST', create_batch_url, session=session, json=batch_template)
+    if batch_response.status_code not in (200, 201):
+        raise Exception(f"Failed to create batch: {batch_response.status_code} - {batch_response.text}")
+    batch_data = batch_response.json()
+    slug = batch_data.get('slug')
+    if not slug:
+        raise Exception('Batch created but no slug returned')
+    return f"{os.environ.get('LEDGER_URL')}/api/products/{slug}/"
+
+
+def save_batches(batches, user_id):
+    """Save products, batches and invoices of created batches in one transaction.
+
+    Each batch is a dict with product_id, owner_id, product_name,
+    create_product, batch_id, information_url and invoices. The rows are
+    logged to the change log in the same transaction. Supplier names for the product
+    summaries are resolved before the transaction opens; the connection is
+    only checked out after all ledger I/O has finished.
+    """
+    names = product_summaries.batch_supplier_names(
+        [invoice.get('url') for invoice in batch['invoices']] for batch in batches
+    )
+
+    now = datetime.utcnow()
+    with transaction() as conn:
+        with conn.cursor() as cur:
+            products = [
+                [batch['product_id'], batch['product_name'], user_id, now] for batch in batches if batch['create_product']
+            ]
+            if products:
+                cur.executemany('INSERT INTO products (id, name, user_id, created_at) VALUES (%s, %s, %s, %s)', products)
+            cur.executemany(
+                'INSERT INTO batches (id, product_id, information_url, created_at) VALUES (%s, %s, %s, %s)',
+                [[batch['batch_id'], batch['product_id'], batch['information_url'], now] for batch in batches]
+            )
+            invoices = [
+                [str(uuid.uuid4()), batch['batch_id'], invoice['facility'], invoice['organizationalUnit'], invoice['url'], invoice['subCategory'], invoice['invoiceNumber'], invoice['invoiceDate'], invoice['emissionsArePerUnit'] == 'YES', invoice['quantityNeededPerUnit'], invoice['unitsBought'], invoice['totalAmount'], invoice['currency'], invoice['transactionStartDate'], invoice['transactionEndDate'], now]
+                for batch in batches for invoice in batch['invoices']
+            ]
+            if invoices:
+                cur.executemany(INSERT_INVOICE, invoices)
+            # Changes are logged for the owner of the product, who may not be the creator of the batch
+            owners = {batch['batch_id']: batch['owner_id'] or user_id for batch in batches}
+            change_log.record_changes(cur, (
+                [('product', row[0], 'insert', user_id, None) for row in products]
+                + [('batch', batch['batch_id'], 'insert', batch['owner_id'] or user_id, batch['product_id']) for batch in batches]
+                + [('invoice', row[0], 'insert', owners[row[1]], row[1]) for row in invoices]
+            ))
+
+        for batch, (batch_names, names_complete) in zip(batches, names):
+            product_summaries.add_batch(
+                batch['product_id'], batch['invoices'], batch_names, names_complete, batch['create_product']
+            )
+
+    # Listing totals are cached; drop the ones these batches changed
+    if any(batch['create_product'] for batch in batches):
+        invalidate_count('products')
+    # Batch lists are counted per product owner, and a batch may be added to another user's product
+    for owner_id in {batch['owner_id'] or user_id for batch in batches}:
+        invalidate_count(f"batches:{owner_id}")
+        invalidate_count(f"batches:{owner_id}:archived")
+
+
+def new_batch(data, product_id=None, owner_id=None):
+    """The batch dict save_batches expects, before its ledger calls.
+
+    owner_id is the user_id of an existing product.
+    """
+    return {
+        'product_id': product_id or str(uuid.uuid4()),
+        'owner_id': owner_id,
+        'product_name': data['productName'],
+        # New products are inserted together with the batch once the ledger calls have succeeded
+        'create_product': not product_id,
+        'batch_id': str(uuid.uuid4()),
+        'information_url': None,
+        'invoices': data['invoices']
+    }
+
+
 @batch_ns.route('/create-batch')
 class CreateBatch(Resource):
     @batch_ns.doc('create_batch')
@@ -19,200 +246,212 @@ class CreateBatch(Resource):
     @batch_ns.response(404, 'Product not found')
     @batch_ns.response(500, 'Internal server error')
     @batch_ns.response(401, 'Unauthorized')
+    @batch_ns.response(429, 'Too many requests')
     @token_required
+    @admission.limit('create_batch')
     def post(self, current_user):
         """Create a new batch for a product"""
         data = request.get_json()
-        
-        if not data:
-            return {'error': 'No data provided'}, 400
-        
-        required_fields = ['productName', 'invoices']
-        for field in required_fields:
-            if field not in data:
-                return {'error': f'Missing required field: {field}'}, 400
-        
+        try:
+            validate_batch_request(data)
+        except BatchRequestError as e:
+            return {'error': str(e)}, e.status_code
+
         product_id = data.get('productId')
-        product_name = data['productName']
-        
         if product_id:
-            product = query_db('SELECT * FROM products WHERE id = %s', [product_id], one=True)
+            product = query_db('SELECT * FROM products WHERE id = %s', [product_id], one=True, primary=True)
             if not product:
                 return {'error': 'Product not found'}, 404
-        else:
-            product_id = str(uuid.uuid4())
-            execute_db(
-                'INSERT INTO products (id, name, user_id, created_at) VALUES (%s, %s, %s, %s)',
-                [product_id, product_name, current_user['id'], datetime.utcnow()]
-            )
-        
-        batch_id = str(uuid.uuid4())
-
-        invoices = data['invoices']
-        sustainability_metrics = {}
-        for invoice in invoices:
-            if 'sustainabilityMetrics' in invoice:
-                metrics = invoice['sustainabilityMetrics']
-                for metric in metrics:
-                    if 'name' in metric and 'value' in metric:
-                        name = metric['name']
-                        value = metric['value']
-                        if name not in sustainability_metrics:
-                            sustainability_metrics[name] = 0
-                        if invoice["emissionsArePerUnit"] == 'YES':
-                            sustainability_metrics[name] += value * float(invoice['quantityNeededPerUnit'])
-                        else:
-                            sustainability_metrics[name] += value / float(invoice['unitsBought']) * float(invoice['quantityNeededPerUnit'])
+        batch = new_batch(data, product_id, product_id and product['user_id'])
 
         try:
-            # 1. Fetch defined sustainability metrics
-            metrics_url = f"{os.environ.get('LEDGER_URL')}/api/sustainability-metrics/"
-            metrics_response = requests.get(metrics_url)
-            if metrics_response.status_code != 200:
-                raise Exception(f"Failed to fetch sustainability metrics: {metrics_response.status_code}")
-            sustainability_metrics_defined = metrics_response.json()
-
-            # 2. Build sustainability metrics input
-            sustainability_metrics_input = []
-            for metric in sustainability_metrics_defined:
-                metric_id = metric['metric_id']
-                name = metric['name']
-                if name in sustainability_metrics:
-                    sustainability_metrics_input.append({
-                        'metric_id': metric_id,
-                        'value': sustainability_metrics[name]
-                    })
-
-            # 3. Format suppliers
-            suppliers = []
-            for supplier in invoices:
-                formatted_metrics = []
-                if 'sustainabilityMetrics' in supplier:
-                    for metric in supplier['sustainabilityMetrics']:
-                        name = metric.get('name')
-                        value = metric.get('value')
-                        if name and value is not None:
-                            metric_id = next((m['metric_id'] for m in sustainability_metrics_defined if m['name'] == name), None)
-                            if metric_id:
-                                formatted_metrics.append({'metric_id': metric_id, 'value': value})
-                    supplier['formattedMetrics'] = formatted_metrics
-
-                # 4. Ensure supplier URL exists or create supplier product
-                slug = None
-                if supplier.get('url') and supplier['url'] not in ('', 'None'):
-                    slug = supplier['url'].split('/')[-1]
-                else:
-                    new_product = {
-                        "name": supplier['productName'],
-                        "manufacturer": {
-                            "name": "",
-                            "mainURL": "http://localhost"
-                        },
-                        "sustainability_metrics_input": formatted_metrics,
-                        "number_of_units": supplier['unitsBought'],
-                        "subparts": []
-                    }
-                    create_url = f"{os.environ.get('LEDGER_URL')}/api/products/"
-                    create_response = requests.post(create_url, json=new_product)
-                    if create_response.status_code not in (200, 201):
-                        raise Exception(f"Failed to create product: {create_response.status_code} - {create_response.text}")
-                    created = create_response.json()
-                    slug = created.get('slug')
-                    if not slug:
-                        raise Exception('Product created but no slug returned')
-                    supplier['url'] = f"{os.environ.get('LEDGER_URL')}/api/products/{slug}/"
-
-                suppliers.append({
-                    "name": supplier['productName'],
-                    "sustainability_metrics_input": formatted_metrics,
-                    "quantity_needed_per_unit": float(supplier['quantityNeededPerUnit']),
-                    "units_bought": float(supplier['unitsBought']),
-                    "manufacturer": {
-                        "name": "",
-                        "mainURL": "http://localhost"
-                    },
-                    "slug": slug
-                })
-
-            # 5. Create batch product (template)
-            batch_template = {
-                "name": f"{batch_id}",
-                "manufacturer": {
-                    "mainURL": "http://localhost"
-                },
-                "sustainability_metrics_input": sustainability_metrics_input,
-                "number_of_units": 1,
-                "subparts": []
-            }
-
-            create_batch_url = f"{os.environ.get('LEDGER_URL')}/api/products/"
-            batch_response = requests.post(create_batch_url, json=batch_template)
-            if batch_response.status_code not in (200, 201):
-                raise Exception(f"Failed to create batch: {batch_response.status_code} - {batch_response.text}")
-            batch_data = batch_response.json()
-            slug = batch_data.get('slug')
-            if not slug:
-                raise Exception('Batch created but no slug returned')
-            information_url = f"{os.environ.get('LEDGER_URL')}/api/products/{slug}/"
-
-            # Save batch to database
-            execute_db(
-                'INSERT INTO batches (id, product_id, information_url, created_at) VALUES (%s, %s, %s, %s)',
-                [batch_id, product_id, information_url, datetime.utcnow()]
-            )
-
-            # Create invoices
-            for invoice in invoices:
-                invoice_id = str(uuid.uuid4())
-                execute_db(
-                    'INSERT INTO invoices (id, batch_id, facility, organizational_unit, supplier_url, sub_category, invoice_number, invoice_date, emissions_are_per_unit, quantity_needed_per_unit, units_bought, total_amount, currency, transaction_start_date, transaction_end_date, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
-                    [invoice_id, batch_id, invoice['facility'], invoice['organizationalUnit'], invoice['url'], invoice['subCategory'], invoice['invoiceNumber'], invoice['invoiceDate'], invoice['emissionsArePerUnit'], invoice['quantityNeededPerUnit'], invoice['unitsBought'], invoice['totalAmount'], invoice['currency'], invoice['transactionStartDate'], invoice['transactionEndDate'], datetime.utcnow()]
-                )
+            batch['information_url'] = create_ledger_batch(batch['batch_id'], batch['invoices'], fetch_metric_catalog())
+            save_batches([batch], current_user['id'])
 
             return {
                 'message': 'Batch created successfully',
-                'productId': product_id,
-                'batchId': batch_id
+                'productId': batch['product_id'],
+                'batchId': batch['batch_id']
             }, 200
 
+        except LedgerUnavailable as e:
+            return {'error': f'Ledger unavailable, try again later: {str(e)}'}, 503
         except Exception as e:
-            # Clean up any created batches if error occurs
-            execute_db('DELETE FROM batches WHERE id = %s', [batch_id])
+            # The DB writes are transactional, so only ledger-side records can be left behind
             return {'error': f'Error creating batch: {str(e)}'}, 500
 
+
+def bulk_batch_results(items, user_id):
+    """Create a /create-batches submission chunk by chunk, yielding one result per item as it is saved.
+
+    One metric catalog fetch and one pooled ledger session serve the whole
+    submission; each chunk's ledger calls run concurrently and its rows are
+    written in one transaction.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=BULK_BATCH_CONCURRENCY)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    executor = ThreadPoolExecutor(max_workers=BULK_BATCH_CONCURRENCY, thread_name_prefix='bulk-batches')
+    try:
+        product_ids = list({item.get('productId') for item in items if isinstance(item, dict) and item.get('productId')})
+        existing = {}  # product id -> owner
+        for start in range(0, len(product_ids), 1000):
+            chunk = product_ids[start:start + 1000]
+            rows = query_db(
+                'SELECT id, user_id FROM products WHERE id IN ({})'.format(','.join(['%s'] * len(chunk))), chunk, primary=True
+            )
+            existing.update((row['id'], row['user_id']) for row in rows)
+
+        catalog = None
+        for start in range(0, len(items), BULK_BATCH_CHUNK):
+            pending = {}
+            for index in range(start, min(start + BULK_BATCH_CHUNK, len(items))):
+                data = items[index]
+                try:
+                    validate_batch_request(data)
+                    if data.get('productId') and data['productId'] not in existing:
+                        raise BatchRequestError('Product not found', 404)
+                    if catalog is None:
+                        catalog = fetch_metric_catalog(session)
+                except BatchRequestError as e:
+                    yield {'index': index, 'status': e.status_code, 'error': str(e)}
+                    continue
+                except LedgerUnavailable as e:
+                    yield {'index': index, 'status': 503, 'error': f'Ledger unavailable, try again later: {str(e)}'}
+                    continue
+                except Exception as e:
+                    yield {'index': index, 'status': 500, 'error': f'Error creating batch: {str(e)}'}
+                    continue
+                batch = new_batch(data, data.get('productId'), existing.get(data.get('productId')))
+                pending[index] = (batch, executor.submit(
+                    create_ledger_batch, batch['batch_id'], batch['invoices'], catalog, session
+                ))
+
+            created = []
+            for index, (batch, future) in pending.items():
+                try:
+                    batch['information_url'] = future.result()
+                    created.append((index, batch))
+                except LedgerUnavailable as e:
+                    yield {'index': index, 'status': 503, 'error': f'Ledger unavailable, try again later: {str(e)}'}
+                except Exception as e:
+                    yield {'index': index, 'status': 500, 'error': f'Error creating batch: {str(e)}'}
+            if not created:
+                continue
+
+            try:
+                save_batches([batch for _, batch in created], user_id)
+            except Exception as e:
+                # The chunk was rolled back as a whole; save its batches one by one so only the failing ones fail
+                print(f"[BULK] Saving {len(created)} batches together failed, saving them one by one: {str(e)}")
+                for index, batch in created:
+                    try:
+                        save_batches([batch], user_id)
+                    except Exception as e:
+                        # Only ledger-side records are left behind
+                        yield {'index': index, 'status': 500, 'error': f'Error creating batch: {str(e)}'}
+                    else:
+                        yield {'index': index, 'status': 200, 'productId': batch['product_id'], 'batchId': batch['batch_id']}
+                continue
+            for index, batch in created:
+                yield {'index': index, 'status': 200, 'productId': batch['product_id'], 'batchId': batch['batch_id']}
+    finally:
+        executor.shutdown(wait=True)
+        session.close()
+
+
+def _bulk_items():
+    data = request.get_json(silent=True)
+    return data.get('batches') if isinstance(data, dict) else None
+
+
+@batch_ns.route('/create-batches')
+class CreateBatches(Resource):
+    @batch_ns.doc('create_batches', params={'stream': 'true to stream one NDJSON line per batch as it is saved'})
+    @batch_ns.expect(models['bulk_batch_request'])
+    @batch_ns.response(200, 'Per-batch results', models['bulk_batch_response'])
+    @batch_ns.response(400, 'Bad request')
+    @batch_ns.response(401, 'Unauthorized')
+    @batch_ns.response(413, 'Too many batches in one request')
+    @batch_ns.response(429, 'Too many requests')
+    @token_required
+    @admission.limit('create_batches', cost=lambda: len(_bulk_items() or []))
+    def post(self, current_user):
+        """Create many batches, each like /create-batch, with per-batch results"""
+        items = _bulk_items()
+        if not isinstance(items, list) or not items:
+            return {'error': 'batches must be a non-empty list of batch requests'}, 400
+
+        results = bulk_batch_results(items, current_user['id'])
+        if request.args.get('stream', '').lower() in ('1', 'true', 'yes') \
+                or 'application/x-ndjson' in request.headers.get('Accept', ''):
+            # The stream outlives this call; its slot is released when the server closes the response, which
+            # also happens when the client disconnects before the generator has started
+            lease_id = admission.detach()
+            response = Response(
+                stream_with_context(dumps(result) + b'\n' for result in results),
+                mimetype='application/x-ndjson'
+            )
+            response.call_on_close(lambda: admission.release(lease_id))
+            return response
+
+        results = sorted(results, key=lambda result: result['index'])
+        created = sum(1 for result in results if result['status'] == 200)
+        return {'created': created, 'failed': len(results) - created, 'results': results}, 200
+
 @batch_ns.route('/batches')
 class BatchList(Resource):
     @batch_ns.doc('list_batches')
+    @batch_ns.param('cursor', 'next_cursor from the previous page')
+    @batch_ns.param('per_page', 'Items per page', type=int, default=50)
+    @batch_ns.param('include_archived', 'true to include batches of archived reporting periods')
     @batch_ns.response(200, 'Success')
+    @batch_ns.response(400, 'Invalid cursor')
     @batch_ns.response(500, 'Internal server error')
     @batch_ns.response(401, 'Unauthorized')
     @token_required
     def get(self, current_user):
-        """Retrieve all batches associated with the logged-in user's products"""
+        """Retrieve the batches associated with the logged-in user's products (paginated)"""
         try:
-            # Query all batches and their products for the current user
-            batches = query_db('''
+            cursor, per_page = page_params(50, 200)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        include_archived = archive.include_archived_param(request.args)
+
+        try:
+            # Query a page of batches and their products for the current user
+            condition, args = keyset_filter(cursor, prefix='b.')
+            batches = query_db(f'''
                 SELECT b.id, b.product_id, p.name as product_name, 
                        b.information_url, b.created_at
-                FROM batches b
+                FROM {archive.source('batches', include_archived, 'b')}
                 JOIN products p ON b.product_id = p.id
-                WHERE p.user_id = %s
-                ORDER BY b.created_at DESC
-            ''', [current_user['id']])
-            
-            # Convert datetime objects to strings
-            for batch in batches:
-                if isinstance(batch['created_at'], datetime):
-                    batch['created_at'] = batch['created_at'].isoformat()
-            
-            return {'batches': batches}, 200
+                WHERE p.user_id = %s AND {condition}
+                ORDER BY b.created_at DESC, b.id DESC
+                LIMIT %s
+            ''', [current_user['id']] + args + [per_page + 1])
+            batches, next_cursor = keyset_page(batches, per_page)
+
+            total = cached_count(
+                f"batches:{current_user['id']}{':archived' if include_archived else ''}",
+                f"SELECT COUNT(*) as count FROM {archive.source('batches', include_archived, 'b')} "
+                "JOIN products p ON b.product_id = p.id WHERE p.user_id = %s",
+                [current_user['id']]
+            )
+
+            return {'batches': batches, 'pagination': pagination(per_page, total, next_cursor)}, 200
         except Exception as e:
             return {'error': f'Error retrieving batches: {str(e)}'}, 500
 
 @batch_ns.route('/batches/<string:id>')
 class BatchDetail(Resource):
     @batch_ns.doc('get_batch')
+    @batch_ns.param('fields', 'Comma separated fields to return, e.g. batch,invoices.id,invoices.totalAmount')
+    @batch_ns.param('expand', 'Ledger data to fetch: supplierDetails,batchData (default both, empty for none)')
+    @batch_ns.param('include_archived', 'true to also look up batches of archived reporting periods')
     @batch_ns.response(200, 'Success')
+    @batch_ns.response(400, 'Invalid expand value')
     @batch_ns.response(404, 'Batch not found')
     @batch_ns.response(403, 'Forbidden - not your batch')
     @batch_ns.response(500, 'Internal server error')
@@ -221,83 +460,86 @@ class BatchDetail(Resource):
     def get(self, id, current_user):
         """Retrieve detailed information about a specific batch owned by the user"""
         try:
-            # Helper function to convert datetime objects in nested structures
-            def convert_datetime(obj):
-                if isinstance(obj, (datetime, date)):  # Handle both datetime and date objects
-                    return obj.isoformat()
-                elif isinstance(obj, dict):
-                    return {k: convert_datetime(v) for k, v in obj.items()}
-                elif isinstance(obj, list):
-                    return [convert_datetime(item) for item in obj]
-                return obj
-            
+            fields, expand = read_fieldset(['supplierDetails', 'batchData'])
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        # Only call the ledger for expansions that were requested and selected
+        expand_suppliers = 'supplierDetails' in expand and wants(fields, 'invoices', 'supplierDetails')
+        expand_batch_data = 'batchData' in expand and wants(fields, 'batchData')
+        include_archived = archive.include_archived_param(request.args)
+
+        try:
             # Get batch information with user check
-            batch = query_db('''
+            batch = query_db(f'''
                 SELECT b.id, b.product_id, p.name as product_name, 
                        b.information_url, b.created_at
-                FROM batches b
+                FROM {archive.source('batches', include_archived, 'b')}
                 JOIN products p ON b.product_id = p.id
                 WHERE b.id = %s AND p.user_id = %s
             ''', [id, current_user['id']], one=True)
             
             if not batch:
                 # Check if batch exists at all
-                exists = query_db('SELECT 1 FROM batches WHERE id = %s', [id], one=True)
+                exists = query_db(f"SELECT 1 FROM {archive.source('batches', include_archived)} WHERE id = %s", [id], one=True)
                 if exists:
                     return {'error': 'Access denied to this batch'}, 403
                 else:
                     return {'error': 'Batch not found'}, 404
             
-            if batch and isinstance(batch['created_at'], datetime):
-                batch['created_at'] = batch['created_at'].isoformat()
-
             # Get batch invoices
-            invoices = query_db('''
+            invoices = [] if not wants(fields, 'invoices') else query_db(f'''
                 SELECT id, facility, organizational_unit, supplier_url as url, 
                        sub_category as subCategory, invoice_number as invoiceNumber, invoice_date as invoiceDate, 
-                       emissions_are_per_unit as emissionsArePerUnit, quantity_needed_per_unit as quantityNeededPerUnit, 
+                       CASE WHEN emissions_are_per_unit IS NULL THEN NULL
+                            WHEN emissions_are_per_unit THEN 'YES' ELSE 'NO' END as emissionsArePerUnit,
+                       quantity_needed_per_unit as quantityNeededPerUnit, 
                        units_bought as unitsBought, total_amount as totalAmount, currency, 
                        transaction_start_date as transactionStartDate, transaction_end_date as transactionEndDate, 
                        created_at as createdAt
-                FROM invoices
+                FROM {archive.source('invoices', include_archived)}
                 WHERE batch_id = %s
             ''', [id])
             
-            # Fetch additional data from invoice URLs and batch information_url
+            # Supplier and batch data come from the local ledger mirror; only unmirrored URLs are fetched live
+            urls = [invoice['url'] for invoice in invoices] if expand_suppliers else []
+            if expand_batch_data:
+                urls.append(batch['information_url'])
+            documents, errors = ledger_mirror.resolve(urls)
+
             enriched_invoices = []
             for invoice in invoices:
                 invoice_data = invoice.copy()
                 
-                # Fetch supplier data if URL is available
-                if invoice['url']:
-                    try:
-                        supplier_response = requests.get(invoice['url'])
-                        if supplier_response.status_code == 200:
-                            invoice_data['supplierDetails'] = supplier_response.json()
-                    except Exception as e:
-                        invoice_data['supplierFetchError'] = str(e)
+                # Attach supplier data if URL is available
+                if expand_suppliers and invoice['url']:
+                    if invoice['url'] in documents:
+                        invoice_data['supplierDetails'], stale, _ = documents[invoice['url']]
+                        if stale:
+                            invoice_data['supplierDetailsStale'] = True
+                    elif isinstance(errors.get(invoice['url']), LedgerUnavailable):
+                        invoice_data['supplierFetchError'] = str(errors[invoice['url']])
                 
                 enriched_invoices.append(invoice_data)
             
             # Get batch data from information_url if available
             batch_data = {}
-            if batch['information_url']:
-                try:
-                    batch_response = requests.get(batch['information_url'])
-                    if batch_response.status_code == 200:
-                        batch_data = batch_response.json()
-                except Exception as e:
-                    batch_data = {'fetchError': str(e)}
+            batch_data_stale = False
+            if expand_batch_data and batch['information_url']:
+                if batch['information_url'] in documents:
+                    batch_data, batch_data_stale, _ = documents[batch['information_url']]
+                elif isinstance(errors.get(batch['information_url']), LedgerUnavailable):
+                    batch_data = {'fetchError': str(errors[batch['information_url']])}
             
             result = {
                 'batch': batch,
                 'batchData': batch_data,
                 'invoices': enriched_invoices
             }
+            if batch_data_stale:
+                result['batchDataStale'] = True
             
-            # Convert all datetime objects to strings
-            result = convert_datetime(result)
-            
-            return result, 200
+            # datetime and date values are serialized by the app-wide JSON encoder
+            return select_fields(result, fields), 200, ledger_mirror.freshness_headers(documents)
         except Exception as e:
             return {'error': f'Error retrieving batch details: {str(e)}'}, 500
\ No newline at end of file
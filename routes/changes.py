@@ -0,0 +1,46 @@
+from flask_restx import Namespace, Resource
+from flask import request
+from auth import token_required
+from models import register_models
+from utils import change_log
+
+changes_ns = Namespace('changes', description='Change feed for syncing products, batches and invoices')
+models = register_models(changes_ns)
+
+@changes_ns.route('/changes')
+class ChangeFeed(Resource):
+    @changes_ns.doc('get_changes')
+    @changes_ns.param('since', 'next_since from the previous response (omit to read from the start of the log)')
+    @changes_ns.param('per_page', 'Changes per page', type=int, default=500)
+    @changes_ns.param('entity', 'Comma separated entities to return: user, product, batch, invoice (default all)')
+    @changes_ns.response(200, 'Success', models['change_feed'])
+    @changes_ns.response(400, 'Invalid since or entity value')
+    @changes_ns.response(401, 'Unauthorized')
+    @token_required
+    def get(self, current_user):
+        """Inserts, updates and deletes after a cursor, oldest first (admins see every user's changes)"""
+        try:
+            since = change_log.parse_since(request.args.get('since'))
+            entities = change_log.parse_entities(request.args.get('entity'))
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        per_page = max(1, min(request.args.get('per_page', 500, type=int), 5000))
+
+        rows, has_more = change_log.read_changes(
+            since, per_page, None if current_user['role'] == 'admin' else current_user['id'], entities
+        )
+        changes = [{
+            'seq': row['seq'],
+            'entity': row['entity'],
+            'id': row['entity_id'],
+            'op': row['op'],
+            'parentId': row['parent_id'],
+            'changedAt': row['changed_at']
+        } for row in rows]
+
+        # An empty page keeps the cursor where it was; poll again with the same value
+        return {
+            'changes': changes,
+            'next_since': str(rows[-1]['seq'] if rows else since),
+            'has_more': has_more
+        }, 200
@@ -1,8 +1,9 @@
 from flask_restx import Namespace, Resource
 from datetime import datetime, date
 from auth import query_db
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import request, Response, stream_with_context
+from utils import ledger_mirror, emission_rollups, columnar_export, archive
+from utils.records import EmissionRecord
 from extensions import cache
 
 from models import register_models
@@ -10,6 +11,24 @@ from models import register_models
 emissions_ns = Namespace('emissions', description='Emissions data operations')
 models = register_models(emissions_ns)
 
+# Emission category for each ledger metric / invoice sub-category name
+EMISSION_SUBCATEGORIES = {
+    'Stationary Combustion': 'Scope 1',
+    'Mobile Combustion': 'Scope 1',
+    'Process Emissions': 'Scope 1',
+    'Purchased Electricity': 'Scope 2',
+    'Purchased Heat': 'Scope 2',
+    'Purchased Steam': 'Scope 2',
+    'Purchased Cooling': 'Scope 2',
+    'Waste Disposal': 'Scope 3',
+    'Business Travel': 'Scope 3',
+    'Employee Commuting': 'Scope 3',
+    'Purchased Goods and Services': 'Scope 3',
+    'Purchased Electricity (Energy)': 'Energy',
+    'Water Quantities': 'Water',
+    'Water Quality': 'Water',
+}
+
 def format_date(date_obj):
     """Convert date objects to ISO format strings"""
     if date_obj is None:
@@ -20,147 +39,124 @@ def format_date(date_obj):
         return date_obj.isoformat()
     return date_obj  # Return as is if it's already a string or other type
 
-def fetch_and_process_supplier(supplier, subcategories):
-    """Process a single supplier synchronously"""
-    try:
-        # Make HTTP request with timeout
-        response = requests.get(supplier['supplier_url'], timeout=10)
-        
-        if response.status_code != 200:
-            print(f"HTTP {response.status_code} for {supplier['supplier_url']}")
-            return []
-        
-        supplier_data = response.json()
-        
-        # Process emissions data
-        emissions = 0
-        water_consumption = 0
-        energy_consumption = 0
-        metricsArePerUnit = supplier.get('emissions_are_per_unit', 'NO')
-        quantityNeededPerUnit = float(supplier.get('quantity_needed_per_unit', 1))
-        unitsBought = float(supplier.get('units_bought', 1))
-        
-        if 'sustainability_metrics' in supplier_data:
-            for metric in supplier_data['sustainability_metrics']:
-                category = subcategories.get(metric.get('name'), 'Unknown')
-                metric_value = metric.get('value', 0)
-                multiplier = quantityNeededPerUnit if metricsArePerUnit == 'YES' else quantityNeededPerUnit / unitsBought
-                
-                if category in ['Scope 1', 'Scope 2', 'Scope 3']:
-                    emissions += metric_value * multiplier
-                elif category == 'Water':
-                    water_consumption += metric_value * multiplier
-                elif category == 'Energy':
-                    energy_consumption += metric_value * multiplier
-                
-        results = []
-        base_template = {
-            'name': supplier_data.get('name'),
-            "originId": supplier_data.get('product_id'),
-            "productName": supplier_data.get('name'),
-            "description": f'{supplier_data.get("description", "")}',
-            "organizationUnit": supplier.get('organizational_unit', ''),
-            'facility': supplier.get('facility', ''),
-            "provider": supplier_data.get('manufacturer', {}).get('name', None),
-            "cost": supplier.get('total_amount', 0),
-            "costUnit": supplier.get('currency', 'EUR'),
-            "timestamp": supplier_data.get('timestamp', datetime.utcnow().isoformat()),
-            "consumptionStartDate": format_date(supplier.get('transaction_start_date')) or datetime.utcnow().isoformat(),
-            "consumptionEndDate": format_date(supplier.get('transaction_end_date')) or datetime.utcnow().isoformat(),
-            "transactionStartDate": format_date(supplier.get('transaction_start_date')) or datetime.utcnow().isoformat(),
-            "transactionEndDate": format_date(supplier.get('transaction_end_date')) or datetime.utcnow().isoformat(),
-            "emissionFactor": supplier.get('emission_factor', None),
-            "emissionFactorLibrary": supplier.get('emission_factor_library', None),
-            "waterTransactionType": supplier.get('water_transaction_type', 'Consumption'),
-            "dataQualityType": None
-        }
-        
-        # Add emissions if applicable
-        if emissions > 0:
-            emissions_template = base_template.copy()
-            emissions_template.update({
-                'quantity': emissions,
-                'quantityUnit': 'kg',
-                'emissonSource': 'Carbon emissions',
-                'emissonCategory': subcategories.get(supplier.get('sub_category'), 'Unknown'),
-                'emissonSubCategory': supplier.get('sub_category'),
-                'CO2E': emissions,
-                'CO2E_unit': 'kg',
-                'isRenewable': None,
-                'fuelType': supplier.get('fuel_type', 'Diesel Oil')
-            })
-            results.append(emissions_template)
-        
-        # Add water consumption if applicable
-        if water_consumption > 0:
-            water_template = base_template.copy()
-            water_template.update({
-                'emissonSource': 'Water',
-                'emissonCategory': 'Water',
-                'emissonSubCategory': 'Water Quantities',
-                'quantity': water_consumption,
-                'quantityUnit': 'Cubic meters',
-                'CO2E': 0,
-                'CO2E_unit': 'kg',
-                'isRenewable': None,
-                'fuelType': None
-            })
-            results.append(water_template)
-        
-        # Add energy consumption if applicable
-        if energy_consumption > 0:
-            energy_template = base_template.copy()
-            energy_template.update({
-                'emissonSource': 'Energy',
-                'emissonCategory': 'Energy',
-                'emissonSubCategory': 'Purchased Electricity (Energy)',
-                'quantity': energy_consumption,
-                'quantityUnit': 'kWh',
-                'emissionFactor': 'Facility',
-                'CO2E': 0,
-                'CO2E_unit': 'kg',
-                'isRenewable': None,
-                'fuelType': None
-            })
-            results.append(energy_template)
-
-        return results
+def _or_default(value, default):
+    return default if value is None else value
+
+def emission_totals(supplier, supplier_data, subcategories):
+    """Emissions (kg CO2e), water (m3) and energy (kWh) of an invoice row given its ledger product"""
+    emissions = 0
+    water_consumption = 0
+    energy_consumption = 0
+    metricsArePerUnit = bool(supplier.get('emissions_are_per_unit'))
+    quantityNeededPerUnit = float(_or_default(supplier.get('quantity_needed_per_unit'), 1))
+    unitsBought = float(_or_default(supplier.get('units_bought'), 1))
     
-    except requests.exceptions.Timeout:
-        print(f"Timeout error for supplier {supplier.get('id')}: {supplier.get('supplier_url')}")
-        return []
-    except requests.exceptions.RequestException as e:
-        print(f"HTTP request error for supplier {supplier.get('id')}: {str(e)}")
-        return []
-    except Exception as e:
-        print(f"Error processing supplier {supplier.get('id')}: {str(e)}")
-        return []
+    if 'sustainability_metrics' in supplier_data:
+        for metric in supplier_data['sustainability_metrics']:
+            category = subcategories.get(metric.get('name'), 'Unknown')
+            metric_value = metric.get('value', 0)
+            multiplier = quantityNeededPerUnit if metricsArePerUnit else quantityNeededPerUnit / unitsBought
+            
+            if category in ['Scope 1', 'Scope 2', 'Scope 3']:
+                emissions += metric_value * multiplier
+            elif category == 'Water':
+                water_consumption += metric_value * multiplier
+            elif category == 'Energy':
+                energy_consumption += metric_value * multiplier
+    return emissions, water_consumption, energy_consumption
+
+def build_emission_records(supplier, supplier_data, subcategories, stale=False):
+    """Turn an invoice row and its ledger product into emission, water and energy EmissionRecords"""
+    emissions, water_consumption, energy_consumption = emission_totals(supplier, supplier_data, subcategories)
+
+    results = []
+    # Fields shared by the invoice row's records; each record holds references to the same values
+    base = {
+        'name': supplier_data.get('name'),
+        "originId": supplier_data.get('product_id'),
+        "productName": supplier_data.get('name'),
+        "description": f'{supplier_data.get("description", "")}',
+        "organizationUnit": supplier.get('organizational_unit', ''),
+        'facility': supplier.get('facility', ''),
+        "provider": supplier_data.get('manufacturer', {}).get('name', None),
+        "cost": float(_or_default(supplier.get('total_amount'), 0)),
+        "costUnit": supplier.get('currency', 'EUR'),
+        "timestamp": supplier_data.get('timestamp', datetime.utcnow().isoformat()),
+        "consumptionStartDate": format_date(supplier.get('transaction_start_date')) or datetime.utcnow().isoformat(),
+        "consumptionEndDate": format_date(supplier.get('transaction_end_date')) or datetime.utcnow().isoformat(),
+        "transactionStartDate": format_date(supplier.get('transaction_start_date')) or datetime.utcnow().isoformat(),
+        "transactionEndDate": format_date(supplier.get('transaction_end_date')) or datetime.utcnow().isoformat(),
+        "emissionFactor": supplier.get('emission_factor', None),
+        "emissionFactorLibrary": supplier.get('emission_factor_library', None),
+        "waterTransactionType": supplier.get('water_transaction_type', 'Consumption'),
+        "dataQualityType": None,
+        "isStale": stale
+    }
+    
+    # Add emissions if applicable
+    if emissions > 0:
+        results.append(EmissionRecord(
+            **base,
+            quantity=emissions,
+            quantityUnit='kg',
+            emissonSource='Carbon emissions',
+            emissonCategory=subcategories.get(supplier.get('sub_category'), 'Unknown'),
+            emissonSubCategory=supplier.get('sub_category'),
+            CO2E=emissions,
+            CO2E_unit='kg',
+            isRenewable=None,
+            fuelType=supplier.get('fuel_type', 'Diesel Oil')
+        ))
+    
+    # Add water consumption if applicable
+    if water_consumption > 0:
+        results.append(EmissionRecord(
+            **base,
+            emissonSource='Water',
+            emissonCategory='Water',
+            emissonSubCategory='Water Quantities',
+            quantity=water_consumption,
+            quantityUnit='Cubic meters',
+            CO2E=0,
+            CO2E_unit='kg',
+            isRenewable=None,
+            fuelType=None
+        ))
+    
+    # Add energy consumption if applicable
+    if energy_consumption > 0:
+        results.append(EmissionRecord(
+            **dict(base, emissionFactor='Facility'),
+            emissonSource='Energy',
+            emissonCategory='Energy',
+            emissonSubCategory='Purchased Electricity (Energy)',
+            quantity=energy_consumption,
+            quantityUnit='kWh',
+            CO2E=0,
+            CO2E_unit='kg',
+            isRenewable=None,
+            fuelType=None
+        ))
+
+    return results
+
+def has_no_stale_records(response):
+    """Cache filter: skip caching responses built from stale ledger data."""
+    body = response[0] if isinstance(response, tuple) else response
+    return not (isinstance(body, list) and any(record.isStale for record in body))
 
 @emissions_ns.route('/emissions')
 class Emissions(Resource):
-    @emissions_ns.doc('get_emissions')
-    @cache.cached(timeout=600)  # Cache for 10 minutes
+    @emissions_ns.doc('get_emissions', params={
+        'include_archived': 'true to include batches and invoices of archived reporting periods'
+    })
+    @cache.cached(timeout=600, query_string=True, response_filter=has_no_stale_records)  # Cache for 10 minutes
     def get(self):
         """Endpoint to retrieve emissions data organized by suppliers"""
-        try:            
-            # Define subcategories for emissions
-            subcategories = {
-                'Stationary Combustion': 'Scope 1',
-                'Mobile Combustion': 'Scope 1',
-                'Process Emissions': 'Scope 1',
-                'Purchased Electricity': 'Scope 2',
-                'Purchased Heat': 'Scope 2',
-                'Purchased Steam': 'Scope 2',
-                'Purchased Cooling': 'Scope 2',
-                'Waste Disposal': 'Scope 3',
-                'Business Travel': 'Scope 3',
-                'Employee Commuting': 'Scope 3',
-                'Purchased Goods and Services': 'Scope 3',
-                'Purchased Electricity (Energy)': 'Energy',
-                'Water Quantities': 'Water',
-                'Water Quality': 'Water',
-            }
-            
+        try:
+            subcategories = EMISSION_SUBCATEGORIES
+            include_archived = archive.include_archived_param(request.args)
+
             # Batch fetch product data
             products = query_db('SELECT * FROM products')
             
@@ -171,8 +167,8 @@ class Emissions(Resource):
                 return [], 200
             
             # Single query to get all relevant batches
-            batches_query = 'SELECT * FROM batches WHERE product_id IN ({})'.format(
-                ','.join(['%s'] * len(product_ids))
+            batches_query = 'SELECT * FROM {} WHERE product_id IN ({})'.format(
+                archive.source('batches', include_archived), ','.join(['%s'] * len(product_ids))
             )
             
             all_batches = query_db(batches_query, product_ids)
@@ -180,8 +176,8 @@ class Emissions(Resource):
             
             # Get all invoices in one query
             if batch_ids:
-                invoices_query = 'SELECT * FROM invoices WHERE batch_id IN ({})'.format(
-                    ','.join(['%s'] * len(batch_ids))
+                invoices_query = 'SELECT * FROM {} WHERE batch_id IN ({})'.format(
+                    archive.source('invoices', include_archived), ','.join(['%s'] * len(batch_ids))
                 )
                 all_invoices = query_db(invoices_query, batch_ids)
             else:
@@ -196,32 +192,105 @@ class Emissions(Resource):
             if not valid_invoices:
                 return [], 200
             
-            # Process suppliers concurrently using ThreadPoolExecutor
+            # Supplier products come from the local ledger mirror; only unmirrored ones are fetched live
+            documents, errors = ledger_mirror.resolve(invoice['supplier_url'] for invoice in valid_invoices)
+            for url, error in errors.items():
+                print(f"Ledger error for supplier {url}: {str(error)}")
+
             all_emissions = []
-            
-            # Use ThreadPoolExecutor for concurrent HTTP requests
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                # Submit all tasks
-                future_to_supplier = {
-                    executor.submit(fetch_and_process_supplier, invoice, subcategories): invoice
-                    for invoice in valid_invoices
-                }
-                
-                # Collect results as they complete
-                for future in as_completed(future_to_supplier):
-                    try:
-                        emissions_list = future.result()
-                        if emissions_list:
-                            all_emissions.extend(emissions_list)
-                    except Exception as e:
-                        supplier = future_to_supplier[future]
-                        print(f"Error processing supplier {supplier.get('id')}: {str(e)}")
+            for invoice in valid_invoices:
+                document = documents.get(invoice['supplier_url'])
+                if document is None:
+                    continue
+                supplier_data, stale, _ = document
+                try:
+                    all_emissions.extend(build_emission_records(invoice, supplier_data, subcategories, stale))
+                except Exception as e:
+                    print(f"Error processing supplier {invoice.get('id')}: {str(e)}")
             
             print(f"Total emissions records processed: {len(all_emissions)}")
-            return all_emissions, 200
+            return all_emissions, 200, ledger_mirror.freshness_headers(documents)
             
         except Exception as e:
             print(f"Unexpected error: {str(e)}")
             import traceback
             traceback.print_exc()
-            return {"error": "Internal Server Error"}, 500
\ No newline at end of file
+            return {"error": "Internal Server Error"}, 500
+@emissions_ns.route('/emissions/summary')
+class EmissionsSummary(Resource):
+    @emissions_ns.doc('get_emissions_summary', params={
+        'from': 'First day of the range (YYYY-MM-DD), open when omitted',
+        'to': 'Last day of the range (YYYY-MM-DD), open when omitted',
+        'group_by': f"Comma-separated subset of {', '.join(emission_rollups.GROUP_COLUMNS)} (default: all)",
+        'period': "'month' for one row per month, 'total' (default) for the whole range"
+    })
+    @emissions_ns.response(400, 'Bad request')
+    @cache.cached(timeout=60, query_string=True)
+    def get(self):
+        """Emission, water and energy totals per facility, organizational unit and scope, from the rollup tables"""
+        try:
+            start, end = (
+                datetime.strptime(request.args[param], '%Y-%m-%d').date() if request.args.get(param) else None
+                for param in ('from', 'to')
+            )
+        except ValueError:
+            return {'error': 'from and to must be dates (YYYY-MM-DD)'}, 400
+        if start and end and start > end:
+            return {'error': 'from must not be after to'}, 400
+
+        group_by = [name.strip() for name in request.args.get('group_by', '').split(',') if name.strip()]
+        group_by = group_by or list(emission_rollups.GROUP_COLUMNS)
+        unknown = set(group_by) - set(emission_rollups.GROUP_COLUMNS)
+        if unknown:
+            return {'error': f"Unknown group_by value(s): {', '.join(sorted(unknown))}"}, 400
+        period = request.args.get('period', 'total')
+        if period not in ('total', 'month'):
+            return {'error': "period must be 'total' or 'month'"}, 400
+
+        created_at, _, refreshed_at = emission_rollups.watermark()
+        return {
+            'from': start.isoformat() if start else None,
+            'to': end.isoformat() if end else None,
+            'groupBy': group_by,
+            'period': period,
+            # Invoices created up to this time are included
+            'includesInvoicesUntil': created_at.isoformat() if refreshed_at else None,
+            'refreshedAt': refreshed_at.isoformat() if refreshed_at else None,
+            'rows': emission_rollups.summary(start, end, group_by, by_month=period == 'month')
+        }, 200
+
+@emissions_ns.route('/emissions/export')
+class EmissionsExport(Resource):
+    @emissions_ns.doc('export_emissions', params={
+        'format': f"One of: {', '.join(columnar_export.FORMATS)} (default: parquet)",
+        'from': 'First transaction date (YYYY-MM-DD)',
+        'to': 'Last transaction date (YYYY-MM-DD)',
+        'facility': 'Only invoices of this facility',
+        'include_archived': 'true to include invoices of archived reporting periods'
+    })
+    @emissions_ns.response(400, 'Bad request')
+    @emissions_ns.response(501, 'pyarrow is not installed')
+    def get(self):
+        """Stream the /emissions records as Parquet or an Arrow IPC stream, one row group per chunk of invoices"""
+        if not columnar_export.available():
+            return {'error': 'Columnar export requires pyarrow'}, 501
+        fmt = request.args.get('format', 'parquet')
+        if fmt not in columnar_export.FORMATS:
+            return {'error': f"format must be one of: {', '.join(columnar_export.FORMATS)}"}, 400
+        try:
+            start, end = (
+                datetime.strptime(request.args[param], '%Y-%m-%d').date() if request.args.get(param) else None
+                for param in ('from', 'to')
+            )
+        except ValueError:
+            return {'error': 'from and to must be dates (YYYY-MM-DD)'}, 400
+
+        mimetype, extension = columnar_export.FORMATS[fmt]
+        records = columnar_export.iter_records(
+            start, end, request.args.get('facility') or None, archive.include_archived_param(request.args)
+        )
+        return Response(
+            stream_with_context(columnar_export.stream(records, fmt)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename=emissions.{extension}'}
+        )
@@ -2,30 +2,102 @@
 from flask_restx import Namespace, Resource
 from flask import request
 from auth import token_required
-from utils.xml_parser import process_multiple_xml_files
+from utils.fair_scheduler import scheduler
 from utils.helpers import schedule_transaction_deletion
+from utils.upload_archives import UploadFiles, UploadError, UPLOAD_MAX_FILES
 import uuid
 import json
 from datetime import datetime, timedelta
 from auth import query_db, execute_db
-import asyncio
 from flask_restx import Api, Resource, fields, Namespace
-from concurrent.futures import ThreadPoolExecutor
-from flask import current_app, copy_current_request_context
 from models import register_models
+from utils import async_db, admission, ingest_dedup, json_encoding
 
 invoice_ns = Namespace('invoices', description='Invoice processing operations')
 models = register_models(invoice_ns)
+
+# group_by value -> {response key: column}
+AGGREGATE_GROUPS = {
+    'batch': {'batchId': 'b.id'},
+    'product': {'productId': 'p.id', 'productName': 'p.name'},
+    'facility': {'facility': 'i.facility'},
+    'subCategory': {'subCategory': 'i.sub_category'}
+}
+def submit_transaction(transaction_id, user_id, upload, ingest, lease_id):
+    """Queue a transaction's new files on the fair scheduler, storing each file's result as it completes.
+
+    `ingest` is the upload's ingest_dedup plan: reused results and in-upload
+    duplicates are filled in when the new files are done. The files to
+    process are read from `upload` again as the scheduler reaches them.
+    """
+    update = 'UPDATE transactions SET result = %s, deletion_scheduled_at = %s WHERE id = %s'
+    insert_file = ('INSERT INTO transaction_files (transaction_id, file_index, filename, status, result, created_at) '
+                   'VALUES (%s, %s, %s, %s, %s, %s)')
+    results = [None] * len(ingest.filenames)
+
+    def items():
+        # Runs in the scheduler's reader thread; reused and duplicate files are skipped unread
+        try:
+            yield from upload.select({index for index, _, _, _ in ingest.process})
+        except Exception as e:
+            # The upload was read once already; files not reached stay without a result
+            print(f"Error reading upload of transaction {transaction_id}: {str(e)}")
+
+    async def save_file(job_index, filename, result):
+        index, _, key, identity = ingest.process[job_index]
+        results[index] = result
+        await async_db.execute_db(
+            insert_file,
+            [transaction_id, index, filename, 'error' if 'error' in result else 'ok',
+             json_encoding.dumps(result).decode('utf-8'), datetime.utcnow()]
+        )
+        await ingest_dedup.record(key, user_id, identity, transaction_id, result)
+
+    async def finish(_):
+        print(f"Transaction {transaction_id} completed")
+        try:
+            copies = []
+            for index, result in ingest.reused.items():
+                results[index] = result
+                copies.append((index, 'reused', result))
+            for index, first in ingest.duplicates.items():
+                results[index] = results[first]
+                copies.append((index, 'duplicate', results[first]))
+            if copies:
+                await async_db.executemany_db(insert_file, [
+                    [transaction_id, index, ingest.filenames[index], status, json_encoding.dumps(result).decode('utf-8'), datetime.utcnow()]
+                    for index, status, result in copies
+                ])
+            # Just update the transaction - the upload request already created it
+            await async_db.execute_db(
+                update,
+                [json_encoding.dumps(results).decode('utf-8'), (datetime.utcnow() + timedelta(hours=24)), transaction_id]
+            )
+        except Exception as e:
+            print(f"Error saving transaction {transaction_id}: {e}")
+            await async_db.execute_db(
+                update,
+                [f'Error saving transaction: {str(e)}', (datetime.utcnow() + timedelta(hours=24)), transaction_id]
+            )
+        finally:
+            upload.close()
+            admission.release(lease_id)
+
+    scheduler.submit(user_id, items(), save_file, finish)
+
 # Endpoints with Flask-RESTx
 @invoice_ns.route('/process-invoices')
 class ProcessInvoices(Resource):
-    @invoice_ns.doc('process_invoices')
+    @invoice_ns.doc('process_invoices', params={'force': 'Reprocess files uploaded before instead of reusing their results'})
     @invoice_ns.response(202, 'Processing started', models['transaction_response'])
     @invoice_ns.response(400, 'Bad request')
     @invoice_ns.response(401, 'Unauthorized')
+    @invoice_ns.response(413, 'Too many files in one upload')
+    @invoice_ns.response(429, 'Too many requests')
     @token_required
+    @admission.limit('process_invoices', cost=lambda: len(request.files.getlist('files')))
     def post(self, current_user):
-        """Upload and process invoice XML files"""    
+        """Upload and process invoice XML files, or zip and tar.gz archives of them"""    
         # Check if files were uploaded
         if 'files' not in request.files:
             return {'error': 'No files provided'}, 400
@@ -34,15 +106,36 @@ class ProcessInvoices(Resource):
         if not files:
             return {'error': 'No files provided'}, 400
         
-        # Read all XML files
-        xml_contents = []
+        # Collect the XML files; archives are only copied to disk, their members are read when needed
+        upload = UploadFiles()
         for file in files:
             print(f"Processing file: {file.filename}")
-            if file.filename.endswith('.xml'):
-                xml_contents.append(file.read().decode('utf-8'))
-        
-        if not xml_contents:
+            upload.add(file)
+
+        # Archive members are counted from the archives' indexes and headers and charged before any is read
+        try:
+            count = upload.count()
+        except UploadError as e:
+            upload.close()
+            return {'error': str(e)}, 400
+        if not count:
+            upload.close()
             return {'error': 'No XML files provided'}, 400
+        if count > UPLOAD_MAX_FILES:
+            upload.close()
+            return {'error': f'At most {UPLOAD_MAX_FILES} XML files per upload'}, 413
+        rejected = admission.charge('process_invoices', current_user['id'], count)
+        if rejected:
+            upload.close()
+            return rejected
+
+        # Files seen before are not parsed again unless forced
+        force = request.values.get('force', '').lower() in ('1', 'true', 'yes')
+        try:
+            ingest = ingest_dedup.plan(current_user['id'], upload, force)
+        except UploadError as e:
+            upload.close()
+            return {'error': str(e)}, 400
         
         # Generate transaction ID
         transaction_id = str(uuid.uuid4())
@@ -56,56 +149,15 @@ class ProcessInvoices(Resource):
                 [transaction_id, 'Processing started', datetime.utcnow()]
             )
 
-        # Process XML files asynchronously
-        @copy_current_request_context
-        def process_files():
-            update = 'UPDATE transactions SET result = %s, deletion_scheduled_at = %s WHERE id = %s'
-            try:
-                # Create event loop
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                # Process files
-                results = loop.run_until_complete(process_multiple_xml_files(xml_contents))
-                
-                # Close the loop
-                loop.close()
-
-                print(f"Transaction {transaction_id} completed")
-
-                with current_app.app_context():  # Properly enter the application context
-                    try:
-                        # Just update the transaction - don't try to insert it again
-                        # The main thread already created the transaction
-                        execute_db(
-                            update,
-                            [json.dumps(results), (datetime.utcnow() + timedelta(hours=24)), transaction_id]
-                        )
-                    except Exception as e:
-                        print(f"Error saving transaction {transaction_id}: {e}")
-                        execute_db(
-                            update,
-                            [f'Error saving transaction: {str(e)}', (datetime.utcnow() + timedelta(hours=24)), transaction_id]
-                        )
-                
-                return True
-
-            except Exception as e:
-                print(f"Error processing transaction {transaction_id}: {e}")
-                with current_app.app_context():  # Context needed here too
-                    execute_db(
-                        update,
-                        [f'Error processing files: {str(e)}', datetime.utcnow(), transaction_id]
-                    )
-                return False
-
-        # Use a thread pool to process files asynchronously
-        with ThreadPoolExecutor() as executor:
-            executor.submit(process_files)
+        # Files are interleaved with other users' uploads; the upload keeps its in-flight slot until they are done
+        submit_transaction(transaction_id, current_user['id'], upload, ingest, admission.detach())
         
         return {
             'message': 'Processing started',
-            'transaction_id': transaction_id
+            'transaction_id': transaction_id,
+            'files': len(ingest.filenames),
+            'reused': len(ingest.reused),
+            'duplicates': len(ingest.duplicates)
         }, 202
 
 @invoice_ns.route('/transaction/<transaction_id>')
@@ -132,7 +184,11 @@ class Transaction(Resource):
             if transaction['result'].startswith('Error'):
                 result = {'error': transaction['result']}
             elif transaction['result'] == 'Processing started':
-                result = {'status': 'Processing started'}
+                done = query_db(
+                    'SELECT COUNT(*) AS count FROM transaction_files WHERE transaction_id = %s',
+                    [transaction_id], one=True
+                )
+                result = {'status': 'Processing started', 'filesCompleted': done['count']}
             else:
                 result = json.loads(transaction['result'])
         except Exception as e:
@@ -144,3 +200,56 @@ class Transaction(Resource):
             'created_at': transaction['created_at'].isoformat() if transaction['created_at'] else None,
             'deletion_scheduled_at': transaction['deletion_scheduled_at'].isoformat() if transaction['deletion_scheduled_at'] else None
         }, 200
+
+@invoice_ns.route('/invoices/aggregates')
+class InvoiceAggregates(Resource):
+    @invoice_ns.doc('invoice_aggregates', params={
+        'group_by': f"One of: {', '.join(AGGREGATE_GROUPS)} (default: product)",
+        'from': 'Only invoices dated on or after this date (YYYY-MM-DD)',
+        'to': 'Only invoices dated on or before this date (YYYY-MM-DD)'
+    })
+    @invoice_ns.response(200, 'Success', [models['invoice_aggregate']])
+    @invoice_ns.response(400, 'Bad request')
+    @invoice_ns.response(401, 'Unauthorized')
+    @token_required
+    def get(self, current_user):
+        """Invoice totals of the current user's products, grouped by batch, product, facility or sub-category"""
+        group_by = request.args.get('group_by', 'product')
+        if group_by not in AGGREGATE_GROUPS:
+            return {'error': f"group_by must be one of: {', '.join(AGGREGATE_GROUPS)}"}, 400
+        columns = AGGREGATE_GROUPS[group_by]
+
+        conditions, args = ['p.user_id = %s'], [current_user['id']]
+        for param, condition in (('from', 'i.invoice_date >= %s'), ('to', 'i.invoice_date <= %s')):
+            if request.args.get(param):
+                try:
+                    args.append(datetime.strptime(request.args[param], '%Y-%m-%d').date())
+                except ValueError:
+                    return {'error': f'{param} must be a date (YYYY-MM-DD)'}, 400
+                conditions.append(condition)
+
+        # Amounts in different currencies are never summed together
+        group_columns = ', '.join(list(columns.values()) + ['i.currency'])
+        rows = query_db(f'''
+            SELECT {', '.join(f'{column} AS {key}' for key, column in columns.items())}, i.currency,
+                   COUNT(*) AS invoiceCount, SUM(i.total_amount) AS totalAmount, SUM(i.units_bought) AS unitsBought,
+                   SUM(CASE WHEN i.emissions_are_per_unit THEN 1 ELSE 0 END) AS perUnitInvoices,
+                   MIN(i.invoice_date) AS firstInvoiceDate, MAX(i.invoice_date) AS lastInvoiceDate
+            FROM invoices i
+            JOIN batches b ON i.batch_id = b.id
+            JOIN products p ON b.product_id = p.id
+            WHERE {' AND '.join(conditions)}
+            GROUP BY {group_columns}
+            ORDER BY totalAmount DESC
+        ''', args)
+
+        return [{
+            'group': {key: row[key] for key in columns},
+            'currency': row['currency'],
+            'invoiceCount': row['invoiceCount'],
+            'totalAmount': float(row['totalAmount']) if row['totalAmount'] is not None else None,
+            'unitsBought': float(row['unitsBought']) if row['unitsBought'] is not None else None,
+            'perUnitInvoices': int(row['perUnitInvoices']),
+            'firstInvoiceDate': str(row['firstInvoiceDate']) if row['firstInvoiceDate'] else None,
+            'lastInvoiceDate': str(row['lastInvoiceDate']) if row['lastInvoiceDate'] else None
+        } for row in rows], 200
@@ -1,12 +1,14 @@
 from flask_restx import Namespace, Resource
 from auth import token_required
 from auth import query_db
-import asyncio
-import aiohttp
 from models import register_models
 from datetime import datetime
 from flask import request
 from extensions import cache
+from utils import ledger_mirror, product_summaries, archive
+from utils.json_encoding import loads
+from utils.fieldsets import read_fieldset, select_fields, wants
+from utils.pagination import page_params, keyset_filter, keyset_page, cached_count, pagination
 
 # Add this helper function at the top of your file
 def json_serial(obj):
@@ -28,50 +30,21 @@ class Product(Resource):
     @token_required
     def get(self, product_id, current_user):
         """Get product details by ID"""
-        # Check if product exists
-        product = query_db('SELECT * FROM products WHERE id = %s', [product_id], one=True)
+        # Batch count, suppliers and totals are maintained in product_summaries by CreateBatch
+        product = query_db('''
+            SELECT p.name, s.product_id AS summary_id, s.batch_count, s.invoice_count, s.total_amount, s.supplier_names
+            FROM products p
+            LEFT JOIN product_summaries s ON s.product_id = p.id
+            WHERE p.id = %s
+        ''', [product_id], one=True)
         
         if not product:
             return {'error': 'Product not found'}, 404
         
-        # Get all batches for this product
-        batches = query_db('SELECT * FROM batches WHERE product_id = %s', [product_id])
-        batch_count = len(batches)
-        
-        # Collect all invoices related to all batches
-        all_invoices = []
-        for batch in batches:
-            invoices = query_db('SELECT * FROM invoices WHERE batch_id = %s', [batch['id']])
-            all_invoices.extend(invoices)
-        
-        # Fetch supplier information for each invoice
-        async def fetch_supplier_info(url):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            return data.get('name')
-                        return None
-            except Exception as e:
-                print(f"Error fetching supplier info: {str(e)}")
-                return None
-
-        async def fetch_all_suppliers():
-            tasks = []
-            for invoice in all_invoices:
-                if invoice.get('supplier_url'):
-                    tasks.append(fetch_supplier_info(invoice['supplier_url']))
-            return await asyncio.gather(*tasks)
-        
-        # Create and execute event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        supplier_names = loop.run_until_complete(fetch_all_suppliers())
-        loop.close()
-        
-        # Filter out None values and get unique names
-        unique_suppliers = list(set(filter(None, supplier_names)))
+        summary = product
+        if product['summary_id'] is None:
+            # Backfill products created before summaries existed
+            summary = product_summaries.rebuild(product_id)
         
         # Convert product name to string if it's a datetime
         product_name = product['name']
@@ -81,83 +54,90 @@ class Product(Resource):
         return {
             'productId': product_id,
             'productName': product_name,
-            'batchCount': batch_count,
-            'relatedSuppliers': unique_suppliers
+            'batchCount': summary['batch_count'],
+            'relatedSuppliers': loads(summary['supplier_names']),
+            'invoiceCount': summary['invoice_count'],
+            'totalAmount': float(summary['total_amount'])
         }, 200
 
+def has_no_stale_products(response):
+    """Cache filter: skip caching pages built from stale ledger data."""
+    body = response[0] if isinstance(response, tuple) else response
+    return not any(p.get('sustainabilityMetricsStale') for p in body.get('products', []))
+
 @product_ns.route('/products')
 class ProductList(Resource):
     @product_ns.doc('list_products')
-    @product_ns.param('page', 'Page number', type=int, default=1)
+    @product_ns.param('cursor', 'next_cursor from the previous page')
     @product_ns.param('per_page', 'Items per page', type=int, default=10)
-    @cache.cached(timeout=300, query_string=True)
+    @product_ns.param('page', 'Page number (deprecated, use cursor)', type=int)
+    @product_ns.param('fields', 'Comma separated product fields to return, e.g. productId,productName')
+    @product_ns.param('expand', 'Ledger data to fetch: sustainabilityMetrics (default, empty for none)')
+    @product_ns.response(400, 'Invalid cursor or expand value')
+    @cache.cached(timeout=300, query_string=True, response_filter=has_no_stale_products)
     def get(self):
         """Get all products with their sustainability metrics (paginated)"""
+        # Parse pagination and fieldset parameters
+        try:
+            cursor, per_page = page_params(10, 50)
+            fields, expand = read_fieldset(['sustainabilityMetrics'])
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        # Batches and the ledger are only read when the metrics are requested
+        expand_metrics = 'sustainabilityMetrics' in expand and wants(fields, 'sustainabilityMetrics')
 
-        async def fetch_all_batch_data(batches):
-            async with aiohttp.ClientSession() as session:
-                tasks = []
-                for batch in batches:
-                    tasks.append(fetch_batch_info(session, batch))
-                return await asyncio.gather(*tasks)
+        page = request.args.get('page', type=int)
+        if page and cursor is None:
+            # Offset paging kept for existing clients; it gets slower on deep pages
+            products = query_db(
+                'SELECT * FROM products ORDER BY created_at DESC, id DESC LIMIT %s OFFSET %s',
+                [per_page + 1, (max(page, 1) - 1) * per_page]
+            )
+        else:
+            condition, args = keyset_filter(cursor)
+            products = query_db(
+                f'SELECT * FROM products WHERE {condition} ORDER BY created_at DESC, id DESC LIMIT %s',
+                args + [per_page + 1]
+            )
+        products, next_cursor = keyset_page(products, per_page)
 
-        async def fetch_batch_info(session, batch):
-            try:
-                async with session.get(batch['information_url']) as response:
-                    if response.status != 200:
-                        return []
-                    data = await response.json()
-                    return data.get('sustainability_metrics', [])  # If sustainability_metrics format is nested like the final format
-            except Exception as e:
-                print(f"Error fetching batch info: {str(e)}")
-                return []
+        total = cached_count('products', 'SELECT COUNT(*) as count FROM products')
+
+        # Batch sustainability metrics for the whole page come from the local ledger mirror
+        batches_by_product = {product['id']: [] for product in products}
+        documents = {}
+        if expand_metrics and products:
+            # Archived batches keep counting towards their product
+            batches = query_db(
+                'SELECT b.product_id, b.information_url FROM {} WHERE b.product_id IN ({})'.format(
+                    archive.source('batches', include_archived=True, alias='b'), ','.join(['%s'] * len(products))
+                ),
+                [product['id'] for product in products]
+            )
+            for batch in batches:
+                batches_by_product[batch['product_id']].append(batch['information_url'])
+            documents, errors = ledger_mirror.resolve(batch['information_url'] for batch in batches)
+            for url, error in errors.items():
+                print(f"Error fetching batch info: {str(error)}")
 
-        # Parse pagination parameters
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
-        
-        # Limit per_page to prevent excessive loads
-        per_page = min(per_page, 50)
-        
-        # Calculate offset
-        offset = (page - 1) * per_page
-        
-        # Get paginated products
-        products = query_db(
-            'SELECT * FROM products ORDER BY created_at DESC LIMIT %s OFFSET %s', 
-            [per_page, offset]
-        )
-        
-        # Get total count for pagination info
-        total = query_db('SELECT COUNT(*) as count FROM products', one=True)['count']
-        
         all_products = []
         for product in products:
-            batches = query_db('SELECT * FROM batches WHERE product_id = %s', [product['id']])
-        
-            # Fetch all sustainability records
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            records_lists = loop.run_until_complete(fetch_all_batch_data(batches))
-            loop.close()
-
-            # Flatten list of lists
-            flat_records = [record for records in records_lists for record in records]
-
-            # Example metadata
             result = {
                 "productId": product['id'],
-                "productName": product['name'],
-                "sustainabilityMetrics": flat_records
+                "productName": product['name']
             }
-            all_products.append(result)
 
-        return {
-            'products': all_products,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'pages': (total + per_page - 1) // per_page
-            }
-        }, 200
+            if expand_metrics:
+                used = [documents[url] for url in batches_by_product[product['id']] if url in documents]
+                result['sustainabilityMetrics'] = [
+                    record for data, _, _ in used for record in data.get('sustainability_metrics', [])
+                ]
+                if any(stale for _, stale, _ in used):
+                    result['sustainabilityMetricsStale'] = True
+
+            all_products.append(select_fields(result, fields))
+
+        body = {'products': all_products, 'pagination': pagination(per_page, total, next_cursor)}
+        if page and cursor is None:
+            body['pagination']['page'] = page
+        return body, 200, ledger_mirror.freshness_headers(documents)
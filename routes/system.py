@@ -0,0 +1,29 @@
+from flask_restx import Namespace, Resource
+from auth import token_required, pool_snapshot
+from utils import ledger_client, ledger_mirror, emission_rollups, admission
+from utils.fair_scheduler import scheduler
+from extensions import cache
+
+system_ns = Namespace('system', description='Operational metrics')
+
+@system_ns.route('/system/stats')
+class SystemStats(Resource):
+    @system_ns.doc('get_system_stats')
+    @system_ns.response(200, 'Success')
+    @system_ns.response(403, 'Forbidden - Admin access required')
+    @system_ns.response(401, 'Unauthorized')
+    @token_required
+    def get(self, current_user):
+        """Report connection pool, ledger circuit, mirror sync, rollup refresh, admission, scheduler and cache state for this worker (admin only)"""
+        if current_user['role'] != 'admin':
+            return {'message': 'Unauthorized - Admin access required', 'success': False}, 403
+
+        return {
+            'db_pool': pool_snapshot(),
+            'ledger': ledger_client.snapshot(),
+            'ledger_mirror': ledger_mirror.last_sync or None,
+            'emission_rollups': emission_rollups.last_refresh or None,
+            'admission': admission.store.snapshot(),
+            'scheduler': scheduler.snapshot(),
+            'cache': cache.cache.stats() if hasattr(cache.cache, 'stats') else None
+        }, 200
@@ -13,6 +13,64 @@ def hash_password(password):
     salt = os.environ.get('PASSWORD_SALT', 'default-salt-for-dev')
     return hashlib.sha256((password + salt).encode()).hexdigest()
 
+# Secondary indexes, (created_at, id) ones back the keyset pagination of the listings
+# and the incremental emission rollup refresh
+INDEXES = [
+    ('users', 'idx_users_created', 'created_at, id'),
+    ('products', 'idx_products_created', 'created_at, id'),
+    ('batches', 'idx_batches_created', 'created_at, id'),
+    ('invoices', 'idx_invoices_created', 'created_at, id'),
+]
+
+def ensure_indexes(cursor):
+    """Create missing secondary indexes; safe to run on an existing database."""
+    for table, name, columns in INDEXES:
+        try:
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+            print(f"Created index {name} on {table}")
+        except pymysql.err.OperationalError as e:
+            if e.args[0] != 1061:  # ER_DUP_KEYNAME: the index already exists
+                raise
+
+def migrate_invoice_types(cursor):
+    """Convert the invoice flag and amount columns of older databases to BOOLEAN/DECIMAL.
+
+    Idempotent: does nothing once emissions_are_per_unit is no longer a VARCHAR.
+    Values that do not parse as numbers become NULL.
+    """
+    cursor.execute("SHOW COLUMNS FROM invoices LIKE 'emissions_are_per_unit'")
+    column = cursor.fetchone()
+    column_type = column['Type'] if isinstance(column, dict) else column[1]
+    if not column_type.lower().startswith('varchar'):
+        return
+
+    print("Migrating invoice columns to BOOLEAN/DECIMAL")
+    cursor.execute('''
+        UPDATE invoices SET emissions_are_per_unit = CASE
+            WHEN emissions_are_per_unit IS NULL THEN NULL
+            WHEN UPPER(TRIM(emissions_are_per_unit)) IN ('YES', 'Y', 'TRUE', '1') THEN '1'
+            ELSE '0'
+        END
+    ''')
+    # Invoices may use a decimal comma
+    cursor.execute('''
+        UPDATE invoices SET quantity_needed_per_unit = CASE
+            WHEN REPLACE(TRIM(quantity_needed_per_unit), ',', '.') REGEXP '^-?[0-9]+([.][0-9]+)?$'
+                THEN REPLACE(TRIM(quantity_needed_per_unit), ',', '.')
+            ELSE NULL
+        END
+    ''')
+    cursor.execute('''
+        ALTER TABLE invoices
+            MODIFY emissions_are_per_unit BOOLEAN,
+            MODIFY quantity_needed_per_unit DECIMAL(18,6),
+            MODIFY units_bought DECIMAL(18,6),
+            MODIFY total_amount DECIMAL(14,2)
+    ''')
+    cursor.execute('''
+        ALTER TABLE product_summaries MODIFY total_amount DECIMAL(18,2) NOT NULL
+    ''')
+
 def setup_database():
     """Set up the MySQL database with all required tables."""
     # Get database configuration from environment variables
@@ -82,10 +140,10 @@ def setup_database():
             sub_category VARCHAR(255) NOT NULL,
             invoice_number VARCHAR(255),
             invoice_date DATE,
-            emissions_are_per_unit VARCHAR(255),
-            quantity_needed_per_unit VARCHAR(255),
-            units_bought FLOAT,
-            total_amount FLOAT,
+            emissions_are_per_unit BOOLEAN,
+            quantity_needed_per_unit DECIMAL(18,6),
+            units_bought DECIMAL(18,6),
+            total_amount DECIMAL(14,2),
             currency VARCHAR(50),
             transaction_start_date DATE,
             transaction_end_date DATE,
@@ -104,6 +162,140 @@ def setup_database():
         ) ENGINE=InnoDB
         ''')
         
+        # Create transaction files table, one result per uploaded file as it completes
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transaction_files (
+            transaction_id VARCHAR(36) NOT NULL,
+            file_index INT NOT NULL,
+            filename VARCHAR(255),
+            status VARCHAR(16) NOT NULL,  -- 'ok', 'error', 'reused' or 'duplicate'
+            result LONGTEXT NOT NULL,  -- JSON result of the file
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (transaction_id, file_index),
+            FOREIGN KEY (transaction_id) REFERENCES transactions (id) ON DELETE CASCADE
+        ) ENGINE=InnoDB
+        ''')
+        
+        # Create invoice ingestions table, results of processed files for duplicate detection
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoice_ingestions (
+            dedup_key CHAR(64) PRIMARY KEY,  -- hash of user, seller, message identifier and content hash
+            user_id VARCHAR(36) NOT NULL,
+            seller_id VARCHAR(255) NOT NULL,
+            message_id VARCHAR(255) NOT NULL,
+            content_hash CHAR(64) NOT NULL,
+            transaction_id VARCHAR(36) NOT NULL,  -- upload that processed the file
+            result LONGTEXT NOT NULL,  -- JSON result of the file
+            created_at DATETIME NOT NULL
+        ) ENGINE=InnoDB
+        ''')
+        
+        # Create product summaries table, maintained by CreateBatch
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS product_summaries (
+            product_id VARCHAR(36) PRIMARY KEY,
+            batch_count INT NOT NULL,
+            invoice_count INT NOT NULL,
+            total_amount DECIMAL(18,2) NOT NULL,
+            supplier_names LONGTEXT NOT NULL,  -- JSON array of distinct supplier names
+            updated_at DATETIME NOT NULL,
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        ) ENGINE=InnoDB
+        ''')
+        
+        # Create ledger products mirror table (keyed on the URL hash, URLs are too long for a key)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_products (
+            url_hash CHAR(64) PRIMARY KEY,
+            url VARCHAR(2048) NOT NULL,
+            data LONGTEXT NOT NULL,  -- JSON document as returned by the ledger
+            content_hash CHAR(64) NOT NULL,
+            etag VARCHAR(255),
+            synced_at DATETIME NOT NULL,  -- last time the ledger confirmed this content
+            changed_at DATETIME NOT NULL
+        ) ENGINE=InnoDB
+        ''')
+        
+        # Create emission rollup tables, refreshed incrementally by utils.emission_rollups
+        for table in ('emission_rollups_daily', 'emission_rollups_monthly'):
+            cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                period DATE NOT NULL,  -- day, or first day of the month
+                facility VARCHAR(255) NOT NULL,
+                organizational_unit VARCHAR(255) NOT NULL,
+                scope VARCHAR(50) NOT NULL,
+                co2e_kg DOUBLE NOT NULL,
+                water_m3 DOUBLE NOT NULL,
+                energy_kwh DOUBLE NOT NULL,
+                invoice_count INT NOT NULL,
+                PRIMARY KEY (period, facility, organizational_unit, scope)
+            ) ENGINE=InnoDB
+            ''')
+        
+        # Create rollup state table, the last invoice (created_at, id) folded into the rollups
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name VARCHAR(64) PRIMARY KEY,
+            watermark_created_at DATETIME NOT NULL,
+            watermark_id VARCHAR(36) NOT NULL,
+            refreshed_at DATETIME NOT NULL
+        ) ENGINE=InnoDB
+        ''')
+        
+        # Create archive tables, batches and invoices of closed reporting periods moved by utils.archive
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS batches_archive (
+            id VARCHAR(36) PRIMARY KEY,
+            product_id VARCHAR(36) NOT NULL,
+            information_url VARCHAR(2048) NOT NULL,
+            created_at DATETIME NOT NULL,
+            archived_at DATETIME NOT NULL,
+            INDEX idx_batches_archive_product (product_id),
+            INDEX idx_batches_archive_created (created_at, id)
+        ) ENGINE=InnoDB ROW_FORMAT=COMPRESSED
+        ''')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoices_archive (
+            id VARCHAR(36) PRIMARY KEY,
+            batch_id VARCHAR(36) NOT NULL,
+            facility VARCHAR(255) NOT NULL,
+            organizational_unit VARCHAR(255) NOT NULL,
+            supplier_url VARCHAR(2048) NOT NULL,
+            sub_category VARCHAR(255) NOT NULL,
+            invoice_number VARCHAR(255),
+            invoice_date DATE,
+            emissions_are_per_unit BOOLEAN,
+            quantity_needed_per_unit DECIMAL(18,6),
+            units_bought DECIMAL(18,6),
+            total_amount DECIMAL(14,2),
+            currency VARCHAR(50),
+            transaction_start_date DATE,
+            transaction_end_date DATE,
+            created_at DATETIME NOT NULL,
+            archived_at DATETIME NOT NULL,
+            INDEX idx_invoices_archive_batch (batch_id),
+            INDEX idx_invoices_archive_created (created_at, id)
+        ) ENGINE=InnoDB ROW_FORMAT=COMPRESSED
+        ''')
+        
+        # Create change log table, appended to alongside user, product, batch and invoice writes
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+            entity VARCHAR(16) NOT NULL,  -- 'user', 'product', 'batch' or 'invoice'
+            entity_id VARCHAR(36) NOT NULL,
+            op VARCHAR(8) NOT NULL,  -- 'insert', 'update' or 'delete'
+            user_id VARCHAR(36) NOT NULL,  -- owner of the entity
+            parent_id VARCHAR(36),  -- product of a batch, batch of an invoice
+            changed_at DATETIME NOT NULL,
+            INDEX idx_change_log_user (user_id, seq)
+        ) ENGINE=InnoDB
+        ''')
+        
+        migrate_invoice_types(cursor)
+        ensure_indexes(cursor)
+        
         # Check if admin user already exists
         cursor.execute("SELECT id FROM users WHERE username = 'admin'")
         admin_exists = cursor.fetchone()
@@ -0,0 +1,296 @@
+# utils/admission.py
+"""Admission control for the heavy endpoints.
+
+Every limited endpoint has a token bucket per user and a cap on work in
+flight across all users. Both live in a SQLite file shared by the worker
+processes on the node, like the L2 of the tiered cache. Requests over either
+limit get 429 with a Retry-After header. In-flight slots are leases that
+expire after ADMISSION_LEASE_SECONDS, so a crashed worker cannot hold a slot
+forever. While the work runs, however long, its worker renews the lease every
+third of that time.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import wraps
+from flask import g
+from utils.upload_archives import UPLOAD_MAX_FILES
+
+ADMISSION_DB_PATH = os.environ.get('ADMISSION_DB_PATH', os.path.join(os.getcwd(), 'cache', 'admission.sqlite3'))
+# Longest an in-flight slot outlives the worker holding it; live workers renew theirs
+ADMISSION_LEASE_SECONDS = float(os.environ.get('ADMISSION_LEASE_SECONDS', 600))
+# Retry-After sent when an endpoint is at its in-flight cap
+ADMISSION_BUSY_RETRY_AFTER = int(os.environ.get('ADMISSION_BUSY_RETRY_AFTER', 5))
+
+
+class Limit:
+    """Token bucket refilled at `per_minute` up to `burst` tokens per user, plus a cap on in-flight work."""
+
+    def __init__(self, per_minute, burst, max_in_flight):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+
+
+LIMITS = {
+    # Tokens are XML files, archive members included, so one upload of many files counts as many. The
+    # burst is at least UPLOAD_MAX_FILES so that cap alone decides how large one upload may be
+    'process_invoices': Limit(
+        per_minute=int(os.environ.get('RATE_LIMIT_UPLOAD_FILES_PER_MINUTE', 120)),
+        burst=max(int(os.environ.get('RATE_LIMIT_UPLOAD_FILES_BURST', UPLOAD_MAX_FILES)), UPLOAD_MAX_FILES),
+        max_in_flight=int(os.environ.get('MAX_IN_FLIGHT_UPLOADS', 4))
+    ),
+    'create_batch': Limit(
+        per_minute=int(os.environ.get('RATE_LIMIT_BATCHES_PER_MINUTE', 30)),
+        burst=int(os.environ.get('RATE_LIMIT_BATCHES_BURST', 10)),
+        max_in_flight=int(os.environ.get('MAX_IN_FLIGHT_BATCHES', 4))
+    ),
+    # Tokens are batches; sized for nightly bulk jobs rather than interactive use
+    'create_batches': Limit(
+        per_minute=int(os.environ.get('RATE_LIMIT_BULK_BATCHES_PER_MINUTE', 600)),
+        burst=int(os.environ.get('RATE_LIMIT_BULK_BATCHES_BURST', 5000)),
+        max_in_flight=int(os.environ.get('MAX_IN_FLIGHT_BULK_BATCHES', 2))
+    ),
+}
+
+
+class AdmissionStore:
+    """Token buckets and in-flight leases in a SQLite file shared by the workers on the node."""
+
+    def __init__(self, path, lease_seconds=ADMISSION_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._acquires = 0
+        self.rejected = Counter()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS buckets (endpoint TEXT NOT NULL, user_id TEXT NOT NULL, '
+            'tokens REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY (endpoint, user_id))'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS leases (id TEXT PRIMARY KEY, endpoint TEXT NOT NULL, expires REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS leases_endpoint ON leases (endpoint, expires)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode; acquire() opens its own write transaction
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        return conn
+
+    def _tokens(self, conn, endpoint, user_id, limit, now):
+        row = conn.execute(
+            'SELECT tokens, updated FROM buckets WHERE endpoint = ? AND user_id = ?', (endpoint, user_id)
+        ).fetchone()
+        return limit.burst if row is None else min(limit.burst, row[0] + (now - row[1]) * limit.rate)
+
+    def acquire(self, endpoint, user_id, limit, cost=1):
+        """Take `cost` tokens and an in-flight slot.
+
+        Returns (lease_id, None) when admitted, (None, retry_after_seconds) when not.
+        """
+        conn = self._conn()
+        now = time.time()
+        # IMMEDIATE takes the write lock up front, so check-and-update is atomic across processes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM leases WHERE endpoint = ? AND expires < ?', (endpoint, now))
+            in_flight = conn.execute('SELECT COUNT(*) FROM leases WHERE endpoint = ?', (endpoint,)).fetchone()[0]
+            if in_flight >= limit.max_in_flight:
+                conn.execute('COMMIT')
+                return None, ADMISSION_BUSY_RETRY_AFTER
+
+            tokens = self._tokens(conn, endpoint, user_id, limit, now)
+            if tokens < cost:
+                conn.execute('COMMIT')
+                return None, (cost - tokens) / limit.rate
+
+            lease_id = str(uuid.uuid4())
+            conn.execute(
+                'REPLACE INTO buckets (endpoint, user_id, tokens, updated) VALUES (?, ?, ?, ?)',
+                (endpoint, user_id, tokens - cost, now)
+            )
+            conn.execute(
+                'INSERT INTO leases (id, endpoint, expires) VALUES (?, ?, ?)',
+                (lease_id, endpoint, now + self.lease_seconds)
+            )
+            self._acquires += 1
+            if self._acquires % 100 == 0:
+                # A bucket idle for long enough to refill completely is the same as no bucket
+                conn.execute(
+                    'DELETE FROM buckets WHERE endpoint = ? AND updated < ?',
+                    (endpoint, now - limit.burst / limit.rate)
+                )
+            conn.execute('COMMIT')
+            return lease_id, None
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def take(self, endpoint, user_id, limit, cost):
+        """Take `cost` more tokens for an admitted request. Returns None when taken, retry_after_seconds when not."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            tokens = self._tokens(conn, endpoint, user_id, limit, now)
+            if tokens < cost:
+                conn.execute('COMMIT')
+                return (cost - tokens) / limit.rate
+            conn.execute(
+                'REPLACE INTO buckets (endpoint, user_id, tokens, updated) VALUES (?, ?, ?, ?)',
+                (endpoint, user_id, tokens - cost, now)
+            )
+            conn.execute('COMMIT')
+            return None
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def renew(self, lease_ids):
+        """Push back the expiry of leases whose work is still running."""
+        self._conn().execute(
+            'UPDATE leases SET expires = ? WHERE id IN ({})'.format(','.join(['?'] * len(lease_ids))),
+            [time.time() + self.lease_seconds] + list(lease_ids)
+        )
+
+    def release(self, lease_id):
+        self._conn().execute('DELETE FROM leases WHERE id = ?', (lease_id,))
+
+    def snapshot(self):
+        rows = self._conn().execute(
+            'SELECT endpoint, COUNT(*) FROM leases WHERE expires >= ? GROUP BY endpoint', (time.time(),)
+        ).fetchall()
+        in_flight = dict(rows)
+        return {
+            endpoint: {'in_flight': in_flight.get(endpoint, 0), 'rejected': self.rejected[endpoint]}
+            for endpoint in LIMITS
+        }
+
+
+store = AdmissionStore(ADMISSION_DB_PATH)
+
+# Leases held by this process, renewed until released
+_held = set()
+_held_lock = threading.Lock()
+_renewer = None
+
+
+def _hold(lease_id):
+    global _renewer
+    with _held_lock:
+        _held.add(lease_id)
+        if _renewer is None:
+            _renewer = threading.Thread(target=_renew_held, name='admission-renewer', daemon=True)
+            _renewer.start()
+
+
+def _renew_held():
+    while True:
+        time.sleep(store.lease_seconds / 3)
+        with _held_lock:
+            lease_ids = list(_held)
+        if not lease_ids:
+            continue
+        try:
+            store.renew(lease_ids)
+        except sqlite3.Error as e:
+            # Retried next round; a lease only lapses after a whole lease period of failed renewals
+            print(f"[ADMISSION] Could not renew {len(lease_ids)} leases: {str(e)}")
+
+
+def limit(endpoint, cost=None):
+    """Admit a token_required endpoint's requests under LIMITS[endpoint].
+
+    `cost` is a callable returning the tokens a request takes (default 1). The
+    in-flight slot is released when the request returns unless the handler
+    takes it over with detach().
+    """
+    endpoint_limit = LIMITS[endpoint]
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            amount = max(1, cost()) if cost else 1
+            if amount > endpoint_limit.burst:
+                return _too_large(endpoint_limit)
+            try:
+                lease_id, retry_after = store.acquire(endpoint, kwargs['current_user']['id'], endpoint_limit, amount)
+            except sqlite3.Error as e:
+                # Admission control must not take the API down with it
+                print(f"[ADMISSION] Store error, admitting request: {str(e)}")
+                return f(*args, **kwargs)
+
+            if lease_id is None:
+                return _rejected(endpoint, retry_after)
+
+            _hold(lease_id)
+            g.admission_lease = lease_id
+            g.admission_cost = amount
+            try:
+                return f(*args, **kwargs)
+            finally:
+                lease_id = g.pop('admission_lease', None)
+                if lease_id is not None:
+                    release(lease_id)
+        return decorated
+    return decorator
+
+
+def charge(endpoint, user_id, cost):
+    """Charge an admitted request for its real size once the handler knows it.
+
+    Only the tokens beyond those taken on admission are taken. Returns None
+    when the request may go on, an error response when it is over the limit.
+    """
+    endpoint_limit = LIMITS[endpoint]
+    if cost > endpoint_limit.burst:
+        return _too_large(endpoint_limit)
+    admitted = g.get('admission_cost', 0)
+    if cost <= admitted:
+        return None
+    try:
+        retry_after = store.take(endpoint, user_id, endpoint_limit, cost - admitted)
+    except sqlite3.Error as e:
+        print(f"[ADMISSION] Store error, admitting request: {str(e)}")
+        return None
+    return None if retry_after is None else _rejected(endpoint, retry_after)
+
+
+def _too_large(endpoint_limit):
+    return {'error': f'At most {endpoint_limit.burst} items per request'}, 413
+
+
+def _rejected(endpoint, retry_after):
+    store.rejected[endpoint] += 1
+    retry_after = max(1, math.ceil(retry_after))
+    return {
+        'error': 'Too many requests, retry later',
+        'retry_after': retry_after
+    }, 429, {'Retry-After': str(retry_after)}
+
+
+def detach():
+    """Take over the current request's in-flight slot, to release it when background work ends."""
+    return g.pop('admission_lease', None)
+
+
+def release(lease_id):
+    if lease_id is None:
+        return
+    with _held_lock:
+        _held.discard(lease_id)
+    try:
+        store.release(lease_id)
+    except sqlite3.Error as e:
+        # The lease expires on its own
+        print(f"[ADMISSION] Could not release lease {lease_id}: {str(e)}")
@@ -0,0 +1,175 @@
+# utils/archive.py
+"""Hot/cold archival of the batches and invoices of closed reporting periods.
+
+archive() moves batches whose invoices' transaction periods all ended before
+a date from batches and invoices to batches_archive and invoices_archive
+(InnoDB compressed rows), ARCHIVE_CHUNK batches per transaction. The hot
+tables, which the read endpoints scan by default, then only hold the active
+working set; with include_archived=true they read both. Products, product
+summaries and the emission rollups keep covering archived rows, so only
+invoices already folded into the rollups are moved. Run from the command line
+with
+
+    python -m utils.archive --before 2025-01-01 [--dry-run]
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+from auth import pooled_connection
+from extensions import cache
+from utils.pagination import invalidate_count
+
+# Batches moved per transaction
+ARCHIVE_CHUNK = int(os.environ.get('ARCHIVE_CHUNK', 200))
+
+ARCHIVE_LOCK = 'archive_batches'
+
+BATCH_COLUMNS = ('id', 'product_id', 'information_url', 'created_at')
+INVOICE_COLUMNS = (
+    'id', 'batch_id', 'facility', 'organizational_unit', 'supplier_url', 'sub_category', 'invoice_number',
+    'invoice_date', 'emissions_are_per_unit', 'quantity_needed_per_unit', 'units_bought', 'total_amount',
+    'currency', 'transaction_start_date', 'transaction_end_date', 'created_at'
+)
+COLUMNS = {'batches': BATCH_COLUMNS, 'invoices': INVOICE_COLUMNS}
+
+
+def source(table, include_archived=False, alias=None):
+    """FROM clause for `batches` or `invoices`, with their archive table appended when include_archived is set."""
+    if not include_archived:
+        return f'{table} {alias}' if alias else table
+    columns = ', '.join(COLUMNS[table])
+    return f'(SELECT {columns} FROM {table} UNION ALL SELECT {columns} FROM {table}_archive) {alias or table}'
+
+
+def include_archived_param(args):
+    """Whether a request's query string asks for archived rows too."""
+    return args.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
+def _closed_batches(cur, before, folded, after, limit):
+    """Batches created before `before` whose invoices are all closed and folded into the rollups.
+
+    An invoice's period ends on its transaction end date, falling back to its
+    start date, invoice date and creation date. Batches are visited in
+    (created_at, id) order after `after`, with the user_id of their product.
+    """
+    created_at, batch_id = after
+    cur.execute('''
+        SELECT b.id, b.created_at, p.user_id FROM batches b
+        LEFT JOIN products p ON p.id = b.product_id
+        WHERE b.created_at < %s AND (b.created_at > %s OR (b.created_at = %s AND b.id > %s))
+          AND NOT EXISTS (
+              SELECT 1 FROM invoices i
+              WHERE i.batch_id = b.id
+                AND (COALESCE(i.transaction_end_date, i.transaction_start_date, i.invoice_date, DATE(i.created_at)) >= %s
+                     OR i.created_at > %s OR (i.created_at = %s AND i.id > %s))
+          )
+        ORDER BY b.created_at, b.id
+        LIMIT %s
+    ''', [before, created_at, created_at, batch_id, before, folded[0], folded[0], folded[1], limit])
+    return cur.fetchall()
+
+
+def _move(conn, batch_ids):
+    """Copy the batches and their invoices to the archive tables and delete them, in one transaction."""
+    placeholders = ','.join(['%s'] * len(batch_ids))
+    now = datetime.utcnow()
+    batch_columns = ', '.join(BATCH_COLUMNS)
+    invoice_columns = ', '.join(INVOICE_COLUMNS)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f'INSERT INTO invoices_archive ({invoice_columns}, archived_at) '
+                f'SELECT {invoice_columns}, %s FROM invoices WHERE batch_id IN ({placeholders})',
+                [now] + batch_ids
+            )
+            invoices = cur.rowcount
+            cur.execute(
+                f'INSERT INTO batches_archive ({batch_columns}, archived_at) '
+                f'SELECT {batch_columns}, %s FROM batches WHERE id IN ({placeholders})',
+                [now] + batch_ids
+            )
+            cur.execute(f'DELETE FROM invoices WHERE batch_id IN ({placeholders})', batch_ids)
+            cur.execute(f'DELETE FROM batches WHERE id IN ({placeholders})', batch_ids)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return invoices
+
+
+def _invalidate(owners):
+    """Drop the cached responses that counted or listed the moved rows."""
+    for owner_id in owners:
+        invalidate_count(f"batches:{owner_id}")
+    # /emissions is cached per query string and reads only the hot tables by default
+    if hasattr(cache.cache, 'delete_prefix'):
+        cache.cache.delete_prefix('/api/emissions')
+    else:
+        cache.clear()
+
+
+def archive(before, dry_run=False, chunk_size=ARCHIVE_CHUNK):
+    """Move the batches of periods closed before `before` (a date) to the archive tables. Needs an app context.
+
+    Returns the counters, or None when another process is already archiving.
+    """
+    from utils import emission_rollups  # emission_rollups imports this module
+    started = time.perf_counter()
+    counts = {'batches': 0, 'invoices': 0, 'dry_run': dry_run}
+    owners = set()
+    # Invoices the rollups have not seen yet stay hot until the next refresh folds them in
+    folded = emission_rollups.watermark()[:2]
+    with pooled_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT GET_LOCK(%s, 0) AS acquired', [ARCHIVE_LOCK])
+            if not cur.fetchone()['acquired']:
+                return None
+        try:
+            after = (emission_rollups.EPOCH, '')
+            while True:
+                with conn.cursor() as cur:
+                    batches = _closed_batches(cur, before, folded, after, chunk_size)
+                if not batches:
+                    break
+                batch_ids = [batch['id'] for batch in batches]
+                if dry_run:
+                    with conn.cursor() as cur:
+                        cur.execute('SELECT COUNT(*) AS count FROM invoices WHERE batch_id IN ({})'.format(
+                            ','.join(['%s'] * len(batch_ids))
+                        ), batch_ids)
+                        counts['invoices'] += cur.fetchone()['count']
+                else:
+                    counts['invoices'] += _move(conn, batch_ids)
+                    owners.update(batch['user_id'] for batch in batches if batch['user_id'])
+                counts['batches'] += len(batch_ids)
+                after = (batches[-1]['created_at'], batches[-1]['id'])
+                if len(batches) < chunk_size:
+                    break
+        finally:
+            with conn.cursor() as cur:
+                cur.execute('SELECT RELEASE_LOCK(%s)', [ARCHIVE_LOCK])
+            # Chunks moved before a failure are committed too
+            if not dry_run and counts['batches']:
+                _invalidate(owners)
+
+    counts['seconds'] = round(time.perf_counter() - started, 3)
+    print(f"[ARCHIVE] {'Would move' if dry_run else 'Moved'} {counts['batches']} batches and "
+          f"{counts['invoices']} invoices closed before {before.isoformat()} in {counts['seconds']}s")
+    return counts
+
+
+if __name__ == '__main__':
+    from flask import Flask
+    parser = argparse.ArgumentParser(description='Move batches and invoices of closed reporting periods to the archive tables')
+    parser.add_argument('--before', required=True, type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        help='First day still open for reporting (YYYY-MM-DD); periods ending before it are archived')
+    parser.add_argument('--dry-run', action='store_true', help='Only count what would be moved')
+    args = parser.parse_args()
+    app = Flask(__name__)
+    # The server's cache directory, to drop the responses the move made stale
+    cache.init_app(app)
+    with app.app_context():
+        if archive(args.before, args.dry_run) is None:
+            print('Another archive run is already in progress')
@@ -0,0 +1,61 @@
+# utils/async_db.py
+"""Coroutine versions of query_db/execute_db for code running on an event loop.
+
+Statements run on a small dedicated thread pool, each on a connection checked
+out of the shared pool for just that statement, so the loop is never blocked
+and no Flask app or request context is needed. Reads always go to the
+primary: callers here read back what they have just written.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from auth import pooled_connection
+
+# Threads running statements for coroutines; keep below DB_POOL_MAX_CONNECTIONS
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 4))
+
+_executor = ThreadPoolExecutor(max_workers=ASYNC_DB_THREADS, thread_name_prefix='async-db')
+
+
+def _query(query, args):
+    with pooled_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, args)
+            return cur.fetchall()
+
+
+def _execute(query, args, many):
+    with pooled_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                if many:
+                    cur.executemany(query, args)
+                else:
+                    cur.execute(query, args)
+                lastrowid = cur.lastrowid
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return lastrowid
+
+
+async def _run(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, partial(function, *args))
+
+
+async def query_db(query, args=(), one=False):
+    """Query the database and return the results as a list of dictionaries."""
+    rv = await _run(_query, query, args)
+    return rv[0] if rv and one else rv
+
+
+async def execute_db(query, args=()):
+    """Execute a statement and commit it. Returns the cursor's lastrowid."""
+    return await _run(_execute, query, args, False)
+
+
+async def executemany_db(query, seq_of_args):
+    """Execute a statement for every set of arguments and commit them together."""
+    return await _run(_execute, query, seq_of_args, True)
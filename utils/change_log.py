@@ -0,0 +1,91 @@
+# utils/change_log.py
+"""Append-only log of user, product, batch and invoice changes, served by /changes.
+
+Entries are written on the cursor of the transaction that makes the change,
+so a rolled back write leaves no entry. They are numbered by an
+AUTO_INCREMENT sequence and read in that order, with the last sequence
+number a consumer has seen as its cursor.
+
+Sequence numbers are taken when a row is inserted, not when its transaction
+commits, so a short transaction can commit after a later number is already
+visible. The feed therefore only serves entries older than
+CHANGE_FEED_SETTLE_SECONDS, which transaction() blocks (no network I/O inside)
+finish well within.
+"""
+import os
+from datetime import datetime, timedelta
+
+# Seconds an entry must be old before /changes serves it
+CHANGE_FEED_SETTLE_SECONDS = int(os.environ.get('CHANGE_FEED_SETTLE_SECONDS', 5))
+
+ENTITIES = ('user', 'product', 'batch', 'invoice')
+OPERATIONS = ('insert', 'update', 'delete')
+
+INSERT_CHANGE = (
+    'INSERT INTO change_log (entity, entity_id, op, user_id, parent_id, changed_at) '
+    'VALUES (%s, %s, %s, %s, %s, %s)'
+)
+
+
+def record_changes(cur, changes):
+    """Append (entity, entity_id, op, user_id, parent_id) changes using the writer's cursor.
+
+    user_id is the user the entity belongs to; parent_id the product of a batch
+    or the batch of an invoice.
+    """
+    now = datetime.utcnow()
+    rows = [[entity, entity_id, op, user_id, parent_id, now] for entity, entity_id, op, user_id, parent_id in changes]
+    if rows:
+        cur.executemany(INSERT_CHANGE, rows)
+
+
+def record_change(cur, entity, entity_id, op, user_id, parent_id=None):
+    record_changes(cur, [(entity, entity_id, op, user_id, parent_id)])
+
+
+def parse_since(value):
+    """The sequence number after which to read; raises ValueError if it is malformed."""
+    if value in (None, ''):
+        return 0
+    try:
+        since = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid since cursor')
+    if since < 0:
+        raise ValueError('Invalid since cursor')
+    return since
+
+
+def parse_entities(value):
+    """Entities listed in a comma separated `entity` parameter, all of them if empty."""
+    if not value:
+        return list(ENTITIES)
+    entities = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in entities if name not in ENTITIES]
+    if unknown:
+        raise ValueError(f"Unknown entity: {', '.join(unknown)}")
+    return entities
+
+
+def read_changes(since, limit, user_id=None, entities=ENTITIES):
+    """Up to `limit` settled entries after `since`, oldest first, and whether more follow.
+
+    With user_id only that user's entries are returned.
+    """
+    from auth import query_db  # auth imports this module
+
+    conditions = ['seq > %s', 'changed_at <= %s']
+    args = [since, datetime.utcnow() - timedelta(seconds=CHANGE_FEED_SETTLE_SECONDS)]
+    if user_id is not None:
+        conditions.append('user_id = %s')
+        args.append(user_id)
+    if len(entities) < len(ENTITIES):
+        conditions.append('entity IN ({})'.format(','.join(['%s'] * len(entities))))
+        args.extend(entities)
+    # A replica applies commits in primary commit order, not sequence order; read the primary
+    rows = query_db(
+        f"SELECT seq, entity, entity_id, op, parent_id, changed_at FROM change_log "
+        f"WHERE {' AND '.join(conditions)} ORDER BY seq LIMIT %s",
+        args + [limit + 1], primary=True
+    )
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,210 @@
+# utils/columnar_export.py
+"""Export the /emissions records as Parquet or an Arrow IPC stream.
+
+Invoices are read EXPORT_ROW_GROUP_SIZE at a time, a keyset page on
+(created_at, id) per pooled connection checkout, and each chunk becomes one row group (Parquet) or record batch (Arrow),
+so memory stays bounded by the chunk size whatever the size of the export.
+Write to a file from the command line with
+
+    python -m utils.columnar_export --output emissions.parquet [--from DATE] [--to DATE] [--facility NAME] [--include-archived]
+"""
+import argparse
+import os
+from datetime import datetime
+from auth import pooled_connection
+from utils import ledger_mirror, archive
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # optional dependency, the export is unavailable without it
+    pyarrow = None
+
+# Invoices per row group / record batch
+EXPORT_ROW_GROUP_SIZE = int(os.environ.get('EXPORT_ROW_GROUP_SIZE', 5000))
+
+EPOCH = datetime(1970, 1, 1)
+
+FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows')
+}
+
+# Columns of the EmissionRecords built by routes.emissions.build_emission_records
+STRING_COLUMNS = [
+    'name', 'originId', 'productName', 'description', 'organizationUnit', 'facility', 'provider', 'costUnit',
+    'timestamp', 'consumptionStartDate', 'consumptionEndDate', 'transactionStartDate', 'transactionEndDate',
+    'emissionFactor', 'emissionFactorLibrary', 'waterTransactionType', 'dataQualityType', 'quantityUnit',
+    'emissonSource', 'emissonCategory', 'emissonSubCategory', 'CO2E_unit', 'fuelType'
+]
+FLOAT_COLUMNS = ['cost', 'quantity', 'CO2E']
+BOOL_COLUMNS = ['isStale', 'isRenewable']
+
+
+def available():
+    return pyarrow is not None
+
+
+def schema():
+    return pyarrow.schema(
+        [(name, pyarrow.string()) for name in STRING_COLUMNS]
+        + [(name, pyarrow.float64()) for name in FLOAT_COLUMNS]
+        + [(name, pyarrow.bool_()) for name in BOOL_COLUMNS]
+    )
+
+
+def _record_batch(records, export_schema):
+    """Build a record batch column by column; ledger values such as originId may not be strings."""
+    columns = []
+    for name in STRING_COLUMNS:
+        columns.append([None if (value := getattr(record, name)) is None else str(value) for record in records])
+    for name in FLOAT_COLUMNS:
+        columns.append([None if (value := getattr(record, name)) is None else float(value) for record in records])
+    for name in BOOL_COLUMNS:
+        columns.append([getattr(record, name) for record in records])
+    return pyarrow.RecordBatch.from_arrays(
+        [pyarrow.array(column, type=field.type) for column, field in zip(columns, export_schema)],
+        schema=export_schema
+    )
+
+
+def iter_records(start=None, end=None, facility=None, include_archived=False, chunk_size=EXPORT_ROW_GROUP_SIZE):
+    """Yield lists of emission records, one list per chunk of invoices. Needs an app context.
+
+    Invoices are filtered on their transaction start date (falling back to the
+    invoice date) like the emission rollups, and on facility. Archived
+    invoices are only read with include_archived.
+    """
+    from routes.emissions import EMISSION_SUBCATEGORIES, build_emission_records  # routes import this module
+    conditions, args = ['i.supplier_url IS NOT NULL'], []
+    if start is not None:
+        conditions.append('COALESCE(i.transaction_start_date, i.invoice_date) >= %s')
+        args.append(start)
+    if end is not None:
+        conditions.append('COALESCE(i.transaction_start_date, i.invoice_date) <= %s')
+        args.append(end)
+    if facility is not None:
+        conditions.append('i.facility = %s')
+        args.append(facility)
+
+    created_at, invoice_id = EPOCH, ''
+    while True:
+        # Keyset pages on short checkouts: no pooled connection is held across ledger calls or the response
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f'''
+                    SELECT i.* FROM {archive.source('invoices', include_archived, 'i')}
+                    JOIN {archive.source('batches', include_archived, 'b')} ON i.batch_id = b.id
+                    WHERE {' AND '.join(conditions)}
+                      AND (i.created_at > %s OR (i.created_at = %s AND i.id > %s))
+                    ORDER BY i.created_at, i.id
+                    LIMIT %s
+                ''', args + [created_at, created_at, invoice_id, chunk_size])
+                invoices = cur.fetchall()
+        if not invoices:
+            break
+        created_at, invoice_id = invoices[-1]['created_at'], invoices[-1]['id']
+        documents, errors = ledger_mirror.resolve(invoice['supplier_url'] for invoice in invoices)
+        for url, error in errors.items():
+            print(f"[EXPORT] Ledger error for supplier {url}: {str(error)}")
+        records = []
+        for invoice in invoices:
+            document = documents.get(invoice['supplier_url'])
+            if document is None:
+                continue
+            supplier_data, stale, _ = document
+            records.extend(build_emission_records(invoice, supplier_data, EMISSION_SUBCATEGORIES, stale))
+        if records:
+            yield records
+        if len(invoices) < chunk_size:
+            break
+
+
+def _open(sink, fmt, export_schema):
+    """A writer for the format and a function writing one record batch as a row group / IPC batch."""
+    if fmt == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(sink, export_schema)
+        return writer, lambda batch: writer.write_table(pyarrow.Table.from_batches([batch]))
+    writer = pyarrow.ipc.new_stream(sink, export_schema)
+    return writer, writer.write_batch
+
+
+def write(sink, chunks, fmt='parquet'):
+    """Write record chunks to a path or writable file object. Returns the number of records."""
+    export_schema = schema()
+    writer, write_batch = _open(sink, fmt, export_schema)
+    count = 0
+    try:
+        for records in chunks:
+            write_batch(_record_batch(records, export_schema))
+            count += len(records)
+    finally:
+        writer.close()
+    return count
+
+
+class _Buffer:
+    """Write-only file object whose contents are taken out after every row group."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream(chunks, fmt='parquet'):
+    """Yield the encoded export piece by piece, one row group at a time, for a streaming response."""
+    export_schema = schema()
+    buffer = _Buffer()
+    writer, write_batch = _open(buffer, fmt, export_schema)
+    finished = False
+    try:
+        for records in chunks:
+            write_batch(_record_batch(records, export_schema))
+            data = buffer.drain()
+            if data:
+                yield data
+        writer.close()
+        finished = True
+        yield buffer.drain()
+    finally:
+        if not finished:
+            writer.close()
+
+
+if __name__ == '__main__':
+    from flask import Flask
+    parse_date = lambda value: datetime.strptime(value, '%Y-%m-%d').date()
+    parser = argparse.ArgumentParser(description='Export emission records to Parquet or Arrow')
+    parser.add_argument('--output', required=True, help='Destination file')
+    parser.add_argument('--format', choices=list(FORMATS), default='parquet')
+    parser.add_argument('--from', dest='start', type=parse_date, help='First transaction date (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='end', type=parse_date, help='Last transaction date (YYYY-MM-DD)')
+    parser.add_argument('--facility')
+    parser.add_argument('--include-archived', action='store_true', help='Include archived reporting periods')
+    args = parser.parse_args()
+    if not available():
+        parser.error('pyarrow is not installed')
+    with Flask(__name__).app_context():
+        count = write(args.output, iter_records(args.start, args.end, args.facility, args.include_archived), args.format)
+    print(f"Exported {count} records to {args.output}")
@@ -0,0 +1,125 @@
+# utils/compression.py
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional dependency, only gzip is offered without it
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+COMPRESS_CACHE_TIMEOUT = int(os.environ.get('COMPRESS_CACHE_TIMEOUT', 600))
+# Bytes of compressed bodies kept per worker
+COMPRESS_CACHE_MAX_BYTES = int(os.environ.get('COMPRESS_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress(body, encoding):
+    """Compress a response body with the given content coding."""
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+class BodyCache:
+    """Byte-bounded in-process LRU of compressed bodies by ETag and coding.
+
+    Kept apart from the shared response cache: every JSON response passes
+    through here, and one-off bodies such as /transaction/<id> must not evict
+    the cached /emissions and /products responses or cost a write each.
+    """
+
+    def __init__(self, max_bytes=COMPRESS_CACHE_MAX_BYTES, timeout=COMPRESS_CACHE_TIMEOUT):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._entries = OrderedDict()  # key -> (expires_at, data)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (time.time() + self.timeout, data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+
+bodies = BodyCache()
+
+
+def compressed_body(body, etag, encoding):
+    """Compressed body for an ETag, compressed once per worker and then served from memory."""
+    key = (etag, encoding)
+    data = bodies.get(key)
+    if data is None:
+        data = compress(body, encoding)
+        bodies.set(key, data)
+    return data
+
+
+def conditional_and_compressed(response):
+    """Add a strong ETag, answer If-None-Match with 304 and compress JSON bodies.
+
+    Each encoded variant gets its own ETag (the identity tag suffixed with the
+    coding) since it is a different byte sequence.
+    """
+    if (request.method not in ('GET', 'HEAD') or response.status_code != 200
+            or response.mimetype != 'application/json' or response.direct_passthrough
+            or response.is_streamed or 'Content-Encoding' in response.headers):
+        return response
+
+    body = response.get_data()
+    etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    response.vary.add('Accept-Encoding')
+
+    encoding = None
+    if len(body) >= COMPRESS_MIN_SIZE:
+        encoding = request.accept_encodings.best_match(ENCODINGS)
+    variant_etag = f'{etag}-{encoding}' if encoding else etag
+    response.set_etag(variant_etag)
+
+    # Any variant the client holds has the same content
+    if request.if_none_match.contains(etag) or request.if_none_match.contains(variant_etag):
+        response.status_code = 304
+        response.set_data(b'')
+        response.headers.pop('Content-Length', None)
+        return response
+
+    if encoding:
+        response.set_data(compressed_body(body, etag, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def register_compression(app):
+    """Compress JSON responses and handle conditional GETs for the whole app."""
+    app.after_request(conditional_and_compressed)
@@ -0,0 +1,299 @@
+# utils/emission_rollups.py
+"""Daily and monthly emission totals per facility, organizational unit and scope.
+
+refresh() folds invoices created since the last run into the
+emission_rollups_daily and emission_rollups_monthly tables, keyed on the
+invoice's transaction start date. summary() answers range queries from them:
+whole months come from the monthly table, the partial months at either end of
+the range from the daily one, so a query reads at most one row per group and
+month plus 62 days. Run from the command line with
+
+    python -m utils.emission_rollups [--rebuild]
+"""
+import argparse
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from auth import query_db, pooled_connection, named_lock
+from utils import ledger_mirror, archive
+from utils.ledger_client import LedgerUnavailable
+
+# Seconds between background refreshes (0 disables the refresh thread)
+EMISSION_ROLLUP_INTERVAL = int(os.environ.get('EMISSION_ROLLUP_INTERVAL', 60))
+# Invoices younger than this many seconds are left for the next run, so an invoice committed
+# after a newer one (CreateBatch timestamps before its transaction commits) is never passed over
+EMISSION_ROLLUP_LAG = int(os.environ.get('EMISSION_ROLLUP_LAG', 30))
+
+STATE_NAME = 'emissions'
+REFRESH_LOCK = 'emission_rollups_refresh'
+CHUNK_SIZE = 500
+EPOCH = datetime(1970, 1, 1)
+
+# Counters of the last refresh run by this process, reported by /api/system/stats
+last_refresh = {}
+
+# group_by value -> rollup column
+GROUP_COLUMNS = {
+    'facility': 'facility',
+    'organizationalUnit': 'organizational_unit',
+    'scope': 'scope'
+}
+MEASURES = ('co2e_kg', 'water_m3', 'energy_kwh', 'invoice_count')
+
+UPSERT = '''
+    INSERT INTO {table} (period, facility, organizational_unit, scope, co2e_kg, water_m3, energy_kwh, invoice_count)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE co2e_kg = co2e_kg + VALUES(co2e_kg), water_m3 = water_m3 + VALUES(water_m3),
+        energy_kwh = energy_kwh + VALUES(energy_kwh), invoice_count = invoice_count + VALUES(invoice_count)
+'''
+
+
+def _month(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _period(invoice):
+    """The day an invoice's emissions are attributed to."""
+    day = invoice['transaction_start_date'] or invoice['invoice_date'] or invoice['created_at']
+    return day.date() if isinstance(day, datetime) else day
+
+
+def watermark():
+    """(created_at, id) of the last invoice folded into the rollups and when that happened."""
+    state = query_db(
+        'SELECT watermark_created_at, watermark_id, refreshed_at FROM rollup_state WHERE name = %s',
+        [STATE_NAME], one=True, primary=True
+    )
+    if not state:
+        return EPOCH, '', None
+    return state['watermark_created_at'], state['watermark_id'], state['refreshed_at']
+
+
+def _rollup(invoices, documents):
+    """Sum a chunk of invoices into {(table, period, facility, unit, scope): [measures]}.
+
+    Returns the deltas and the number of invoices skipped because their
+    emissions could not be computed.
+    """
+    from routes.emissions import EMISSION_SUBCATEGORIES, emission_totals  # routes import this module
+    deltas = defaultdict(lambda: [0.0, 0.0, 0.0, 0])
+    skipped = 0
+    for invoice in invoices:
+        supplier_data, _, _ = documents[invoice['supplier_url']]
+        try:
+            co2e, water, energy = emission_totals(invoice, supplier_data, EMISSION_SUBCATEGORIES)
+        except (ZeroDivisionError, TypeError, ValueError) as e:
+            # One malformed invoice must not stall the watermark for every invoice after it
+            print(f"[ROLLUPS] Skipping invoice {invoice['id']}: {str(e)}")
+            skipped += 1
+            continue
+        day = _period(invoice)
+        key = (
+            invoice['facility'] or '',
+            invoice['organizational_unit'] or '',
+            EMISSION_SUBCATEGORIES.get(invoice['sub_category'], 'Unknown')
+        )
+        for table, period in (('emission_rollups_daily', day), ('emission_rollups_monthly', _month(day))):
+            measures = deltas[(table, period) + key]
+            measures[0] += co2e
+            measures[1] += water
+            measures[2] += energy
+            measures[3] += 1
+    return deltas, skipped
+
+
+def _apply(conn, deltas, last):
+    """Add the deltas and advance the watermark in one transaction."""
+    by_table = defaultdict(list)
+    for (table, *key), measures in deltas.items():
+        by_table[table].append(key + measures)
+    with conn.cursor() as cur:
+        for table, rows in by_table.items():
+            cur.executemany(UPSERT.format(table=table), rows)
+        cur.execute(
+            'REPLACE INTO rollup_state (name, watermark_created_at, watermark_id, refreshed_at) VALUES (%s, %s, %s, %s)',
+            [STATE_NAME, last['created_at'], last['id'], datetime.utcnow()]
+        )
+    conn.commit()
+
+
+def refresh(rebuild=False):
+    """Fold invoices created since the watermark into the rollups. Needs an app context.
+
+    Invoices whose ledger product is unknown to the ledger, or whose emissions
+    cannot be computed from their data, are skipped. When the ledger is
+    unavailable the refresh stops before the first affected invoice and the
+    next run picks up from there. Returns the counters, or None when another
+    process is already refreshing.
+    """
+    started = time.perf_counter()
+    counts = {'invoices': 0, 'skipped': 0, 'waiting_for_ledger': False}
+    # The lock has its own connection; pooled ones are only checked out around statements, never across ledger calls
+    with named_lock(REFRESH_LOCK) as acquired:
+        if not acquired:
+            return None
+        if rebuild:
+            with pooled_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute('DELETE FROM emission_rollups_daily')
+                    cur.execute('DELETE FROM emission_rollups_monthly')
+                    cur.execute('DELETE FROM rollup_state WHERE name = %s', [STATE_NAME])
+                conn.commit()
+        created_at, invoice_id, _ = watermark()
+        settled_before = datetime.utcnow() - timedelta(seconds=EMISSION_ROLLUP_LAG)
+        while True:
+            with pooled_connection() as conn:
+                with conn.cursor() as cur:
+                    # Archived invoices were folded in before they were moved, but a rebuild needs them again
+                    cur.execute(f'''
+                        SELECT id, created_at, facility, organizational_unit, sub_category, supplier_url, invoice_date,
+                               transaction_start_date, emissions_are_per_unit, quantity_needed_per_unit, units_bought
+                        FROM {archive.source('invoices', include_archived=rebuild)}
+                        WHERE (created_at > %s OR (created_at = %s AND id > %s)) AND created_at < %s
+                        ORDER BY created_at, id
+                        LIMIT %s
+                    ''', [created_at, created_at, invoice_id, settled_before, CHUNK_SIZE])
+                    invoices = cur.fetchall()
+            if not invoices:
+                break
+
+            documents, errors = ledger_mirror.resolve(invoice['supplier_url'] for invoice in invoices)
+            ready, last = [], None
+            for invoice in invoices:
+                if isinstance(errors.get(invoice['supplier_url']), LedgerUnavailable):
+                    counts['waiting_for_ledger'] = True
+                    break
+                if invoice['supplier_url'] in documents:
+                    ready.append(invoice)
+                else:
+                    counts['skipped'] += 1
+                last = invoice
+            if last is not None:
+                deltas, failed = _rollup(ready, documents)
+                with pooled_connection() as conn:
+                    _apply(conn, deltas, last)
+                counts['invoices'] += len(ready) - failed
+                counts['skipped'] += failed
+                created_at, invoice_id = last['created_at'], last['id']
+            if counts['waiting_for_ledger'] or len(invoices) < CHUNK_SIZE:
+                break
+
+    counts['seconds'] = round(time.perf_counter() - started, 3)
+    counts['finished_at'] = datetime.utcnow().isoformat() + 'Z'
+    last_refresh.clear()
+    last_refresh.update(counts)
+    if counts['invoices'] or counts['skipped'] or counts['waiting_for_ledger']:
+        print(f"[ROLLUPS] Folded {counts['invoices']} invoices in {counts['seconds']}s, {counts['skipped']} skipped"
+              f"{', stopped until the ledger is available' if counts['waiting_for_ledger'] else ''}")
+    return counts
+
+
+def _ranges(start, end):
+    """Split [start, end] into whole months and the leftover days at either end.
+
+    Returns (months, days): an inclusive range of month periods (or None) and a
+    list of inclusive day ranges. Open ends cover everything on that side.
+    """
+    first_month = start if start is None or start.day == 1 else _next_month(start)
+    # Month containing the day after `end`; months before it are whole
+    end_month = None if end is None else _month(end + timedelta(days=1))
+    if first_month is not None and end_month is not None and first_month >= end_month:
+        return None, [(start, end)]
+    last_month = None if end_month is None else _month(end_month - timedelta(days=1))
+    days = []
+    if start is not None and start != first_month:
+        days.append((start, first_month - timedelta(days=1)))
+    if end is not None and end_month - timedelta(days=1) != end:
+        days.append((end_month, end))
+    return (first_month, last_month), days
+
+
+def _select(table, group_columns, period_range):
+    columns = ', '.join(group_columns)
+    conditions, args = [], []
+    if period_range[0] is not None:
+        conditions.append('period >= %s')
+        args.append(period_range[0])
+    if period_range[1] is not None:
+        conditions.append('period <= %s')
+        args.append(period_range[1])
+    return query_db(f'''
+        SELECT {columns}{', ' if columns else ''}SUM(co2e_kg) AS co2e_kg, SUM(water_m3) AS water_m3,
+               SUM(energy_kwh) AS energy_kwh, SUM(invoice_count) AS invoice_count
+        FROM {table}
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        {'GROUP BY ' + columns if columns else ''}
+    ''', args)
+
+
+def summary(start=None, end=None, group_by=tuple(GROUP_COLUMNS), by_month=False):
+    """Emission totals between two dates (inclusive, open when None) from the rollup tables.
+
+    Returns a list of dicts with the group_by keys, 'period' ('YYYY-MM') when
+    by_month is set, and co2eKg, waterM3, energyKwh and invoiceCount.
+    """
+    group_columns = [GROUP_COLUMNS[name] for name in group_by]
+    selected = group_columns + (['period'] if by_month else [])
+    months, days = _ranges(start, end)
+
+    rows = []
+    if months is not None:
+        rows += _select('emission_rollups_monthly', selected, months)
+    for day_range in days:
+        rows += _select('emission_rollups_daily', selected, day_range)
+
+    totals = defaultdict(lambda: [0.0, 0.0, 0.0, 0])
+    for row in rows:
+        key = tuple(row[column] for column in group_columns)
+        if by_month:
+            key += (row['period'].strftime('%Y-%m'),)
+        measures = totals[key]
+        for index, measure in enumerate(MEASURES):
+            measures[index] += float(row[measure] or 0)
+
+    result = []
+    for key, (co2e, water, energy, count) in sorted(totals.items()):
+        item = dict(zip(group_by, key))
+        if by_month:
+            item['period'] = key[-1]
+        item.update({
+            'co2eKg': round(float(co2e), 6),
+            'waterM3': round(float(water), 6),
+            'energyKwh': round(float(energy), 6),
+            'invoiceCount': int(count)
+        })
+        result.append(item)
+    return result
+
+
+def start_refresh(app, interval=EMISSION_ROLLUP_INTERVAL):
+    """Run refresh() every `interval` seconds in a daemon thread."""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    refresh()
+            except Exception as e:
+                print(f"[ROLLUPS] Refresh error: {str(e)}")
+
+    thread = threading.Thread(target=run, name='emission-rollups-refresh', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    from flask import Flask
+    parser = argparse.ArgumentParser(description='Refresh the emission rollup tables')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Recompute from scratch, e.g. after ledger metrics changed')
+    args = parser.parse_args()
+    with Flask(__name__).app_context():
+        if refresh(args.rebuild) is None:
+            print('Another refresh is already running')
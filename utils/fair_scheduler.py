@@ -0,0 +1,272 @@
+# utils/fair_scheduler.py
+"""Fair scheduling of invoice files across users and transactions.
+
+Each worker process runs one scheduler with its own event loop thread. Files
+are dispatched by deficit round-robin over users, with the cost of a file
+being its size: every turn a user's deficit grows by SCHEDULER_QUANTUM_BYTES
+and their files are dispatched while it covers them. A user's transactions
+take turns among themselves. A 3-file upload therefore starts within one
+round however many files other users have queued, instead of waiting behind
+them. Files are read (and archive members decompressed) a few ahead in a
+worker thread, never on the event loop or under the scheduler's lock.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from utils.xml_parser import process_xml_file
+
+# Files processed concurrently by the scheduler
+SCHEDULER_CONCURRENCY = int(os.environ.get('SCHEDULER_CONCURRENCY', 10))
+# Bytes of files a user may have dispatched per round
+SCHEDULER_QUANTUM_BYTES = int(os.environ.get('SCHEDULER_QUANTUM_BYTES', 256 * 1024))
+# Files of a job read ahead of the dispatcher
+SCHEDULER_READ_AHEAD = int(os.environ.get('SCHEDULER_READ_AHEAD', 4))
+# Users kept in the queue-wait metrics
+SCHEDULER_STATS_USERS = 1000
+
+
+class Job:
+    """One transaction's files, read from `items` as (filename, content) pairs a few files ahead.
+
+    Reading an item may decompress an archive member, so the scheduler calls
+    read() in a worker thread and only dispatches files already read.
+    """
+
+    def __init__(self, user_id, items, on_result, on_done):
+        self.user_id = user_id
+        self.on_result = on_result
+        self.on_done = on_done
+        self.submitted = time.monotonic()
+        self.first_dispatch = None
+        self.results = []
+        self.dispatched = 0
+        self.completed = 0
+        self.reading = False
+        self.read_all = False
+        self._items = iter(items)
+        self._ready = deque()
+
+    @property
+    def ready(self):
+        return bool(self._ready)
+
+    @property
+    def exhausted(self):
+        return self.read_all and not self._ready
+
+    @property
+    def wants_more(self):
+        return not self.read_all and not self.reading and len(self._ready) < SCHEDULER_READ_AHEAD
+
+    @property
+    def cost(self):
+        return max(1, len(self._ready[0][1]))
+
+    def read(self):
+        """The next (filename, content), or None at the end. Blocking; runs outside the event loop."""
+        try:
+            return next(self._items, None)
+        except Exception as e:
+            print(f"[SCHEDULER] Error reading files: {str(e)}")
+            return None
+
+    def add(self, item):
+        """Buffer an item returned by read(); None marks the end. Returns whether to read on."""
+        if item is None:
+            self.read_all = True
+        else:
+            self._ready.append(item)
+        self.reading = not self.read_all and len(self._ready) < SCHEDULER_READ_AHEAD
+        return self.reading
+
+    def take(self):
+        """The next (index, filename, content) to process."""
+        filename, content = self._ready.popleft()
+        index = self.dispatched
+        self.dispatched += 1
+        self.results.append(None)
+        return index, filename, content
+
+
+class FairScheduler:
+    """Deficit round-robin over users, round-robin over each user's jobs."""
+
+    def __init__(self, concurrency=SCHEDULER_CONCURRENCY, quantum=SCHEDULER_QUANTUM_BYTES):
+        self.concurrency = concurrency
+        self.quantum = quantum
+        self._lock = threading.Lock()
+        self._queues = {}  # user_id -> deque of jobs with files left to dispatch
+        self._active = deque()  # user_ids in round-robin order
+        self._deficit = {}
+        self._turn_started = False
+        self._running = 0
+        self._stats = OrderedDict()  # user_id -> queue-wait metrics
+        self._loop = None
+        self._wakeup = None
+        self._started = threading.Event()
+
+    def submit(self, user_id, items, on_result, on_done):
+        """Queue a job. `on_result(index, filename, result)` is awaited per file, `on_done(results)` once at the end."""
+        job = Job(user_id, items, on_result, on_done)
+        with self._lock:
+            if self._loop is None:
+                threading.Thread(target=lambda: asyncio.run(self._run()), name='fair-scheduler', daemon=True).start()
+                self._started.wait()
+            if user_id not in self._queues:
+                self._queues[user_id] = deque()
+                self._deficit[user_id] = 0
+                self._active.append(user_id)
+            self._queues[user_id].append(job)
+        self._loop.call_soon_threadsafe(self._read_ahead, job)
+        return job
+
+    def _read_ahead(self, job):
+        if job.wants_more:
+            job.reading = True
+            asyncio.create_task(self._read(job))
+
+    async def _read(self, job):
+        """Fill a job's read-ahead buffer in a worker thread; the event loop and the lock are never held meanwhile."""
+        while True:
+            item = await self._loop.run_in_executor(None, job.read)
+            with self._lock:
+                more = job.add(item)
+                if job.exhausted:
+                    self._drop(job)
+            self._wakeup.set()
+            if not more:
+                break
+        if job.exhausted and job.completed == job.dispatched:
+            # Every file was done before the end of the items was reached, or there were none
+            await self._finish_job(job)
+
+    def _drop(self, job):
+        """Remove a job with nothing left to dispatch from its user's queue. Call with the lock held."""
+        jobs = self._queues.get(job.user_id)
+        if jobs is None or job not in jobs:
+            return
+        jobs.remove(job)
+        if not jobs:
+            # An idle user keeps no credit
+            del self._queues[job.user_id]
+            del self._deficit[job.user_id]
+            if self._active[0] == job.user_id:
+                self._turn_started = False
+            self._active.remove(job.user_id)
+
+    def _pick(self):
+        """Next (job, index, filename, content) by deficit round-robin, or None when nothing is ready."""
+        with self._lock:
+            if not any(job.ready for jobs in self._queues.values() for job in jobs):
+                return None
+            while True:
+                user_id = self._active[0]
+                jobs = self._queues[user_id]
+                job = next((job for job in jobs if job.ready), None)
+                if job is None:
+                    # Still reading this user's files; their turn passes without credit
+                    self._active.rotate(-1)
+                    self._turn_started = False
+                    continue
+                if not self._turn_started:
+                    self._deficit[user_id] += self.quantum
+                    self._turn_started = True
+                if job.cost <= self._deficit[user_id]:
+                    self._deficit[user_id] -= job.cost
+                    picked = (job,) + job.take()
+                    # The user's other jobs go first next time
+                    jobs.remove(job)
+                    jobs.append(job)
+                    if job.exhausted:
+                        self._drop(job)
+                    return picked
+                self._active.rotate(-1)
+                self._turn_started = False
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        slots = asyncio.Semaphore(self.concurrency)
+        self._started.set()
+        while True:
+            await slots.acquire()
+            picked = self._pick()
+            while picked is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                picked = self._pick()
+            self._read_ahead(picked[0])
+            asyncio.create_task(self._process(slots, *picked))
+
+    async def _process(self, slots, job, index, filename, content):
+        now = time.monotonic()
+        if job.first_dispatch is None:
+            job.first_dispatch = now
+            self._record(job.user_id, 'first_file_wait', now - job.submitted)
+        with self._lock:
+            self._running += 1
+        try:
+            try:
+                result = await process_xml_file(content)
+            except Exception as e:
+                result = {'error': f'Processing error: {str(e)}'}
+            job.results[index] = result
+            try:
+                await job.on_result(index, filename, result)
+            except Exception as e:
+                print(f"[SCHEDULER] Error storing result of {filename}: {str(e)}")
+        finally:
+            with self._lock:
+                self._running -= 1
+            slots.release()
+
+        job.completed += 1
+        if job.exhausted and job.completed == job.dispatched:
+            await self._finish_job(job)
+
+    async def _finish_job(self, job):
+        if job.dispatched:
+            self._record(job.user_id, 'job_seconds', time.monotonic() - job.submitted)
+        try:
+            await job.on_done(job.results)
+        except Exception as e:
+            print(f"[SCHEDULER] Error finishing job: {str(e)}")
+
+    def _record(self, user_id, metric, seconds):
+        with self._lock:
+            stats = self._stats.pop(user_id, None) or {
+                'jobs': 0, 'first_file_wait': {'count': 0, 'total': 0.0, 'max': 0.0},
+                'job_seconds': {'count': 0, 'total': 0.0, 'max': 0.0}
+            }
+            self._stats[user_id] = stats
+            if len(self._stats) > SCHEDULER_STATS_USERS:
+                self._stats.popitem(last=False)
+            if metric == 'first_file_wait':
+                stats['jobs'] += 1
+            entry = stats[metric]
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            users = {}
+            for user_id, stats in self._stats.items():
+                users[user_id] = {'jobs': stats['jobs']}
+                for metric in ('first_file_wait', 'job_seconds'):
+                    entry = stats[metric]
+                    users[user_id][metric] = {
+                        'avg': round(entry['total'] / entry['count'], 4) if entry['count'] else None,
+                        'max': round(entry['max'], 4)
+                    }
+            return {
+                'running_files': self._running,
+                'queued_users': len(self._active),
+                'queued_jobs': sum(len(jobs) for jobs in self._queues.values()),
+                'users': users
+            }
+
+
+scheduler = FairScheduler()
@@ -0,0 +1,71 @@
+# utils/fieldsets.py
+from flask import request
+
+
+def parse_fields(value):
+    """Turn 'batch,invoices.id,invoices.url' into {'batch': {}, 'invoices': {'id': {}, 'url': {}}}.
+
+    An empty subtree selects the whole value; an empty tree selects everything.
+    """
+    tree = {}
+    for path in (value or '').split(','):
+        parts = [part for part in path.strip().split('.') if part]
+        if not parts:
+            continue
+        node = tree
+        for part in parts[:-1]:
+            if part in node and not node[part]:
+                break  # the parent is already selected whole
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = {}
+    return tree
+
+
+def select_fields(data, tree):
+    """Keep only the selected keys of a dict, or of every dict in a list.
+
+    A field's staleness flag (e.g. batchDataStale) is kept along with it.
+    """
+    if not tree:
+        return data
+    if isinstance(data, list):
+        return [select_fields(item, tree) for item in data]
+    if isinstance(data, dict):
+        selected = {}
+        for key, subtree in tree.items():
+            if key in data:
+                selected[key] = select_fields(data[key], subtree)
+            if f'{key}Stale' in data:
+                selected[f'{key}Stale'] = data[f'{key}Stale']
+        return selected
+    return data
+
+
+def wants(tree, *path):
+    """Whether the field at `path` is part of the selection."""
+    for part in path:
+        if not tree:
+            return True
+        if part not in tree:
+            return False
+        tree = tree[part]
+    return True
+
+
+def read_fieldset(allowed_expansions):
+    """Read `fields` and `expand` from the query string.
+
+    Returns (fields tree, expansions). Without `expand` every ledger expansion
+    runs, as before these parameters existed; `expand=` with no value runs none.
+    Raises ValueError for unknown expansions.
+    """
+    fields = parse_fields(request.args.get('fields'))
+    if 'expand' not in request.args:
+        return fields, set(allowed_expansions)
+    expand = {name.strip() for name in request.args['expand'].split(',') if name.strip()}
+    unknown = expand - set(allowed_expansions)
+    if unknown:
+        raise ValueError(f"Unknown expand value(s): {', '.join(sorted(unknown))}; "
+                         f"allowed: {', '.join(allowed_expansions)}")
+    return fields, expand
@@ -1,19 +1,24 @@
 from datetime import datetime, timedelta
 import aiohttp
+import asyncio
+import weakref
+from utils import ledger_client
+from utils.ledger_client import LedgerError
 # Import the authentication module
 from auth import execute_db, query_db
 import threading
 import json
 from flask import current_app, copy_current_request_context
 
-# Create a shared session object
-_session = None
+# Shared session objects, one per event loop: a session cannot be used outside the loop it was created on
+_sessions = weakref.WeakKeyDictionary()
 
 async def get_session():
-    """Get or create a shared aiohttp ClientSession."""
-    global _session
-    if _session is None or _session.closed:
-        _session = aiohttp.ClientSession(
+    """Get or create the aiohttp ClientSession shared by the running event loop."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = _sessions[loop] = aiohttp.ClientSession(
             connector=aiohttp.TCPConnector(
                 limit=20,  # Limit total connections
                 limit_per_host=5,  # Limit connections per host
@@ -21,7 +26,7 @@ async def get_session():
             ),
             timeout=aiohttp.ClientTimeout(total=30)  # Set timeout
         )
-    return _session
+    return session
 
 # Schedule transaction deletion
 def schedule_transaction_deletion(transaction_id, hours=24):
@@ -52,14 +57,19 @@ def schedule_transaction_deletion(transaction_id, hours=24):
 
 # Helper function to fetch data from URL
 async def fetch_url_data(url):
-    """Fetch data from URL using shared session."""
+    """Fetch data from URL using shared session.
+
+    Goes through the ledger circuit breaker; a last known good response is
+    returned with 'stale': True when the ledger is unavailable.
+    """
     try:
         session = await get_session()
-        async with session.get(url) as response:
-            if response.status == 200:
-                return await response.json()
-            else:
-                return {'error': f'HTTP error: {response.status}'}
+        data, stale = await ledger_client.get_json_async(session, url)
+        if stale:
+            data = dict(data, stale=True)
+        return data
+    except LedgerError as e:
+        return {'error': str(e)}
     except Exception as e:
         print(f"Error fetching URL {url}: {str(e)}")
         return {'error': f'Fetch error: {str(e)}'}
@@ -0,0 +1,114 @@
+# utils/ingest_dedup.py
+"""Duplicate detection for uploaded Finvoice files.
+
+A file is identified by its seller (SellerPartyIdentifier), its
+MessageIdentifier and the SHA-256 of its content, read with a regular
+expression instead of a full parse. Results of files processed before are
+kept in invoice_ingestions per user for INGEST_DEDUP_MAX_AGE seconds and reused
+when the same user uploads the same file again. Repeats within one upload are
+processed once.
+"""
+import hashlib
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from auth import query_db
+from utils import async_db, json_encoding
+from utils.xml_parser import XML_EXTRACTION
+
+# Seconds a stored result is reused before the file is processed again
+INGEST_DEDUP_MAX_AGE = int(os.environ.get('INGEST_DEDUP_MAX_AGE', 7 * 86400))
+
+_MESSAGE_ID = re.compile(r'<(?:\w+:)?MessageIdentifier\b[^>]*>\s*([^<]*?)\s*<')
+_SELLER_ID = re.compile(r'<(?:\w+:)?SellerPartyIdentifier\b[^>]*>\s*([^<]*?)\s*<')
+
+
+# Keys looked up per query
+LOOKUP_CHUNK = 1000
+
+
+class IngestPlan:
+    """What to do with each file of an upload."""
+
+    def __init__(self):
+        self.filenames = []  # every file of the upload, in order
+        self.process = []  # (index, filename, dedup_key, identity) to run through the parser
+        self.reused = {}  # index -> stored result of an earlier upload
+        self.duplicates = {}  # index -> index of the same file earlier in this upload
+
+
+def identify(content):
+    """(seller id, message id, content hash) of a Finvoice document, without parsing it."""
+    message_id = _MESSAGE_ID.search(content)
+    seller_id = _SELLER_ID.search(content)
+    return (
+        seller_id.group(1) if seller_id else '',
+        message_id.group(1) if message_id else '',
+        hashlib.sha256(content.encode('utf-8')).hexdigest()
+    )
+
+
+def dedup_key(user_id, identity):
+    # Results of the projected and the full extraction are not interchangeable
+    return hashlib.sha256('\x1f'.join((user_id, XML_EXTRACTION) + identity).encode('utf-8')).hexdigest()
+
+
+def plan(user_id, files, force=False):
+    """Split an upload's (filename, content) pairs into files to process, reuse or copy.
+
+    `files` is iterated once and contents are not kept. With `force`, earlier
+    uploads are ignored; repeats within the upload are still processed once.
+    """
+    ingest = IngestPlan()
+    first_seen = {}
+    for index, (filename, content) in enumerate(files):
+        ingest.filenames.append(filename)
+        identity = identify(content)
+        key = dedup_key(user_id, identity)
+        if key in first_seen:
+            ingest.duplicates[index] = first_seen[key]
+        else:
+            first_seen[key] = index
+            ingest.process.append((index, filename, key, identity))
+
+    if force or not ingest.process:
+        return ingest
+    stored = {}
+    cutoff = datetime.utcnow() - timedelta(seconds=INGEST_DEDUP_MAX_AGE)
+    for start in range(0, len(ingest.process), LOOKUP_CHUNK):
+        keys = [key for _, _, key, _ in ingest.process[start:start + LOOKUP_CHUNK]]
+        rows = query_db(
+            'SELECT dedup_key, result FROM invoice_ingestions WHERE dedup_key IN ({}) AND created_at >= %s'.format(
+                ','.join(['%s'] * len(keys))
+            ),
+            keys + [cutoff]
+        )
+        stored.update((row['dedup_key'], row['result']) for row in rows)
+    remaining = []
+    for item in ingest.process:
+        if item[2] in stored:
+            ingest.reused[item[0]] = json.loads(stored[item[2]])
+        else:
+            remaining.append(item)
+    ingest.process = remaining
+    return ingest
+
+
+def reusable(result):
+    """Only complete results are stored: errors and stale ledger metrics are retried next time."""
+    metrics = result.get('sustainabilityMetrics')
+    return ('error' not in result and not result.get('sustainabilityMetricsStale')
+            and not (isinstance(metrics, dict) and 'error' in metrics))
+
+
+async def record(key, user_id, identity, transaction_id, result):
+    """Store a processed file's result for later uploads of the same file."""
+    if not reusable(result):
+        return
+    seller_id, message_id, content_hash = identity
+    await async_db.execute_db(
+        'REPLACE INTO invoice_ingestions (dedup_key, user_id, seller_id, message_id, content_hash, transaction_id, result, created_at) '
+        'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
+        [key, user_id, seller_id[:255], message_id[:255], content_hash, transaction_id, json_encoding.dumps(result).decode('utf-8'), datetime.utcnow()]
+    )
@@ -0,0 +1,66 @@
+# utils/json_encoding.py
+import json
+import os
+from datetime import datetime, date, time
+from decimal import Decimal
+from flask import make_response
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency, fall back to the standard library
+    orjson = None
+
+# 'orjson' (default when installed) or 'json' to force the standard library encoder
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'orjson' if orjson else 'json')
+
+
+def default(obj):
+    """Serialize values PyMySQL returns that JSON has no native type for."""
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+
+if JSON_ENCODER == 'orjson' and orjson is not None:
+    def dumps(data):
+        """Encode data as JSON bytes."""
+        return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    _encoder = json.JSONEncoder(default=default, separators=(',', ':'), ensure_ascii=False)
+
+    def dumps(data):
+        """Encode data as JSON bytes."""
+        return _encoder.encode(data).encode('utf-8')
+
+    loads = json.loads
+
+
+def output_json(data, code, headers=None):
+    """flask-restx representation for application/json using the configured encoder."""
+    resp = make_response(dumps(data), code)
+    resp.headers.extend(headers or {})
+    resp.mimetype = 'application/json'
+    return resp
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider so jsonify and plain Flask routes use the same encoder."""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+
+def register_json(app, api):
+    """Use the fast encoder for every JSON response of the app and the API."""
+    app.json = FastJSONProvider(app)
+    api.representation('application/json')(output_json)
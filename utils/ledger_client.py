@@ -0,0 +1,273 @@
+# utils/ledger_client.py
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import aiohttp
+import requests
+
+# Consecutive failures that open a host's circuit
+LEDGER_FAILURE_THRESHOLD = int(os.environ.get('LEDGER_FAILURE_THRESHOLD', 5))
+# Seconds an open circuit waits before letting a single half-open probe through
+LEDGER_RESET_TIMEOUT = float(os.environ.get('LEDGER_RESET_TIMEOUT', 30))
+# Maximum concurrent calls per ledger host (bulkhead) and how long to wait for a slot
+LEDGER_MAX_CONCURRENCY = int(os.environ.get('LEDGER_MAX_CONCURRENCY', 10))
+LEDGER_BULKHEAD_WAIT = float(os.environ.get('LEDGER_BULKHEAD_WAIT', 2))
+# Default request timeout in seconds
+LEDGER_TIMEOUT = float(os.environ.get('LEDGER_TIMEOUT', 10))
+# Number of last known good GET responses kept for stale fallbacks
+LEDGER_STALE_ENTRIES = int(os.environ.get('LEDGER_STALE_ENTRIES', 2000))
+
+
+class LedgerError(Exception):
+    """A ledger call failed and no stale copy was available."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LedgerUnavailable(LedgerError):
+    """The ledger host is down, its circuit is open or its bulkhead is full."""
+
+
+class CircuitBreaker:
+    """Per-host circuit breaker with a single half-open probe."""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, host, failure_threshold=LEDGER_FAILURE_THRESHOLD, reset_timeout=LEDGER_RESET_TIMEOUT):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may proceed. While half-open only one probe is let through."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"[LEDGER] Circuit for {self.host} closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"[LEDGER] Circuit for {self.host} opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_cancelled(self):
+        """A call was cancelled by its caller: no verdict on the host, but a half-open probe may be retried."""
+        with self._lock:
+            self._probing = False
+
+    def snapshot(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures}
+
+
+class Bulkhead:
+    """Caps concurrent calls to one host so a slow ledger cannot absorb every worker thread."""
+
+    def __init__(self, limit=LEDGER_MAX_CONCURRENCY):
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def acquire(self, timeout=LEDGER_BULKHEAD_WAIT):
+        acquired = self._semaphore.acquire(timeout=timeout)
+        self._acquired(acquired)
+        return acquired
+
+    async def acquire_async(self, timeout=LEDGER_BULKHEAD_WAIT):
+        # The semaphore is shared with threaded callers, so poll it instead of blocking the loop
+        deadline = time.monotonic() + timeout
+        acquired = self._semaphore.acquire(blocking=False)
+        while not acquired and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+            acquired = self._semaphore.acquire(blocking=False)
+        self._acquired(acquired)
+        return acquired
+
+    def _acquired(self, acquired):
+        with self._lock:
+            if acquired:
+                self.in_flight += 1
+            else:
+                self.rejected += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+
+    def snapshot(self):
+        with self._lock:
+            return {'in_flight': self.in_flight, 'rejected': self.rejected}
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+_last_good = OrderedDict()
+_last_good_lock = threading.Lock()
+
+
+def _guards_for(url):
+    """Return the (breaker, bulkhead) pair for the URL's host."""
+    host = urlsplit(url).netloc
+    with _guards_lock:
+        guards = _guards.get(host)
+        if guards is None:
+            guards = _guards[host] = (CircuitBreaker(host), Bulkhead())
+        return guards
+
+
+def _remember(url, data):
+    with _last_good_lock:
+        _last_good[url] = data
+        _last_good.move_to_end(url)
+        while len(_last_good) > LEDGER_STALE_ENTRIES:
+            _last_good.popitem(last=False)
+
+
+def _stale_copy(url):
+    with _last_good_lock:
+        return _last_good.get(url)
+
+
+def _admit(breaker, admitted):
+    """Raise LedgerUnavailable if the bulkhead or the circuit rejected the call."""
+    if not admitted:
+        raise LedgerUnavailable(f'Too many concurrent ledger calls to {breaker.host}')
+    if not breaker.allow():
+        raise LedgerUnavailable(f'Circuit open for {breaker.host}')
+
+
+def request(method, url, timeout=LEDGER_TIMEOUT, session=None, **kwargs):
+    """Send a ledger request through the host's bulkhead and circuit breaker.
+
+    Transport errors and 5xx responses count as failures. Raises
+    LedgerUnavailable when the call is rejected or the host cannot be reached.
+    """
+    breaker, bulkhead = _guards_for(url)
+    admitted = bulkhead.acquire()
+    try:
+        _admit(breaker, admitted)
+        try:
+            response = (session or requests).request(method, url, timeout=timeout, **kwargs)
+        except BaseException as e:
+            breaker.record_failure()
+            if isinstance(e, requests.exceptions.RequestException):
+                raise LedgerUnavailable(f'Ledger request failed: {e}') from e
+            raise
+    finally:
+        if admitted:
+            bulkhead.release()
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+def _fallback(url, error, status_code=None):
+    """Return (last good data, True) for the URL, or raise if there is none."""
+    data = _stale_copy(url)
+    if data is None:
+        if status_code is not None and status_code < 500:
+            raise LedgerError(error, status_code)
+        raise LedgerUnavailable(error, status_code)
+    print(f"[LEDGER] Serving stale data for {url}: {error}")
+    return data, True
+
+
+def get_json(url, timeout=LEDGER_TIMEOUT, session=None):
+    """GET a ledger URL and return (data, stale).
+
+    When the call fails or is rejected, the last good response for the URL is
+    returned with stale=True. Raises LedgerError if there is none.
+    """
+    try:
+        response = request('GET', url, timeout=timeout, session=session)
+    except LedgerUnavailable as e:
+        return _fallback(url, str(e))
+    if response.status_code != 200:
+        return _fallback(url, f'HTTP error: {response.status_code}', response.status_code)
+    try:
+        data = response.json()
+    except ValueError as e:
+        return _fallback(url, f'Invalid JSON: {e}')
+    _remember(url, data)
+    return data, False
+
+
+async def get_json_async(session, url, timeout=LEDGER_TIMEOUT):
+    """Async counterpart of get_json using an aiohttp session."""
+    breaker, bulkhead = _guards_for(url)
+    admitted = await bulkhead.acquire_async()
+    status = None
+    try:
+        _admit(breaker, admitted)
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                status = response.status
+                data = await response.json() if status == 200 else None
+        except asyncio.CancelledError:
+            # Cancelled by our side (shutdown, a caller's timeout), which says nothing about the ledger
+            breaker.record_cancelled()
+            raise
+        except BaseException as e:
+            breaker.record_failure()
+            if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError, ValueError)):
+                raise LedgerUnavailable(f'Ledger request failed: {e}') from e
+            raise
+    except LedgerUnavailable as e:
+        return _fallback(url, str(e))
+    finally:
+        if admitted:
+            bulkhead.release()
+    if status >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    if status != 200:
+        return _fallback(url, f'HTTP error: {status}', status)
+    _remember(url, data)
+    return data, False
+
+
+def snapshot():
+    """Return breaker and bulkhead state for every ledger host seen so far."""
+    with _guards_lock:
+        guards = dict(_guards)
+    return {
+        host: {**breaker.snapshot(), **bulkhead.snapshot()}
+        for host, (breaker, bulkhead) in guards.items()
+    }
@@ -0,0 +1,284 @@
+# utils/ledger_mirror.py
+"""Local mirror of the ledger products referenced by invoices and batches.
+
+Read paths call resolve(), which serves documents from the ledger_products
+table and only goes to the ledger for URLs that are not mirrored yet (or are
+older than LEDGER_MIRROR_MAX_AGE). sync() refreshes every referenced URL in
+the background; run it once from the command line with
+
+    python -m utils.ledger_mirror [--url URL ...] [--concurrency N]
+"""
+import argparse
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import requests
+from auth import query_db, pooled_connection, named_lock
+from utils import ledger_client
+from utils.json_encoding import dumps, loads
+from utils.ledger_client import LedgerError
+
+# Seconds between background syncs (0 disables the sync thread)
+LEDGER_SYNC_INTERVAL = int(os.environ.get('LEDGER_SYNC_INTERVAL', 300))
+# Concurrent ledger requests per sync, kept below LEDGER_MAX_CONCURRENCY so live reads still get slots
+LEDGER_SYNC_CONCURRENCY = int(os.environ.get('LEDGER_SYNC_CONCURRENCY', 4))
+# Mirrored documents older than this many seconds are re-fetched on read (0 never expires them)
+LEDGER_MIRROR_MAX_AGE = int(os.environ.get('LEDGER_MIRROR_MAX_AGE', 86400))
+
+SYNC_LOCK = 'ledger_mirror_sync'
+CHUNK_SIZE = 500
+
+# Counters of the last sync run by this process, reported by /api/system/stats
+last_sync = {}
+
+_local = threading.local()
+
+
+def url_hash(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def content_hash(data):
+    """Hash of a document's content, independent of key order."""
+    return hashlib.sha256(dumps(_sorted(data))).hexdigest()
+
+
+def _sorted(value):
+    if isinstance(value, dict):
+        return {key: _sorted(value[key]) for key in sorted(value)}
+    if isinstance(value, list):
+        return [_sorted(item) for item in value]
+    return value
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def lookup(urls):
+    """Mirrored rows for the given URLs as {url: {'data', 'synced_at'}}."""
+    rows = {}
+    for chunk in _chunks(urls):
+        found = query_db(
+            'SELECT url, data, synced_at FROM ledger_products WHERE url_hash IN ({})'.format(
+                ','.join(['%s'] * len(chunk))
+            ),
+            [url_hash(url) for url in chunk]
+        )
+        for row in found:
+            rows[row['url']] = {'data': loads(row['data']), 'synced_at': row['synced_at']}
+    return rows
+
+
+def store(documents, etags=None):
+    """Insert or replace mirrored documents given as {url: data}."""
+    if not documents:
+        return
+    etags = etags or {}
+    now = datetime.utcnow()
+    rows = [
+        (url_hash(url), url, dumps(data).decode('utf-8'), content_hash(data), etags.get(url), now, now)
+        for url, data in documents.items()
+    ]
+    with pooled_connection() as conn:
+        with conn.cursor() as cur:
+            cur.executemany(
+                'REPLACE INTO ledger_products (url_hash, url, data, content_hash, etag, synced_at, changed_at) '
+                'VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                rows
+            )
+        conn.commit()
+
+
+def _fetch_live(url):
+    try:
+        return ledger_client.get_json(url)
+    except LedgerError as e:
+        return e
+
+
+def resolve(urls):
+    """Ledger documents for `urls`, served from the mirror where possible.
+
+    Returns (documents, errors). documents maps url -> (data, stale, synced_at);
+    errors maps url -> LedgerError for URLs neither the mirror nor the ledger
+    could serve. Documents fetched live are written to the mirror.
+    """
+    urls = list(dict.fromkeys(url for url in urls if url))
+    documents, errors = {}, {}
+    if not urls:
+        return documents, errors
+
+    rows = lookup(urls)
+    cutoff = datetime.utcnow() - timedelta(seconds=LEDGER_MIRROR_MAX_AGE) if LEDGER_MIRROR_MAX_AGE else None
+    missing = []
+    for url in urls:
+        row = rows.get(url)
+        if row is not None and (cutoff is None or row['synced_at'] >= cutoff):
+            documents[url] = (row['data'], False, row['synced_at'])
+        else:
+            missing.append(url)
+
+    if missing:
+        fetched = {}
+        now = datetime.utcnow()
+        with ThreadPoolExecutor(max_workers=min(LEDGER_SYNC_CONCURRENCY, len(missing))) as executor:
+            for url, result in zip(missing, executor.map(_fetch_live, missing)):
+                if isinstance(result, LedgerError):
+                    if url in rows:
+                        # An expired mirror copy beats no data
+                        documents[url] = (rows[url]['data'], True, rows[url]['synced_at'])
+                    else:
+                        errors[url] = result
+                    continue
+                data, stale = result
+                documents[url] = (data, stale, None if stale else now)
+                if not stale:
+                    fetched[url] = data
+        try:
+            store(fetched)
+        except Exception as e:
+            print(f"[LEDGER MIRROR] Could not store {len(fetched)} documents: {str(e)}")
+    return documents, errors
+
+
+def freshness_headers(documents):
+    """X-Ledger-Synced-At header with the oldest sync time of the documents used."""
+    synced = [synced_at for _, _, synced_at in documents.values() if synced_at is not None]
+    if not synced:
+        return {}
+    return {'X-Ledger-Synced-At': min(synced).isoformat() + 'Z'}
+
+
+def referenced_urls():
+    """Every ledger URL referenced by invoices and batches, archived ones included."""
+    with pooled_connection() as conn:
+        with conn.cursor() as cur:
+            # Archived rows still feed product summaries, product metrics and include_archived reads
+            cur.execute(
+                'SELECT supplier_url AS url FROM invoices UNION SELECT information_url FROM batches '
+                'UNION SELECT supplier_url FROM invoices_archive UNION SELECT information_url FROM batches_archive'
+            )
+            return [row['url'] for row in cur.fetchall() if row['url']]
+
+
+def _session():
+    # requests.Session is not guaranteed to be thread-safe, keep one per sync thread
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def _check(url, known):
+    """Fetch one URL and classify it as ('changed', data, etag), ('unchanged', ...) or ('failed', error)."""
+    headers = {'If-None-Match': known['etag']} if known and known['etag'] else {}
+    try:
+        response = ledger_client.request('GET', url, session=_session(), headers=headers)
+    except LedgerError as e:
+        return 'failed', str(e), None
+    if response.status_code == 304 and known:
+        return 'unchanged', None, known['etag']
+    if response.status_code != 200:
+        return 'failed', f'HTTP error: {response.status_code}', None
+    try:
+        data = response.json()
+    except ValueError as e:
+        return 'failed', f'Invalid JSON: {e}', None
+    if known and known['content_hash'] == content_hash(data):
+        return 'unchanged', None, known['etag']
+    return 'changed', data, response.headers.get('ETag')
+
+
+def _sync_chunk(executor, urls, counts):
+    """Sync one chunk of URLs. No connection is held while the ledger is called."""
+    hashes = [url_hash(url) for url in urls]
+    with pooled_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                'SELECT url_hash, content_hash, etag FROM ledger_products WHERE url_hash IN ({})'.format(
+                    ','.join(['%s'] * len(hashes))
+                ),
+                hashes
+            )
+            known = {row['url_hash']: row for row in cur.fetchall()}
+
+    results = executor.map(lambda item: _check(item[0], known.get(item[1])), zip(urls, hashes))
+    changed, etags, unchanged = {}, {}, []
+    for url, digest, (status, data, etag) in zip(urls, hashes, results):
+        counts[status] += 1
+        if status == 'changed':
+            changed[url] = data
+            etags[url] = etag
+        elif status == 'unchanged':
+            unchanged.append(digest)
+        else:
+            print(f"[LEDGER MIRROR] Sync failed for {url}: {data}")
+
+    if unchanged:
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    'UPDATE ledger_products SET synced_at = %s WHERE url_hash IN ({})'.format(
+                        ','.join(['%s'] * len(unchanged))
+                    ),
+                    [datetime.utcnow()] + unchanged
+                )
+            conn.commit()
+    store(changed, etags)
+
+
+def sync(urls=None, concurrency=LEDGER_SYNC_CONCURRENCY):
+    """Refresh the mirror for `urls` (default: every referenced URL).
+
+    Unchanged documents, detected by ETag or content hash, only get their
+    synced_at bumped. Returns the counters, or None when another process is
+    already syncing.
+    """
+    started = time.perf_counter()
+    counts = {'changed': 0, 'unchanged': 0, 'failed': 0}
+    # One sync at a time across workers
+    with named_lock(SYNC_LOCK) as acquired:
+        if not acquired:
+            return None
+        urls = list(dict.fromkeys(urls if urls is not None else referenced_urls()))
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            for chunk in _chunks(urls):
+                _sync_chunk(executor, chunk, counts)
+
+    counts['urls'] = len(urls)
+    counts['seconds'] = round(time.perf_counter() - started, 3)
+    counts['finished_at'] = datetime.utcnow().isoformat() + 'Z'
+    last_sync.clear()
+    last_sync.update(counts)
+    print(f"[LEDGER MIRROR] Synced {len(urls)} URLs in {counts['seconds']}s: "
+          f"{counts['changed']} changed, {counts['unchanged']} unchanged, {counts['failed']} failed")
+    return counts
+
+
+def start_sync(interval=LEDGER_SYNC_INTERVAL):
+    """Run sync() every `interval` seconds in a daemon thread."""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                sync()
+            except Exception as e:
+                print(f"[LEDGER MIRROR] Sync error: {str(e)}")
+
+    thread = threading.Thread(target=run, name='ledger-mirror-sync', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sync the local mirror of ledger products')
+    parser.add_argument('--url', action='append', help='Only sync this URL (repeatable)')
+    parser.add_argument('--concurrency', type=int, default=LEDGER_SYNC_CONCURRENCY)
+    args = parser.parse_args()
+    if sync(args.url, args.concurrency) is None:
+        print('Another sync is already running')
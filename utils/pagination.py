@@ -0,0 +1,84 @@
+# utils/pagination.py
+import base64
+import json
+import os
+from datetime import datetime
+from flask import request
+from extensions import cache
+
+COUNT_CACHE_TIMEOUT = int(os.environ.get('COUNT_CACHE_TIMEOUT', 300))
+
+
+def encode_cursor(row):
+    """Opaque cursor pointing just after `row` in (created_at DESC, id DESC) order."""
+    created_at = row['created_at']
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat(' ')
+    raw = json.dumps([str(created_at), row['id']], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id) from a cursor; raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def page_params(default_per_page, max_per_page):
+    """Read `cursor` and `per_page` from the query string."""
+    per_page = request.args.get('per_page', default_per_page, type=int)
+    per_page = max(1, min(per_page, max_per_page))
+    cursor = request.args.get('cursor')
+    return (decode_cursor(cursor) if cursor else None), per_page
+
+
+def keyset_filter(cursor, prefix=''):
+    """WHERE condition and args selecting rows after the cursor.
+
+    Written out instead of a row comparison so MySQL uses a range scan on the
+    (created_at, id) index.
+    """
+    if cursor is None:
+        return '1 = 1', []
+    created_at, row_id = cursor
+    return (
+        f'({prefix}created_at < %s OR ({prefix}created_at = %s AND {prefix}id < %s))',
+        [created_at, created_at, row_id]
+    )
+
+
+def keyset_page(rows, per_page):
+    """Trim a page fetched with LIMIT per_page + 1 and return (rows, next_cursor)."""
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def cached_count(name, query, args=()):
+    """COUNT(*) result kept in the cache until invalidate_count(name) or the timeout."""
+    key = f'count:{name}'
+    total = cache.get(key)
+    if total is None:
+        from auth import query_db  # auth imports this module
+        total = query_db(query, args, one=True)['count']
+        cache.set(key, total, timeout=COUNT_CACHE_TIMEOUT)
+    return total
+
+
+def invalidate_count(name):
+    """Drop a cached total after rows were inserted or deleted."""
+    cache.delete(f'count:{name}')
+
+
+def pagination(per_page, total, next_cursor):
+    return {
+        'per_page': per_page,
+        'total': total,
+        'pages': (total + per_page - 1) // per_page,
+        'next_cursor': next_cursor
+    }
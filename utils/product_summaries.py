@@ -0,0 +1,124 @@
+# utils/product_summaries.py
+from datetime import datetime
+from auth import query_db, execute_db, transaction
+from utils import ledger_mirror, archive
+from utils.json_encoding import dumps, loads
+
+
+def supplier_names(urls):
+    """Distinct supplier names for the given ledger URLs and whether every URL resolved."""
+    urls = [url for url in urls if url]
+    documents, errors = ledger_mirror.resolve(urls)
+    names = {data.get('name') for data, _, _ in documents.values()} - {None}
+    return names, not errors
+
+
+def batch_supplier_names(url_lists):
+    """supplier_names for several batches' URLs, resolved together."""
+    url_lists = [[url for url in urls if url] for urls in url_lists]
+    documents, errors = ledger_mirror.resolve({url for urls in url_lists for url in urls})
+    results = []
+    for urls in url_lists:
+        names = {documents[url][0].get('name') for url in urls if url in documents} - {None}
+        results.append((names, not any(url in errors for url in urls)))
+    return results
+
+
+def _amount(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _save(product_id, batch_count, invoice_count, total_amount, names):
+    execute_db(
+        'REPLACE INTO product_summaries (product_id, batch_count, invoice_count, total_amount, supplier_names, updated_at) '
+        'VALUES (%s, %s, %s, %s, %s, %s)',
+        [product_id, batch_count, invoice_count, total_amount, dumps(sorted(names)).decode('utf-8'), datetime.utcnow()]
+    )
+
+
+def add_batch(product_id, invoices, names, names_complete, new_product):
+    """Fold a new batch into the product's summary. Call inside the CreateBatch transaction.
+
+    `names` are the batch's supplier names, resolved before the transaction so
+    no ledger I/O happens while it is open. If some could not be resolved, the
+    summary is dropped and rebuilt on the next read instead.
+    """
+    if not names_complete:
+        execute_db('DELETE FROM product_summaries WHERE product_id = %s', [product_id])
+        return
+    total = sum(_amount(invoice.get('totalAmount')) for invoice in invoices)
+    if new_product:
+        _save(product_id, 1, len(invoices), total, names)
+        return
+    summary = query_db(
+        'SELECT * FROM product_summaries WHERE product_id = %s FOR UPDATE', [product_id], one=True
+    )
+    if not summary:
+        # Product predates the summaries; the first read backfills it
+        return
+    _save(
+        product_id,
+        summary['batch_count'] + 1,
+        summary['invoice_count'] + len(invoices),
+        float(summary['total_amount']) + total,
+        set(loads(summary['supplier_names'])) | names
+    )
+
+
+def _supplier_urls(product_id):
+    batches = archive.source('batches', include_archived=True, alias='b')
+    invoices = archive.source('invoices', include_archived=True, alias='i')
+    rows = query_db(f'''
+        SELECT DISTINCT i.supplier_url
+        FROM {invoices}
+        JOIN {batches} ON i.batch_id = b.id
+        WHERE b.product_id = %s
+    ''', [product_id], primary=True)
+    return {row['supplier_url'] for row in rows}
+
+
+def _totals(product_id):
+    """Batch count, invoice count and total amount of a product, archived rows included."""
+    batches = archive.source('batches', include_archived=True, alias='b')
+    invoices = archive.source('invoices', include_archived=True, alias='i')
+    batch_count = query_db(
+        f'SELECT COUNT(*) AS count FROM {batches} WHERE b.product_id = %s', [product_id], one=True, primary=True
+    )['count']
+    totals = query_db(f'''
+        SELECT COUNT(*) AS invoice_count, COALESCE(SUM(i.total_amount), 0) AS total_amount
+        FROM {invoices}
+        JOIN {batches} ON i.batch_id = b.id
+        WHERE b.product_id = %s
+    ''', [product_id], one=True, primary=True)
+    return batch_count, totals['invoice_count'], float(totals['total_amount'])
+
+
+def rebuild(product_id):
+    """Recompute a product's summary from its batches and invoices, archived ones included, and store it.
+
+    Supplier names are resolved first; the counts are then read again and
+    stored in one transaction holding the product row, which CreateBatch also
+    locks when it inserts a batch (foreign key), so a batch committed meanwhile
+    is counted here or folded in by add_batch afterwards. If some supplier
+    names are missing the summary is returned without being stored, so the
+    next read rebuilds it.
+    """
+    urls = _supplier_urls(product_id)
+    names, names_complete = supplier_names(urls)
+    with transaction():
+        query_db('SELECT id FROM products WHERE id = %s FOR UPDATE', [product_id])
+        batch_count, invoice_count, total_amount = _totals(product_id)
+        # Suppliers of a batch added since the names were resolved are not among them
+        if not names_complete or _supplier_urls(product_id) - urls:
+            return {
+                'product_id': product_id,
+                'batch_count': batch_count,
+                'invoice_count': invoice_count,
+                'total_amount': total_amount,
+                'supplier_names': dumps(sorted(names)).decode('utf-8')
+            }
+        _save(product_id, batch_count, invoice_count, total_amount, names)
+        return query_db('SELECT * FROM product_summaries WHERE product_id = %s', [product_id], one=True)
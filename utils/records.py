@@ -0,0 +1,98 @@
+# utils/records.py
+"""Compact record types for parsed invoices and emission records.
+
+Hundreds of thousands of these can be alive in one /emissions response or
+upload job. As plain dicts every one of them carries a hash table of the
+same keys; these keep their values in __slots__ instead and are turned into
+JSON only when a response or row is written. orjson encodes the dataclasses
+natively; the stdlib encoder and ours go through to_dict().
+"""
+from dataclasses import dataclass, fields
+
+
+class Record:
+    """A __slots__ record that reads like a dict of its set fields.
+
+    Unset slots take no memory beyond their pointer and are left out of
+    to_dict(), so a record serializes like the dict it replaces.
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        data = {}
+        for name in self.__slots__:
+            value = getattr(self, name, None)
+            if value is not None:
+                data[name] = value
+        return data
+
+    def copy(self):
+        """A shallow copy, to add fields to a shared record without changing it."""
+        other = type(self)()
+        for name in self.__slots__:
+            if hasattr(self, name):
+                setattr(other, name, getattr(self, name))
+        return other
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None) if name in self.__slots__ else None
+        return default if value is None else value
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+@dataclass(slots=True)
+class EmissionRecord:
+    """One emission, water or energy record of an invoice row, as served by /emissions."""
+    name: object
+    originId: object
+    productName: object
+    description: str
+    organizationUnit: object
+    facility: object
+    provider: object
+    cost: float
+    costUnit: object
+    timestamp: object
+    consumptionStartDate: object
+    consumptionEndDate: object
+    transactionStartDate: object
+    transactionEndDate: object
+    emissionFactor: object
+    emissionFactorLibrary: object
+    waterTransactionType: object
+    dataQualityType: object
+    isStale: bool
+    quantity: float
+    quantityUnit: str
+    emissonSource: str
+    emissonCategory: str
+    emissonSubCategory: object
+    CO2E: float
+    CO2E_unit: str
+    isRenewable: object
+    fuelType: object
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in EMISSION_RECORD_FIELDS}
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+
+EMISSION_RECORD_FIELDS = tuple(field.name for field in fields(EmissionRecord))
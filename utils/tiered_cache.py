@@ -0,0 +1,257 @@
+# utils/tiered_cache.py
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from flask_caching.backends.base import BaseCache
+
+try:
+    import orjson
+except ImportError:  # optional dependency, fall back to the standard library
+    orjson = None
+
+# Serialized value header: format byte followed by compression byte
+_JSON = b'j'
+_JSON_TUPLE = b't'
+_PICKLE = b'p'
+_BYTES = b'b'
+_COMPRESSED = b'z'
+_PLAIN = b'-'
+
+
+def _json_dumps(value):
+    """Strict JSON encoding: raises TypeError for anything that would not round-trip."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def _json_loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class TieredCache(BaseCache):
+    """Two-tier cache: a size-bounded in-process LRU (L1) in front of a shared SQLite store (L2).
+
+    L2 runs in WAL mode so every worker process on the node shares it. JSON-able
+    values are stored as JSON instead of pickles, and values larger than
+    `compress_threshold` bytes are zlib-compressed. L1 holds the deserialized
+    objects, which callers must treat as read-only. L1 entries live at most
+    `l1_timeout` seconds, so a delete in another worker shows up within that window.
+    """
+
+    def __init__(self, path, default_timeout=300, threshold=500, l1_max_items=256,
+                 l1_max_bytes=64 * 1024 * 1024, l1_timeout=30, compress_threshold=4096,
+                 compress_level=3):
+        super().__init__(default_timeout=default_timeout)
+        self.path = path
+        self.threshold = threshold
+        self.l1_max_items = l1_max_items
+        self.l1_max_bytes = l1_max_bytes
+        self.l1_timeout = l1_timeout
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+        self._l1 = OrderedDict()  # key -> (expires_at, size, value)
+        self._l1_bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sets = 0
+        self._stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0, 'sets': 0}
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL NOT NULL, '
+            'stored REAL NOT NULL, value BLOB NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_stored ON cache (stored)')
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(
+            path=os.path.join(config['CACHE_DIR'], 'cache.sqlite3'),
+            threshold=config['CACHE_THRESHOLD'],
+            l1_max_items=config.get('CACHE_L1_MAX_ITEMS', 256),
+            l1_max_bytes=config.get('CACHE_L1_MAX_BYTES', 64 * 1024 * 1024),
+            l1_timeout=config.get('CACHE_L1_TIMEOUT', 30),
+            compress_threshold=config.get('CACHE_COMPRESS_THRESHOLD', 4096),
+        )
+        return cls(*args, **kwargs)
+
+    def _conn(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _expires_at(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout else 0
+
+    # Serialization
+
+    def dumps(self, value):
+        """Serialize a value: JSON when possible, pickle otherwise, compressed when large."""
+        if type(value) is bytes:
+            # Stored verbatim; these are usually already compressed response bodies
+            return _BYTES + _PLAIN + value
+        try:
+            if type(value) is tuple:
+                # Flask views return (body, status) tuples; keep them tuples on the way back
+                kind, data = _JSON_TUPLE, _json_dumps(list(value))
+            else:
+                kind, data = _JSON, _json_dumps(value)
+        except TypeError:
+            kind, data = _PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) >= self.compress_threshold:
+            return kind + _COMPRESSED + zlib.compress(data, self.compress_level)
+        return kind + _PLAIN + data
+
+    def loads(self, blob):
+        kind, compression, data = blob[:1], blob[1:2], blob[2:]
+        if compression == _COMPRESSED:
+            data = zlib.decompress(data)
+        if kind == _BYTES:
+            return data
+        if kind == _PICKLE:
+            return pickle.loads(data)
+        value = _json_loads(data)
+        return tuple(value) if kind == _JSON_TUPLE else value
+
+    # L1
+
+    def _l1_get(self, key):
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= time.time():
+                self._l1_pop(key)
+                return False, None
+            self._l1.move_to_end(key)
+            return True, entry[2]
+
+    def _l1_set(self, key, value, size, expires):
+        l1_expires = time.time() + self.l1_timeout
+        expires = min(expires, l1_expires) if expires else l1_expires
+        with self._lock:
+            self._l1_pop(key)
+            if size > self.l1_max_bytes:
+                return
+            self._l1[key] = (expires, size, value)
+            self._l1_bytes += size
+            while len(self._l1) > self.l1_max_items or self._l1_bytes > self.l1_max_bytes:
+                _, (_, evicted_size, _) = self._l1.popitem(last=False)
+                self._l1_bytes -= evicted_size
+
+    def _l1_pop(self, key):
+        entry = self._l1.pop(key, None)
+        if entry is not None:
+            self._l1_bytes -= entry[1]
+
+    # Cache API
+
+    def get(self, key):
+        found, value = self._l1_get(key)
+        if found:
+            self._count('l1_hits')
+            return value
+        row = self._conn().execute(
+            'SELECT expires, value FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or (row[0] and row[0] <= time.time()):
+            self._count('misses')
+            return None
+        expires, blob = row
+        value = self.loads(blob)
+        self._l1_set(key, value, len(blob), expires)
+        self._count('l2_hits')
+        return value
+
+    def set(self, key, value, timeout=None):
+        expires = self._expires_at(timeout)
+        blob = self.dumps(value)
+        self._conn().execute(
+            'INSERT OR REPLACE INTO cache (key, expires, stored, value) VALUES (?, ?, ?, ?)',
+            (key, expires, time.time(), blob)
+        )
+        self._l1_set(key, value, len(blob), expires)
+        self._count('sets')
+        self._maybe_prune()
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def has(self, key):
+        found, _ = self._l1_get(key)
+        if found:
+            return True
+        row = self._conn().execute('SELECT expires FROM cache WHERE key = ?', (key,)).fetchone()
+        return row is not None and (not row[0] or row[0] > time.time())
+
+    def delete(self, key):
+        with self._lock:
+            self._l1_pop(key)
+        return self._conn().execute('DELETE FROM cache WHERE key = ?', (key,)).rowcount > 0
+
+    def delete_prefix(self, prefix):
+        """Delete every key starting with `prefix`, e.g. all query strings of a cached view."""
+        with self._lock:
+            for key in [key for key in self._l1 if key.startswith(prefix)]:
+                self._l1_pop(key)
+        return self._conn().execute(
+            'DELETE FROM cache WHERE substr(key, 1, ?) = ?', (len(prefix), prefix)
+        ).rowcount
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+            self._l1_bytes = 0
+        self._conn().execute('DELETE FROM cache')
+        return True
+
+    def _maybe_prune(self):
+        """Every so often drop expired rows and trim L2 to `threshold` entries."""
+        with self._lock:
+            self._sets += 1
+            if self._sets % 50:
+                return
+        conn = self._conn()
+        conn.execute('DELETE FROM cache WHERE expires != 0 AND expires <= ?', (time.time(),))
+        conn.execute(
+            'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY stored DESC LIMIT -1 OFFSET ?)',
+            (self.threshold,)
+        )
+
+    # Metrics
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Hit counts and ratios per tier for this worker process."""
+        with self._lock:
+            stats = dict(self._stats)
+            l1_items, l1_bytes = len(self._l1), self._l1_bytes
+        lookups = stats['l1_hits'] + stats['l2_hits'] + stats['misses']
+        l2_lookups = stats['l2_hits'] + stats['misses']
+        stats.update(
+            l1_items=l1_items,
+            l1_bytes=l1_bytes,
+            l1_hit_ratio=round(stats['l1_hits'] / lookups, 4) if lookups else None,
+            l2_hit_ratio=round(stats['l2_hits'] / l2_lookups, 4) if l2_lookups else None,
+            overall_hit_ratio=round((stats['l1_hits'] + stats['l2_hits']) / lookups, 4) if lookups else None,
+        )
+        return stats
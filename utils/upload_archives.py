@@ -0,0 +1,144 @@
+# utils/upload_archives.py
+"""Uploaded invoice files, sent one by one or packed in zip and tar.gz archives.
+
+Archives are copied to a temporary file and their members are read one at a
+time each time the upload is iterated, so an archive of thousands of invoices
+is never unpacked in memory or on disk.
+"""
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+import zlib
+
+# Largest uncompressed archive member, in bytes
+ARCHIVE_MAX_MEMBER_BYTES = int(os.environ.get('ARCHIVE_MAX_MEMBER_BYTES', 10 * 1024 * 1024))
+# Most XML files in one upload, archive members included
+UPLOAD_MAX_FILES = int(os.environ.get('UPLOAD_MAX_FILES', 20000))
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar.gz', '.tgz')
+# Longest filename stored in transaction_files
+FILENAME_LENGTH = 255
+# Raised by zipfile and tarfile for corrupt or truncated archives
+ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError, RuntimeError, OSError)
+
+
+class UploadError(ValueError):
+    """An uploaded file or archive that cannot be read or is over the limits."""
+
+
+class UploadFiles:
+    """The XML files of an upload, as (filename, content) pairs in upload order."""
+
+    def __init__(self):
+        self._parts = []  # (filename, content, archive path); content is None for archives
+
+    def add(self, file):
+        """Add a multipart file. Returns False for files that are neither XML nor an archive."""
+        name = file.filename or ''
+        if name.lower().endswith('.xml'):
+            self._parts.append((name, file.read(), None))
+            return True
+        if name.lower().endswith(ARCHIVE_SUFFIXES):
+            # The request's own spool is gone once the request returns, the scheduler reads this copy
+            fd, path = tempfile.mkstemp(prefix='invoices-', suffix=os.path.splitext(name)[1])
+            with os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(file.stream, out)
+            self._parts.append((name, None, path))
+            return True
+        return False
+
+    def __bool__(self):
+        return bool(self._parts)
+
+    def __iter__(self):
+        return self.select()
+
+    def count(self, limit=UPLOAD_MAX_FILES):
+        """Number of XML files in the upload, up to limit + 1, without reading any archive member.
+
+        Zip members are counted from the central directory, tar.gz members from
+        their headers.
+        """
+        count = 0
+        for name, _, path in self._parts:
+            for _ in ([None] if path is None else _members(name, path)):
+                count += 1
+                if count > limit:
+                    return count
+        return count
+
+    def select(self, indices=None):
+        """(filename, content) of the files at `indices` of the upload, all of them by default.
+
+        Zip members that are not selected are skipped without being read; tar.gz
+        members are still decompressed, the stream cannot seek past them.
+        """
+        count = 0
+        for name, content, path in self._parts:
+            for filename, load in ([(name, lambda: content)] if path is None else _members(name, path)):
+                count += 1
+                if count > UPLOAD_MAX_FILES:
+                    raise UploadError(f'At most {UPLOAD_MAX_FILES} XML files per upload')
+                if indices is not None and count - 1 not in indices:
+                    continue
+                try:
+                    data = load()
+                except ARCHIVE_ERRORS as e:
+                    raise UploadError(f'{name} is not a readable archive: {str(e)}')
+                try:
+                    yield filename, data.decode('utf-8')
+                except UnicodeDecodeError:
+                    raise UploadError(f'{filename} is not UTF-8 encoded')
+
+    def close(self):
+        """Remove the archives' temporary files."""
+        for _, _, path in self._parts:
+            if path is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def _members(name, path):
+    """(filename, load) of the XML members of an archive; load() reads the current member's bytes.
+
+    Members are visited one at a time, and load() is only valid until the
+    next member is reached.
+    """
+    def member_name(member):
+        return f'{name}/{member}'[-FILENAME_LENGTH:]
+
+    def too_large(member):
+        return UploadError(f'{member_name(member)} is larger than {ARCHIVE_MAX_MEMBER_BYTES} bytes')
+
+    try:
+        if name.lower().endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith('.xml'):
+                        continue
+                    if info.file_size > ARCHIVE_MAX_MEMBER_BYTES:
+                        raise too_large(info.filename)
+
+                    def load(info=info):
+                        with archive.open(info) as member:
+                            # The size in the header is not trusted
+                            data = member.read(ARCHIVE_MAX_MEMBER_BYTES + 1)
+                        if len(data) > ARCHIVE_MAX_MEMBER_BYTES:
+                            raise too_large(info.filename)
+                        return data
+                    yield member_name(info.filename), load
+        else:
+            # Stream mode reads the gzip once from start to end, without seeking
+            with tarfile.open(path, 'r|gz') as archive:
+                for info in archive:
+                    if not info.isfile() or not info.name.lower().endswith('.xml'):
+                        continue
+                    if info.size > ARCHIVE_MAX_MEMBER_BYTES:
+                        raise too_large(info.name)
+                    yield member_name(info.name), lambda info=info: archive.extractfile(info).read()
+    except ARCHIVE_ERRORS as e:
+        raise UploadError(f'{name} is not a readable archive: {str(e)}')
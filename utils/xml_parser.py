@@ -1,38 +1,75 @@
 # utils/xml_parser.py
 import lxml.etree as ET  # Use lxml instead of the standard library
 import asyncio
+import os
 from utils.helpers import fetch_url_data
 from functools import lru_cache
+from utils.records import Record
+
+FINVOICE_NS = 'http://www.finvoice.fi/Finvoice'
+
+# Fields extracted from each section of the document; what CreateBatch and the frontend read
+PROJECTION = {
+    'MessageTransmissionDetails': ('MessageIdentifier', 'MessageTimeStamp'),
+    'SellerPartyDetails': ('SellerPartyIdentifier', 'SellerOrganisationName'),
+    'BuyerPartyDetails': ('BuyerPartyIdentifier', 'BuyerOrganisationName'),
+    'InvoiceDetails': (
+        'InvoiceTypeCode', 'InvoiceNumber', 'InvoiceDate', 'CurrencyIdentifier',
+        'InvoiceTotalVatExcludedAmount', 'InvoiceTotalVatAmount', 'InvoiceTotalVatIncludedAmount'
+    ),
+}
+# Fields extracted from every InvoiceRow
+ROW_PROJECTION = (
+    'ArticleIdentifier', 'ArticleName', 'DeliveredQuantity', 'UnitPriceAmount',
+    'RowVatRatePercent', 'RowAmount', 'SpecificationDetails', 'Other'
+)
+# 'projected' extracts the fields above, 'full' converts every element of the document
+XML_EXTRACTION = os.environ.get('XML_EXTRACTION', 'projected')
+
+
+class InvoiceRow(Record):
+    """The ROW_PROJECTION fields of an InvoiceRow."""
+    __slots__ = ROW_PROJECTION
+
+
+class ParsedInvoice(Record):
+    """The PROJECTION sections of an invoice, its rows and the ledger data added by process_xml_file."""
+    __slots__ = tuple(PROJECTION) + ('InvoiceRows', 'other_url', 'sustainabilityMetrics', 'sustainabilityMetricsStale')
+
+
+def strip_namespace(tag):
+    return tag.split('}', 1)[1] if '}' in tag else tag
+
+
+def process_element(element):
+    """Convert an element to nested dicts of its children's text."""
+    data = {}
+    for child in element:
+        tag = strip_namespace(child.tag)
+        if list(child):
+            data[tag] = process_element(child)
+        else:
+            data[tag] = child.text.strip() if child.text else ''
+    return data
+
 
 @lru_cache(maxsize=128)
 def xml_to_json(xml_content):
     """Convert Finvoice XML content to JSON with caching."""
     try:
         # Define the Finvoice namespace
-        namespaces = {'fin': 'http://www.finvoice.fi/Finvoice'}
+        namespaces = {'fin': FINVOICE_NS}
 
         # Parse the XML content - use faster lxml parser
         root = ET.fromstring(xml_content.encode('utf-8'))
 
-        # Helper function to strip namespace
-        def strip_namespace(tag):
-            return tag.split('}', 1)[1] if '}' in tag else tag
-
-        # Recursive function to process elements
-        def process_element(element):
-            data = {}
-            for child in element:
-                tag = strip_namespace(child.tag)
-                if list(child):
-                    data[tag] = process_element(child)
-                else:
-                    data[tag] = child.text.strip() if child.text else ''
-            return data
-
         result = {}
         for child in root:
             tag = strip_namespace(child.tag)
             if tag == 'InvoiceRow':
+                # All InvoiceRow elements are handled on the first one
+                if 'InvoiceRows' in result:
+                    continue
                 # Process all InvoiceRow elements
                 invoice_rows = []
                 for invoice_row in root.findall('fin:InvoiceRow', namespaces):
@@ -58,14 +95,105 @@ def xml_to_json(xml_content):
         return {'error': f'XML parsing error: {str(e)}'}
 
 
-async def process_xml_file(xml_content):
+def _tags(name):
+    """The tags lxml reports for an element, in the Finvoice namespace or in none."""
+    return ('{%s}%s' % (FINVOICE_NS, name), name)
+
+
+class ExtractionPlan:
+    """A projection compiled to lookups on lxml's namespaced tags.
+
+    Only the listed fields are read, so no tag is split and no dict is built
+    for the sections left out. The extracted values are the same as in the
+    full conversion.
+    """
+
+    def __init__(self):
+        # The fields are the slots of ParsedInvoice and InvoiceRow, so the plan follows PROJECTION
+        self.sections = {}
+        for section, fields in PROJECTION.items():
+            compiled = {tag: field for field in fields for tag in _tags(field)}
+            for tag in _tags(section):
+                self.sections[tag] = (section, compiled)
+        self.row_tags = frozenset(_tags('InvoiceRow'))
+        self.row_fields = {tag: field for field in ROW_PROJECTION for tag in _tags(field)}
+        self.spec_tags = frozenset(_tags('SpecificationFreeText'))
+
+    def extract(self, root):
+        result = ParsedInvoice()
+        invoice_rows = None
+        for child in root:
+            tag = child.tag
+            if tag in self.row_tags:
+                if invoice_rows is None:
+                    invoice_rows = result.InvoiceRows = []
+                row_data = InvoiceRow()
+                for elem in child:
+                    field = self.row_fields.get(elem.tag)
+                    if field is None:
+                        continue
+                    if field == 'SpecificationDetails':
+                        row_data.SpecificationDetails = [
+                            spec.text.strip() for spec in elem if spec.tag in self.spec_tags and spec.text
+                        ]
+                    else:
+                        # Every .text access builds a new string
+                        text = elem.text
+                        text = text.strip() if text else ''
+                        setattr(row_data, field, text)
+                        if field == 'Other':
+                            result.other_url = text
+                invoice_rows.append(row_data)
+                continue
+
+            section = self.sections.get(tag)
+            if section is None:
+                continue
+            name, fields = section
+            data = {}
+            for elem in child:
+                field = fields.get(elem.tag)
+                if field is not None:
+                    # A selected element with children is converted whole
+                    if len(elem):
+                        data[field] = process_element(elem)
+                    else:
+                        text = elem.text
+                        data[field] = text.strip() if text else ''
+            setattr(result, name, data)
+        return result
+
+
+DEFAULT_PLAN = ExtractionPlan()
+
+
+@lru_cache(maxsize=128)
+def extract_invoice(xml_content):
+    """Extract the PROJECTION fields of Finvoice XML content into a ParsedInvoice, with caching."""
+    try:
+        root = ET.fromstring(xml_content.encode('utf-8'))
+        return DEFAULT_PLAN.extract(root)
+    except Exception as e:
+        return {'error': f'XML parsing error: {str(e)}'}
+
+
+def parse_invoice(xml_content, full=None):
+    """The projected fields of a document, or every element with `full` (default: XML_EXTRACTION)."""
+    if full is None:
+        full = XML_EXTRACTION == 'full'
+    return xml_to_json(xml_content) if full else extract_invoice(xml_content)
+
+
+async def process_xml_file(xml_content, full=None):
     """Process a single XML file."""
     try:
         # Convert XML to JSON
-        json_data = xml_to_json(xml_content)
+        json_data = parse_invoice(xml_content, full)
         
         # If there's an 'other_url', fetch data from it
         if 'other_url' in json_data and 'error' not in json_data:
+            # extract_invoice results are cached and shared; the ledger data goes on this upload's copy
+            json_data = json_data.copy()
             sustainability_data = await fetch_url_data(json_data['other_url'])
             
             # Add sustainability metrics to JSON data
@@ -73,6 +201,8 @@ async def process_xml_file(xml_content):
                 # First extract sustainability_metrics from the response if available
                 if 'sustainability_metrics' in sustainability_data:
                     json_data['sustainabilityMetrics'] = sustainability_data['sustainability_metrics']
+                    if sustainability_data.get('stale'):
+                        json_data['sustainabilityMetricsStale'] = True
                 else:
                     # If no sustainability metrics, add error
                     json_data['sustainabilityMetrics'] = {'error': 'No sustainability metrics found'}